@@ -7,6 +7,107 @@ class Settings(BaseSettings):
     openweathermap_api_key: str
     ai_api_key: str = ""  # Optional: for AI chat assistant
     model_path: str = "models/crop_disease_model.onnx"
+    model_variant: str = ""  # e.g. "int8" or "fp16" from inference_config.json variants
+    
+    # Versioned model directories (ONNX + class_names.json + inference_config.json);
+    # the ACTIVE file in model_registry_dir names the one to serve, else model_path
+    model_registry_dir: str = "models/versions"
+    model_watch_interval: float = 10.0  # seconds between pointer file checks, 0 disables
+    
+    # Shadow scoring of a candidate version on a sample of traffic
+    shadow_model: str = ""
+    shadow_sample_rate: float = 0.0
+    shadow_max_pending: int = 8
+    
+    # Token for /api/admin (X-Admin-Token header); empty disables the admin API
+    admin_token: str = ""
+    
+    # Test-time augmentation: "full" or "adaptive" (early exit on clear-cut scans).
+    # "full" (as EfficientNetInference) until adaptive is validated against full TTA accuracy
+    tta_mode: str = "full"
+    tta_early_exit_confidence: float = 0.95
+    tta_early_exit_margin: float = 0.90
+    
+    # Cascade: a small student model (file or version directory) answers first and
+    # escalates to the full model with TTA when unsure; 0 = calibrated thresholds
+    cascade_student_model: str = ""
+    cascade_confidence: float = 0.0
+    cascade_margin: float = 0.0
+    
+    # Shared OpenWeatherMap client (pooled keep-alive connections)
+    weather_timeout: float = 5.0  # seconds an upstream request may run (in the background past the budget)
+    weather_latency_budget: float = 1.5  # seconds a request waits for upstream before using cached/default weather
+    weather_breaker_failures: int = 5  # consecutive failed or over-budget calls that open the circuit
+    weather_breaker_reset: float = 30.0  # seconds the circuit stays open before a trial call
+    weather_pool_size: int = 20
+    weather_dns_cache_ttl: int = 300  # seconds
+    weather_keepalive_timeout: float = 30.0  # seconds an idle connection is kept
+    
+    # Weather cache per geohash cell (precision 5 = ~4.9 km cells; ttl 0 disables it)
+    weather_cache_precision: int = 5
+    weather_cache_ttl: float = 600.0  # seconds an observation is fresh
+    weather_cache_stale_ttl: float = 3600.0  # further seconds it's served while refreshing
+    weather_cache_size: int = 4096  # cells
+    weather_forecast_ttl: float = 10800.0  # seconds a cell's 5-day forecast is reused
+    
+    # Background refresh of cells with recent traffic (interval or rate 0 disables it)
+    weather_prefetch_interval: float = 60.0  # seconds between cycles
+    weather_prefetch_rate: float = 0.5  # max upstream calls per second
+    weather_prefetch_window: float = 10800.0  # seconds a cell stays active after a lookup
+    weather_prefetch_max_cells: int = 200  # per cycle
+    
+    # Regional risk heatmap (/api/risk/heatmap) over cached weather cells
+    risk_heatmap_max_cells: int = 2500  # weather cells per request
+    risk_heatmap_max_fetch: int = 8  # uncached cells fetched per request (the rest in the background)
+    risk_heatmap_cache_size: int = 256  # areas/tiles
+    risk_heatmap_fill_rate: float = 0.5  # max upstream calls per second for background cell fills
+    risk_heatmap_backlog: int = 500  # cells waiting for a background fill
+    
+    # Cross-request micro-batching of inference calls
+    inference_batching: bool = True
+    inference_max_batch_size: int = 32  # images (TTA variants) per session.run
+    inference_max_wait_ms: float = 5.0
+    
+    # Worker pool for decoding and ONNX execution ("thread" or "process")
+    inference_executor: str = "thread"
+    inference_workers: int = 2  # also the number of micro-batches scored at once
+    inference_max_pending: int = 64
+    
+    # ONNX Runtime session options
+    ort_intra_op_threads: int = 0  # 0 = CPU cores / inference_workers
+    ort_inter_op_threads: int = 0  # 0 = ORT default
+    ort_execution_mode: str = "sequential"  # "sequential" or "parallel"
+    ort_graph_optimization: str = "all"  # "disable", "basic", "extended" or "all"
+    ort_enable_mem_arena: bool = True
+    ort_enable_mem_pattern: bool = True
+    ort_optimized_model_dir: str = "models/.ort_cache"  # empty disables the optimized graph cache
+    
+    # Drone orthomosaic tiling (/api/drone/mosaic)
+    mosaic_tile_size: int = 520  # source pixels per tile side
+    mosaic_max_upload_mb: int = 2048
+    mosaic_max_pixels: int = 1_000_000_000
+    mosaic_gdal_cache_mb: int = 32  # GDAL block cache (rows already read)
+    mosaic_max_concurrent: int = 1
+    
+    # Bulk field surveys (/api/survey): ZIPs or batches of geotagged photos
+    survey_max_upload_mb: int = 1024
+    survey_max_files: int = 2000
+    survey_max_image_mb: int = 25
+    survey_concurrency: int = 16  # photos decoding/scoring at once
+    survey_weather_cell_deg: float = 0.05  # one weather lookup per grid cell
+    survey_insert_batch: int = 100
+    
+    # Background jobs (/api/jobs): state lives in MongoDB, or in jobs_dir without it;
+    # uploads are kept in jobs_dir until the job finishes. Without MongoDB (or with
+    # job_store_uploads off) jobs only resume after a restart if jobs_dir persists.
+    jobs_dir: str = "data/jobs"
+    job_store_uploads: bool = True  # also keep uploads in MongoDB (GridFS) while the job runs
+    job_workers: int = 1  # jobs processed at once
+    job_progress_interval: float = 1.0  # seconds between persisted progress updates
+    
+    # Content-addressed prediction cache (0 entries disables it)
+    prediction_cache_size: int = 1024
+    prediction_cache_ttl: int = 3600  # seconds
     
     class Config:
         env_file = ".env"
@@ -1,21 +1,55 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from contextlib import asynccontextmanager
+import asyncio
 from pathlib import Path
 import os
 from app.config import get_settings
 from app.services.database import Database
+from app.services.batching import get_batcher_stats, shutdown_batcher
+from app.services.executor import get_executor_stats, shutdown_executor
+from app.services.inference import get_cascade_stats
+from app.services.jobs import get_job_queue, shutdown_job_queue
+from app.services.prediction_cache import get_prediction_cache
+from app.services.model_registry import get_model_registry, shutdown_model_registry
+from app.services.risk_heatmap import get_risk_heatmap, shutdown_risk_heatmap
+from app.services.warmup import Readiness
+from app.services.weather_service import get_weather_service, shutdown_weather_service
+from app.services.weather_prefetch import get_weather_prefetcher, shutdown_weather_prefetcher
 from app.routes.diagnosis import router as diagnosis_router
 from app.routes.chat import router as chat_router
+from app.routes.admin import router as admin_router
+from app.routes.drone import router as drone_router
+from app.routes.survey import router as survey_router
+from app.routes.jobs import router as jobs_router
+from app.routes.risk import router as risk_router
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     settings = get_settings()
     await Database.connect(settings.mongodb_uri)
+    # Warm the model in the background; /ready reports not-ready until it's done
+    warmup_task = asyncio.create_task(get_model_registry().start())
+    # Resumes jobs left unfinished by the last shutdown
+    await get_job_queue().start()
+    get_weather_prefetcher().start()
     yield
+    # Let the warm-up unwind before the registry and executor it runs on go away
+    warmup_task.cancel()
+    try:
+        await warmup_task
+    except asyncio.CancelledError:
+        pass
+    await shutdown_job_queue()
+    await shutdown_model_registry()
+    await shutdown_batcher()
+    shutdown_executor()
+    await shutdown_weather_prefetcher()
+    await shutdown_risk_heatmap()
+    await shutdown_weather_service()
     await Database.disconnect()
 
 
@@ -35,6 +69,11 @@ app.add_middleware(
 
 app.include_router(diagnosis_router)
 app.include_router(chat_router)
+app.include_router(admin_router)
+app.include_router(drone_router)
+app.include_router(survey_router)
+app.include_router(jobs_router)
+app.include_router(risk_router)
 
 
 @app.get("/health")
@@ -42,6 +81,27 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    status = Readiness.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "inference_batching": get_batcher_stats(),
+        "inference_executor": get_executor_stats(),
+        "prediction_cache": get_prediction_cache().stats(),
+        "model_registry": get_model_registry().stats(),
+        "inference_cascade": get_cascade_stats(get_model_registry().active_path),
+        "jobs": get_job_queue().stats(),
+        "weather": get_weather_service().stats(),
+        "weather_prefetch": get_weather_prefetcher().stats(),
+        "risk_heatmap": get_risk_heatmap().stats()
+    }
+
+
 # Serve frontend static files in production
 FRONTEND_BUILD = Path(__file__).parent.parent.parent / "frontend" / "dist"
 if FRONTEND_BUILD.exists():
@@ -13,6 +13,7 @@ class WeatherData(BaseModel):
     temperature: float
     description: str
     wind_speed: float
+    source: Optional[str] = None  # live, cache, stale, default or demo
 
 
 class PredictionResult(BaseModel):
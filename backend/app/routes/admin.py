@@ -0,0 +1,62 @@
+"""
+AgroSentinel Admin API Routes
+Model registry management: hot swaps and shadow scoring
+"""
+
+import hmac
+from fastapi import APIRouter, Depends, Header, HTTPException
+from pydantic import BaseModel
+from typing import Optional
+from app.config import get_settings
+from app.services.model_registry import get_model_registry
+
+
+def require_admin(x_admin_token: str = Header("")):
+    """Admin endpoints need ADMIN_TOKEN configured and sent as X-Admin-Token"""
+    token = get_settings().admin_token
+    if not token:
+        raise HTTPException(403, "Admin API is disabled (set ADMIN_TOKEN to enable it)")
+    if not hmac.compare_digest(x_admin_token.encode(), token.encode()):
+        raise HTTPException(401, "Invalid admin token")
+
+
+router = APIRouter(prefix="/api/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+
+class ActivateModelRequest(BaseModel):
+    version: str
+
+
+class ShadowModelRequest(BaseModel):
+    version: Optional[str] = None  # None stops shadow scoring
+    sample_rate: Optional[float] = None
+
+
+@router.get("/models")
+async def list_models():
+    """Available versions, the active model and shadow agreement"""
+    return get_model_registry().stats()
+
+
+@router.post("/models/activate")
+async def activate_model(request: ActivateModelRequest):
+    """Load, warm and atomically switch to another model version"""
+    registry = get_model_registry()
+    try:
+        await registry.activate(request.version)
+    except ValueError as e:
+        raise HTTPException(404, str(e))
+    except Exception as e:
+        raise HTTPException(500, f"Model activation failed: {str(e)}")
+    return registry.stats()
+
+
+@router.post("/models/shadow")
+async def set_shadow_model(request: ShadowModelRequest):
+    """Choose the candidate version scored in the background on sampled traffic"""
+    registry = get_model_registry()
+    try:
+        await registry.set_candidate(request.version, request.sample_rate)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return registry.stats()
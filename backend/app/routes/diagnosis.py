@@ -1,7 +1,7 @@
 from fastapi import APIRouter, File, UploadFile, HTTPException, Query
 from app.config import get_settings
-from app.services.inference import get_inference
-from app.services.weather_service import WeatherService
+from app.services.prediction import run_prediction
+from app.services.weather_service import get_weather_service
 from app.services.risk_engine import RiskEngine
 from app.services.database import Database
 from app.services.disease_data import REMEDIES, DISEASE_CLASSES, get_disease_info
@@ -36,8 +36,7 @@ async def predict_disease(
                 raise HTTPException(400, "File must be an image")
         
         image_bytes = await file.read()
-        inference = get_inference(settings.model_path)
-        disease, confidence, top_predictions, is_confident = inference.predict(image_bytes)
+        disease, confidence, top_predictions, is_confident, tta_variants = await run_prediction(image_bytes)
         
         disease_info = get_disease_info(disease)
         
@@ -50,7 +49,8 @@ async def predict_disease(
             "is_healthy": disease_info["is_healthy"],
             "severity": disease_info["severity"],
             "top_predictions": top_predictions[:3] if top_predictions else [],
-            "is_confident": is_confident
+            "is_confident": is_confident,
+            "tta_variants": tta_variants
         }
         
         # Add warning if not confident
@@ -77,13 +77,11 @@ async def analyze_with_risk(
         raise HTTPException(400, "File must be an image")
     
     image_bytes = await file.read()
-    inference = get_inference(settings.model_path)
-    disease, confidence, top_predictions, is_confident = inference.predict(image_bytes)
+    disease, confidence, top_predictions, is_confident, tta_variants = await run_prediction(image_bytes)
     
     disease_info = get_disease_info(disease)
     
-    weather_service = WeatherService(settings.openweathermap_api_key)
-    weather = await weather_service.get_weather(latitude, longitude)
+    weather = await get_weather_service().get_weather(latitude, longitude)
     
     risk_score, risk_level = RiskEngine.calculate_risk(disease, confidence, weather)
     
@@ -111,20 +109,21 @@ async def analyze_with_risk(
         "is_healthy": disease_info["is_healthy"],
         "severity": disease_info["severity"],
         "weather": weather,
+        "weather_source": weather.source,
         "risk_score": risk_score,
         "risk_level": risk_level,
         "risk_level_display": get_risk_level_name(risk_level, lang),
         "treatment": disease_info["treatment"],
         "remedy": remedy,
         "is_confident": is_confident,
+        "tta_variants": tta_variants,
         "warning": None if is_confident else "Low confidence prediction. Results may be inaccurate."
     }
 
 
 @router.get("/weather")
 async def get_weather(latitude: float = Query(...), longitude: float = Query(...)):
-    weather_service = WeatherService(settings.openweathermap_api_key)
-    return await weather_service.get_weather(latitude, longitude)
+    return await get_weather_service().get_weather(latitude, longitude)
 
 
 @router.get("/history/user/{user_id}")
@@ -0,0 +1,79 @@
+"""
+AgroSentinel Drone API Routes
+Per-tile disease maps for drone orthomosaics
+"""
+
+import asyncio
+import os
+from fastapi import APIRouter, File, UploadFile, HTTPException, Query
+from typing import Optional
+from app.config import get_settings
+from app.services.batching import get_batcher
+from app.services.inference import get_inference
+from app.services.model_registry import get_model_registry
+from app.services.mosaic import analyze_mosaic
+from app.services.uploads import save_upload
+
+router = APIRouter(prefix="/api/drone", tags=["Drone"])
+
+# One mosaic at a time by default - each holds a couple of tile rows in memory
+_mosaic_slots: asyncio.Semaphore | None = None
+
+def get_mosaic_slots() -> asyncio.Semaphore:
+    global _mosaic_slots
+    if _mosaic_slots is None:
+        _mosaic_slots = asyncio.Semaphore(get_settings().mosaic_max_concurrent)
+    return _mosaic_slots
+
+
+@router.post("/mosaic")
+async def analyze_orthomosaic(
+    file: UploadFile = File(...),
+    tile_size: Optional[int] = Query(None, ge=64, le=4096, description="Tile side in source pixels"),
+    north: Optional[float] = Query(None, description="Latitude of the top edge (non-GeoTIFF uploads)"),
+    south: Optional[float] = Query(None, description="Latitude of the bottom edge"),
+    east: Optional[float] = Query(None, description="Longitude of the right edge"),
+    west: Optional[float] = Query(None, description="Longitude of the left edge")
+):
+    """
+    Score a drone orthomosaic (GeoTIFF, or JPEG/PNG/TIFF with explicit bounds)
+    tile by tile and return a per-tile disease grid with lat/lon bounds
+    """
+    settings = get_settings()
+    bounds = None
+    edges = (north, south, east, west)
+    if any(edge is not None for edge in edges):
+        if any(edge is None for edge in edges):
+            raise HTTPException(400, "Give all of north, south, east and west, or none")
+        if north <= south or east <= west:
+            raise HTTPException(400, "Bounds must satisfy north > south and east > west")
+        bounds = {"north": north, "south": south, "east": east, "west": west}
+    
+    model_path = get_model_registry().active_path
+    inference = await asyncio.to_thread(get_inference, model_path)
+    if not hasattr(inference, "run_batch"):
+        raise HTTPException(503, "Mosaic analysis needs the trained model")
+    
+    batcher = get_batcher()
+    path = await save_upload(file, settings.mosaic_max_upload_mb * 1024 * 1024, prefix="mosaic_")
+    try:
+        async with get_mosaic_slots():
+            return await analyze_mosaic(
+                path,
+                inference,
+                lambda batch: batcher.score(model_path, batch, pad=inference.supports_batching),
+                tile_size=tile_size or settings.mosaic_tile_size,
+                max_pixels=settings.mosaic_max_pixels,
+                bounds=bounds,
+                gdal_cache_mb=settings.mosaic_gdal_cache_mb
+            )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(500, f"Mosaic analysis error: {str(e)}")
+    finally:
+        os.unlink(path)
@@ -0,0 +1,103 @@
+"""
+AgroSentinel Jobs API Routes
+Submit long-running bulk analyses and poll or stream their progress
+"""
+
+import json
+from fastapi import APIRouter, File, UploadFile, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from app.services.jobs import FINISHED_STATUSES, get_job_queue
+
+router = APIRouter(prefix="/api/jobs", tags=["Jobs"])
+
+# Seconds between keep-alive lines on the progress stream
+EVENTS_KEEPALIVE = 15.0
+
+
+def job_status(job: dict) -> dict:
+    """Public view of a job (without upload paths)"""
+    total = job["total"]
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "total": total,
+        "done": job["done"],
+        "failed": job["failed"],
+        "progress": round(job["done"] / total, 4) if total else 1.0,
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "summary": job["summary"],
+        "error": job["error"],
+    }
+
+
+async def find_job(job_id: str) -> dict:
+    job = await get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job
+
+
+@router.post("/survey", status_code=202)
+async def submit_survey(
+    files: list[UploadFile] = File(..., description="Photos and/or ZIP archives of photos"),
+    lang: str = Query("en", description="Language code (en, hi, te, ta, kn)"),
+    latitude: Optional[float] = Query(None, ge=-90, le=90, description="Location for photos without EXIF GPS"),
+    longitude: Optional[float] = Query(None, ge=-180, le=180)
+):
+    """
+    Queue a field survey (same input as /api/survey) and return its job id at
+    once; poll /api/jobs/{job_id} or stream /api/jobs/{job_id}/events
+    """
+    if (latitude is None) != (longitude is None):
+        raise HTTPException(400, "Give both latitude and longitude, or neither")
+    default_location = (latitude, longitude) if latitude is not None else None
+    
+    try:
+        job = await get_job_queue().submit_survey(files, lang, default_location)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return job_status(job)
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    return job_status(await find_job(job_id))
+
+
+@router.get("/{job_id}/results")
+async def get_job_results(job_id: str):
+    """Results so far as a GeoJSON FeatureCollection (complete once the job is)"""
+    job = await find_job(job_id)
+    return {
+        "type": "FeatureCollection",
+        "features": await get_job_queue().results(job_id),
+        "job": job_status(job),
+    }
+
+
+@router.get("/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    NDJSON stream of the job's status on every progress update until it
+    finishes (or a final "not_found" line if the job disappears meanwhile)
+    """
+    await find_job(job_id)
+    queue = get_job_queue()
+    
+    async def stream():
+        while True:
+            job = await queue.get(job_id)
+            if job is None:
+                # Deleted or expired while streaming - end the stream with a final line
+                yield json.dumps({"job_id": job_id, "status": "not_found", "error": "Job not found"}) + "\n"
+                return
+            yield json.dumps(job_status(job)) + "\n"
+            if job["status"] in FINISHED_STATUSES:
+                return
+            await queue.wait_for_update(job_id, EVENTS_KEEPALIVE)
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -0,0 +1,104 @@
+"""
+AgroSentinel Risk API Routes
+Forward-looking disease risk from the weather forecast and regional
+risk heatmaps from cached weather
+"""
+
+from datetime import datetime, timezone
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+import numpy as np
+from app.services.risk_engine import RiskEngine, THRESHOLD_DISEASES
+from app.services.risk_heatmap import get_risk_heatmap, tile_bounds
+from app.services.translations import get_disease_name
+from app.services.weather_service import get_weather_service
+
+router = APIRouter(prefix="/api/risk", tags=["Risk"])
+
+
+@router.get("/forecast")
+async def risk_forecast(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    confidence: float = Query(1.0, ge=0, le=1, description="Diagnosis confidence (1 = risk if the disease is present)"),
+    disease: Optional[str] = Query(None, description="Only this disease (default: all)"),
+    lang: str = Query("en", description="Language code (en, hi, te, ta, kn)")
+):
+    """Per-disease risk curve over the next days (3-hourly forecast slots)"""
+    if disease is not None and disease not in THRESHOLD_DISEASES:
+        raise HTTPException(404, f"No risk profile for '{disease}'")
+    
+    forecast = await get_weather_service().get_forecast(latitude, longitude)
+    if forecast is None or not len(forecast):
+        raise HTTPException(503, "Weather forecast unavailable")
+    
+    scores, levels = RiskEngine.project_forecast(forecast.humidity, forecast.temperature, forecast.rain, confidence)
+    times = [datetime.fromtimestamp(int(t), timezone.utc).isoformat() for t in forecast.times]
+    
+    diseases = {}
+    for row, name in enumerate(THRESHOLD_DISEASES):
+        if disease is not None and name != disease:
+            continue
+        peak = int(np.argmax(scores[row]))
+        diseases[name] = {
+            "display_name": get_disease_name(name, lang),
+            "risk_score": scores[row].tolist(),
+            "risk_level": levels[row].tolist(),
+            "peak_risk_score": float(scores[row, peak]),
+            "peak_risk_level": str(levels[row, peak]),
+            "peak_time": times[peak],
+        }
+    
+    return {
+        "location": {"latitude": latitude, "longitude": longitude},
+        "source": forecast.source,
+        "confidence": confidence,
+        "times": times,
+        "weather": {
+            "temperature": forecast.temperature.tolist(),
+            "humidity": forecast.humidity.tolist(),
+            "wind_speed": forecast.wind_speed.tolist(),
+            "description": forecast.descriptions,
+        },
+        "diseases": diseases,
+    }
+
+
+async def heatmap_response(south: float, north: float, west: float, east: float, confidence: Optional[float], disease: Optional[str]) -> dict:
+    if disease is not None and disease not in THRESHOLD_DISEASES:
+        raise HTTPException(404, f"No risk profile for '{disease}'")
+    try:
+        return await get_risk_heatmap().grid(south, north, west, east, confidence, disease)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+@router.get("/heatmap")
+async def risk_heatmap(
+    north: float = Query(..., ge=-90, le=90),
+    south: float = Query(..., ge=-90, le=90),
+    east: float = Query(..., ge=-180, le=180),
+    west: float = Query(..., ge=-180, le=180),
+    confidence: Optional[float] = Query(None, ge=0, le=1, description="Diagnosis confidence (default: score weather conditions alone)"),
+    disease: Optional[str] = Query(None, description="Only this disease (default: all)")
+):
+    """Per-disease weather risk on a grid of weather cells covering the bounding box"""
+    if north <= south or east <= west:
+        raise HTTPException(400, "Bounds must satisfy north > south and east > west")
+    return await heatmap_response(south, north, west, east, confidence, disease)
+
+
+@router.get("/heatmap/{z}/{x}/{y}")
+async def risk_heatmap_tile(
+    z: int,
+    x: int,
+    y: int,
+    confidence: Optional[float] = Query(None, ge=0, le=1),
+    disease: Optional[str] = Query(None)
+):
+    """The heatmap grid for one XYZ map tile"""
+    try:
+        south, north, west, east = tile_bounds(z, x, y)
+    except ValueError as e:
+        raise HTTPException(404, str(e))
+    return await heatmap_response(south, north, west, east, confidence, disease)
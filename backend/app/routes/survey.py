@@ -0,0 +1,126 @@
+"""
+AgroSentinel Field Survey API Routes
+Bulk analysis of geotagged photos uploaded as a ZIP or a multipart batch
+"""
+
+import asyncio
+import json
+import os
+from fastapi import APIRouter, File, UploadFile, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from app.config import get_settings
+from app.services.prediction import run_prediction
+from app.services.survey import SurveyFiles, SurveySummary, WeatherCells, run_survey
+from app.services.uploads import save_upload
+from app.services.weather_service import get_weather_service
+
+router = APIRouter(prefix="/api/survey", tags=["Survey"])
+
+
+async def spool_survey(files: list[UploadFile]) -> tuple[SurveyFiles, list[str]]:
+    """Save the uploads to temp files and list the photos in them"""
+    settings = get_settings()
+    budget = settings.survey_max_upload_mb * 1024 * 1024
+    paths = []
+    try:
+        uploads = []
+        for file in files:
+            path = await save_upload(file, budget, prefix="survey_")
+            paths.append(path)
+            budget -= os.path.getsize(path)
+            uploads.append((file.filename or os.path.basename(path), path))
+        
+        survey_files = await asyncio.to_thread(
+            SurveyFiles,
+            uploads,
+            settings.survey_max_files,
+            settings.survey_max_image_mb * 1024 * 1024
+        )
+    except BaseException as e:
+        remove_files(paths)
+        if isinstance(e, ValueError):
+            raise HTTPException(400, str(e))
+        raise
+    
+    if not len(survey_files):
+        survey_files.close()
+        remove_files(paths)
+        raise HTTPException(400, "No photos found (upload images or a ZIP of images)")
+    return survey_files, paths
+
+
+def remove_files(paths: list[str]):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+@router.post("")
+async def analyze_survey(
+    files: list[UploadFile] = File(..., description="Photos and/or ZIP archives of photos"),
+    format: str = Query("geojson", pattern="^(geojson|ndjson)$", description="geojson, or ndjson to stream progress"),
+    lang: str = Query("en", description="Language code (en, hi, te, ta, kn)"),
+    latitude: Optional[float] = Query(None, ge=-90, le=90, description="Location for photos without EXIF GPS"),
+    longitude: Optional[float] = Query(None, ge=-180, le=180)
+):
+    """
+    Diagnose every photo of a field survey. Each photo is located from its EXIF
+    GPS tags (or the given latitude/longitude), scored with risk from the weather
+    of its grid cell and stored. Returns a GeoJSON FeatureCollection, or with
+    format=ndjson one JSON line per finished photo and a final summary line.
+    """
+    if (latitude is None) != (longitude is None):
+        raise HTTPException(400, "Give both latitude and longitude, or neither")
+    default_location = (latitude, longitude) if latitude is not None else None
+    
+    settings = get_settings()
+    survey_files, paths = await spool_survey(files)
+    weather = WeatherCells(get_weather_service(), settings.survey_weather_cell_deg)
+    summary = SurveySummary(len(survey_files))
+    features = run_survey(
+        survey_files,
+        run_prediction,
+        weather,
+        summary,
+        lang=lang,
+        default_location=default_location,
+        concurrency=settings.survey_concurrency,
+        insert_batch=settings.survey_insert_batch
+    )
+    
+    def cleanup():
+        weather.close()
+        survey_files.close()
+        remove_files(paths)
+    
+    if format == "ndjson":
+        async def stream():
+            try:
+                async for feature in features:
+                    yield json.dumps({"done": summary.done, "total": summary.total, "feature": feature}) + "\n"
+                yield json.dumps({"done": summary.done, "total": summary.total, "summary": summary.to_dict(weather.lookups)}) + "\n"
+            finally:
+                await features.aclose()
+                cleanup()
+        
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+    
+    try:
+        collected = [feature async for feature in features]
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(500, f"Survey analysis error: {str(e)}")
+    finally:
+        await features.aclose()
+        cleanup()
+    
+    collected.sort(key=lambda feature: feature["properties"]["index"])
+    return {
+        "type": "FeatureCollection",
+        "features": collected,
+        "summary": summary.to_dict(weather.lookups),
+    }
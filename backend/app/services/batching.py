@@ -0,0 +1,319 @@
+"""
+AgroSentinel Inference Batching
+Collects preprocessed TTA batches from concurrent requests and scores them
+together in one ONNX session call (dynamic micro-batching)
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+import numpy as np
+from app.config import get_settings
+from app.services.inference import CascadeInference, get_predictor
+from app.services.executor import InferenceExecutor, get_executor
+
+# Model input rows per upload with full TTA (original + 4 augmentations)
+TTA_ROWS = 5
+
+
+def padded_batch_sizes(max_batch_size: int) -> list[int]:
+    """The session.run sizes combined batches are padded up to: 1, every multiple of TTA_ROWS, and the limit"""
+    return sorted({1, max_batch_size, *range(TTA_ROWS, max_batch_size, TTA_ROWS)})
+
+
+@dataclass
+class _BatchItem:
+    """One request waiting in the batching queue"""
+    model_path: str
+    batch: np.ndarray
+    future: asyncio.Future
+    pad: bool = True  # False for fixed batch-1 models, which score row by row anyway
+    rows: int = field(init=False)
+    
+    def __post_init__(self):
+        self.rows = self.batch.shape[0]
+
+
+class InferenceBatcher:
+    """
+    Asyncio micro-batching layer in front of EfficientNetInference.
+    
+    Requests are queued as [N,3,H,W] TTA batches. A single worker task pulls
+    them off the queue and flushes a combined batch as soon as either
+    max_batch_size images are collected or max_wait_ms has passed since the
+    first queued request, then hands each caller its own slice of the logits.
+    Combined batches are padded up to the next of batch_sizes (repeating their
+    last row), so session.run only ever sees the sizes warm-up has run.
+    Up to max_in_flight batches (one per executor worker) are scored at once,
+    so the next batch is collected while earlier ones run. Only requests for
+    the same model are combined, so batches in flight during a hot swap stay
+    on the model they were decoded for. Decoding and session runs are
+    dispatched to the InferenceExecutor so the event loop never blocks on them.
+    """
+    
+    def __init__(
+        self,
+        executor: InferenceExecutor,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        enabled: bool = True,
+        max_in_flight: int = 1
+    ):
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.enabled = enabled
+        self.max_in_flight = max(1, max_in_flight)
+        self.batch_sizes = padded_batch_sizes(max_batch_size)
+        
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._carry: _BatchItem | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._flushes: set[asyncio.Task] = set()
+        
+        # Metrics
+        self.batches_run = 0
+        self.requests_batched = 0
+        self.images_batched = 0
+        self.rows_padded = 0
+        self.last_batch_size = 0
+        self.max_batch_size_seen = 0
+        self.max_in_flight_seen = 0
+    
+    def _ensure_worker(self):
+        """Start the worker lazily so it binds to the running event loop"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._carry = None
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._worker = asyncio.create_task(self._run())
+    
+    async def predict(self, model_path: str, image_bytes: bytes) -> tuple[str, float, list, bool, int]:
+        """Queue one upload for batched scoring on the given (loaded) model and wait for its result"""
+        predictor = await asyncio.to_thread(get_predictor, model_path)
+        if isinstance(predictor, CascadeInference):
+            return await self._predict_cascade(model_path, predictor, image_bytes)
+        return await self._predict_tta(model_path, predictor, image_bytes)
+    
+    async def _predict_tta(self, model_path: str, inference, image_bytes: bytes) -> tuple[str, float, list, bool, int]:
+        """Full model with (adaptive) TTA"""
+        # Only the real model exposes the prepare/run/summarize split
+        if not (self.enabled and hasattr(inference, "prepare_batch")):
+            return await self.executor.predict(model_path, image_bytes)
+        
+        batch = await self.executor.prepare_batch(model_path, image_bytes)
+        
+        if inference.tta_mode == "adaptive":
+            # Original first; only ambiguous scans queue their remaining variants
+            first = await self._score(model_path, batch[:1], inference.supports_batching)
+            if inference.should_exit_early(first[0]):
+                return inference.summarize(first)
+            remaining = await self._score(model_path, batch[1:], inference.supports_batching)
+            all_logits = np.concatenate([first, remaining], axis=0)
+        else:
+            all_logits = await self._score(model_path, batch, inference.supports_batching)
+        
+        return inference.summarize(all_logits)
+    
+    async def _predict_cascade(self, model_path: str, cascade: CascadeInference, image_bytes: bytes) -> tuple[str, float, list, bool, int]:
+        """Student first; only uncertain scans pay for the full model with TTA"""
+        student_path = cascade.student_path
+        row = await self.executor.prepare_single(student_path, image_bytes)
+        if self.enabled:
+            student_logits = (await self._score(student_path, row, cascade.student.supports_batching))[0]
+        else:
+            student_logits = (await self.executor.run_batch(student_path, row))[0]
+        
+        if not cascade.should_escalate(student_logits):
+            return cascade.accept(student_logits)
+        prediction = await self._predict_tta(model_path, cascade.teacher, image_bytes)
+        return cascade.escalated(student_logits, prediction)
+    
+    async def score(self, model_path: str, batch: np.ndarray, pad: bool = True) -> np.ndarray:
+        """Logits for any number of model input rows (e.g. mosaic tiles), queued in max_batch_size chunks"""
+        if not self.enabled:
+            return await self.executor.run_batch(model_path, batch)
+        chunks = [batch[i:i + self.max_batch_size] for i in range(0, batch.shape[0], self.max_batch_size)]
+        results = await asyncio.gather(*[self._score(model_path, chunk, pad) for chunk in chunks])
+        return np.concatenate(results, axis=0)
+    
+    async def _score(self, model_path: str, batch: np.ndarray, pad: bool = True) -> np.ndarray:
+        """Queue rows for the next combined batch and wait for their logits"""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_BatchItem(model_path, batch, future, pad))
+        return await future
+    
+    async def _collect(self) -> list[_BatchItem]:
+        """Wait for the first request, then gather more until size or time limit"""
+        if self._carry is not None:
+            first, self._carry = self._carry, None
+        else:
+            first = await self._queue.get()
+        
+        items = [first]
+        rows = first.rows
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        
+        while rows < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item.model_path != first.model_path or rows + item.rows > self.max_batch_size:
+                # Doesn't fit (or is for another model) - it opens the next batch instead
+                self._carry = item
+                break
+            items.append(item)
+            rows += item.rows
+        
+        return items
+    
+    async def _run(self):
+        """Worker loop: collect batches and start scoring them until cancelled"""
+        while True:
+            # Collect the next batch only once an executor worker can take it
+            await self._slots.acquire()
+            try:
+                items = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            # Drop requests whose callers have already gone away
+            items = [item for item in items if not item.future.done()]
+            if not items:
+                self._slots.release()
+                continue
+            
+            flush = asyncio.create_task(self._flush(items))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+            self.max_in_flight_seen = max(self.max_in_flight_seen, len(self._flushes))
+    
+    async def _flush(self, items: list[_BatchItem]):
+        """Score one combined batch and dispatch the logits to its callers"""
+        try:
+            combined = np.concatenate([item.batch for item in items], axis=0)
+            rows = combined.shape[0]
+            size = self.padded_size(rows) if items[0].pad else rows
+            if size > rows:
+                # Repeat the last row up to a warmed size; its logits are dropped
+                combined = np.concatenate([combined, np.repeat(combined[-1:], size - rows, axis=0)])
+            try:
+                logits = (await self.executor.run_batch(items[0].model_path, combined))[:rows]
+            except Exception as e:
+                for item in items:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                return
+            except BaseException:
+                # Cancelled (e.g. at loop shutdown) - don't leave the callers waiting forever
+                for item in items:
+                    item.future.cancel()
+                raise
+        finally:
+            self._slots.release()
+        
+        self.batches_run += 1
+        self.requests_batched += len(items)
+        self.images_batched += rows
+        self.rows_padded += size - rows
+        self.last_batch_size = rows
+        self.max_batch_size_seen = max(self.max_batch_size_seen, rows)
+        
+        # Hand each caller back its own rows of logits
+        offsets = np.cumsum([item.rows for item in items])[:-1]
+        for item, item_logits in zip(items, np.split(logits, offsets)):
+            if not item.future.done():
+                item.future.set_result(item_logits)
+    
+    def padded_size(self, rows: int) -> int:
+        """The smallest of batch_sizes that holds rows (rows itself past the limit)"""
+        return next((size for size in self.batch_sizes if size >= rows), rows)
+    
+    def queue_depth(self) -> int:
+        """Requests currently waiting to be batched"""
+        depth = self._queue.qsize() if self._queue is not None else 0
+        return depth + (1 if self._carry is not None else 0)
+    
+    def stats(self) -> dict:
+        """Queue-depth and batch-size metrics"""
+        return {
+            "enabled": self.enabled,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": self.queue_depth(),
+            "in_flight": len(self._flushes),
+            "batches_run": self.batches_run,
+            "requests_batched": self.requests_batched,
+            "images_batched": self.images_batched,
+            "batch_sizes": self.batch_sizes,
+            "rows_padded": self.rows_padded,
+            "avg_batch_size": round(self.images_batched / self.batches_run, 2) if self.batches_run else 0.0,
+            "avg_requests_per_batch": round(self.requests_batched / self.batches_run, 2) if self.batches_run else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size_seen": self.max_batch_size_seen,
+            "max_in_flight_seen": self.max_in_flight_seen,
+        }
+    
+    async def close(self):
+        """Stop the worker and fail any requests still waiting"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        
+        # Batches already handed to the executor still get their results
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        
+        pending = [self._carry] if self._carry is not None else []
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for item in pending:
+            if not item.future.done():
+                item.future.set_exception(RuntimeError("Inference batcher shut down"))
+        self._carry = None
+
+
+_batcher_instance: InferenceBatcher | None = None
+
+
+def get_batcher() -> InferenceBatcher:
+    """Get or create the shared batcher"""
+    global _batcher_instance
+    
+    if _batcher_instance is None:
+        settings = get_settings()
+        _batcher_instance = InferenceBatcher(
+            get_executor(),
+            max_batch_size=settings.inference_max_batch_size,
+            max_wait_ms=settings.inference_max_wait_ms,
+            enabled=settings.inference_batching,
+            max_in_flight=settings.inference_workers
+        )
+    
+    return _batcher_instance
+
+
+def get_batcher_stats() -> dict:
+    """Batching metrics, without creating the batcher if it isn't running yet"""
+    if _batcher_instance is None:
+        return {"enabled": False, "queue_depth": 0, "batches_run": 0}
+    return _batcher_instance.stats()
+
+
+async def shutdown_batcher():
+    """Stop the batching worker (called from the app lifespan)"""
+    global _batcher_instance
+    if _batcher_instance is not None:
+        await _batcher_instance.close()
+        _batcher_instance = None
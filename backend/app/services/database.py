@@ -1,6 +1,8 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
 from datetime import datetime
+from pathlib import Path
 from typing import Optional
+from pymongo.errors import BulkWriteError
 from app.models.schemas import DiagnosisRecord
 
 
@@ -36,6 +38,152 @@ class Database:
         except Exception:
             return "error_id"
     
+    @classmethod
+    async def save_diagnoses(cls, records: list[DiagnosisRecord]) -> int:
+        """Bulk insert; returns how many records were written"""
+        if not cls.connected or not records:
+            return 0
+        try:
+            created_at = datetime.utcnow()
+            documents = []
+            for record in records:
+                record_dict = record.model_dump()
+                record_dict["created_at"] = created_at
+                documents.append(record_dict)
+            result = await cls.db.diagnoses.insert_many(documents, ordered=False)
+            return len(result.inserted_ids)
+        except Exception:
+            return 0
+    
+    @classmethod
+    async def get_recent_locations(cls, since: datetime, limit: int = 1000) -> list:
+        """(latitude, longitude) of diagnoses saved since a time, newest first"""
+        if not cls.connected:
+            return []
+        try:
+            cursor = cls.db.diagnoses.find(
+                {"created_at": {"$gte": since}},
+                {"_id": 0, "location": 1}
+            ).sort("created_at", -1).limit(limit)
+            results = await cursor.to_list(length=limit)
+            return [(r["location"]["latitude"], r["location"]["longitude"]) for r in results if r.get("location")]
+        except Exception:
+            return []
+    
+    @classmethod
+    async def save_job(cls, job: dict) -> bool:
+        """Insert or replace a background job's state document"""
+        if not cls.connected:
+            return False
+        try:
+            await cls.db.jobs.replace_one({"_id": job["id"]}, {"_id": job["id"], **job}, upsert=True)
+            return True
+        except Exception:
+            return False
+    
+    @classmethod
+    async def get_job(cls, job_id: str) -> Optional[dict]:
+        if not cls.connected:
+            return None
+        try:
+            job = await cls.db.jobs.find_one({"_id": job_id})
+            if job:
+                job.pop("_id")
+            return job
+        except Exception:
+            return None
+    
+    @classmethod
+    async def find_jobs(cls, statuses: list[str]) -> list:
+        if not cls.connected:
+            return []
+        try:
+            cursor = cls.db.jobs.find({"status": {"$in": statuses}}).sort("created_at", 1)
+            results = await cursor.to_list(length=None)
+            for r in results:
+                r.pop("_id")
+            return results
+        except Exception:
+            return []
+    
+    @classmethod
+    async def save_job_results(cls, job_id: str, results: list[dict]) -> int:
+        """
+        Bulk insert per-item results of a job (one document per item, keyed by
+        the item's index so a retried batch doesn't store anything twice);
+        returns how many of them are stored
+        """
+        if not cls.connected or not results:
+            return 0
+        try:
+            documents = [
+                {"_id": f"{job_id}:{result['properties']['index']}", "job_id": job_id, "result": result}
+                for result in results
+            ]
+            result = await cls.db.job_results.insert_many(documents, ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Items already stored by an earlier attempt count as saved
+            duplicates = sum(error.get("code") == 11000 for error in e.details.get("writeErrors", []))
+            return e.details.get("nInserted", 0) + duplicates
+        except Exception:
+            return 0
+    
+    @classmethod
+    async def get_job_results(cls, job_id: str) -> list:
+        if not cls.connected:
+            return []
+        try:
+            cursor = cls.db.job_results.find({"job_id": job_id}, {"_id": 0, "result": 1})
+            return [r["result"] async for r in cursor]
+        except Exception:
+            return []
+    
+    @classmethod
+    async def save_job_upload(cls, job_id: str, name: str, path: Path) -> bool:
+        """Store one of a job's input files (GridFS) so it outlives the local disk"""
+        if not cls.connected:
+            return False
+        try:
+            bucket = AsyncIOMotorGridFSBucket(cls.db, bucket_name="job_uploads")
+            with open(path, "rb") as f:
+                await bucket.upload_from_stream(name, f, metadata={"job_id": job_id})
+            return True
+        except Exception:
+            return False
+    
+    @classmethod
+    async def restore_job_uploads(cls, job_id: str, root: Path, names: list[str]) -> int:
+        """Write the named input files of a job back under root; returns how many were found"""
+        if not cls.connected or not names:
+            return 0
+        restored = 0
+        try:
+            bucket = AsyncIOMotorGridFSBucket(cls.db, bucket_name="job_uploads")
+            cursor = bucket.find({"metadata.job_id": job_id, "filename": {"$in": names}})
+            async for stored in cursor:
+                path = root / stored.filename
+                path.parent.mkdir(parents=True, exist_ok=True)
+                partial = path.with_name(path.name + ".part")
+                with open(partial, "wb") as f:
+                    await bucket.download_to_stream(stored._id, f)
+                partial.replace(path)
+                restored += 1
+            return restored
+        except Exception:
+            return restored
+    
+    @classmethod
+    async def delete_job_uploads(cls, job_id: str):
+        if not cls.connected:
+            return
+        try:
+            bucket = AsyncIOMotorGridFSBucket(cls.db, bucket_name="job_uploads")
+            async for stored in bucket.find({"metadata.job_id": job_id}):
+                await bucket.delete(stored._id)
+        except Exception:
+            pass
+    
     @classmethod
     async def get_user_history(cls, user_id: str, limit: int = 50) -> list:
         if not cls.connected:
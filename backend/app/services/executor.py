@@ -0,0 +1,155 @@
+"""
+AgroSentinel Inference Executor
+Bounded worker pool that keeps image decoding and ONNX execution off the
+asyncio event loop
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+from app.config import get_settings
+from app.services.inference import get_inference
+
+# Job functions name the model they run on, so a hot swap takes effect in every
+# worker: threads share the main process's loaded models, while each child of
+# the process pool loads (and caches) a model the first time it is asked for it
+# (startup warm-up and hot swaps send every worker a dummy batch for that).
+
+
+def _prepare_batch(model_path: str, image_bytes: bytes) -> np.ndarray:
+    return get_inference(model_path).prepare_batch(image_bytes)
+
+
+def _prepare_single(model_path: str, image_bytes: bytes) -> np.ndarray:
+    return get_inference(model_path).prepare_single(image_bytes)
+
+
+def _run_batch(model_path: str, batch: np.ndarray) -> np.ndarray:
+    return get_inference(model_path).run_batch(batch)
+
+
+def _predict(model_path: str, image_bytes: bytes) -> tuple[str, float, list, bool, int]:
+    return get_inference(model_path).predict(image_bytes)
+
+
+class InferenceExecutor:
+    """
+    Dedicated pool for blocking inference work.
+    
+    Uses a thread pool by default (ONNX Runtime and PIL release the GIL for the
+    heavy parts); a process pool can be selected instead, in which case every
+    worker loads its own copy of the model. At most max_pending jobs are
+    admitted at once - further callers wait on the event loop, so a burst of
+    uploads applies backpressure instead of growing an unbounded queue.
+    """
+    
+    def __init__(self, max_workers: int = 2, max_pending: int = 64, use_processes: bool = False):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.use_processes = use_processes
+        
+        if use_processes:
+            self.pool = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        
+        self._slots = asyncio.Semaphore(max_pending)
+        
+        # Metrics
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.waiting = 0
+        self.running = 0
+        self.total_wait_time = 0.0
+        self.total_run_time = 0.0
+    
+    async def _submit(self, fn, *args):
+        """Run fn in the pool once a pending slot is free"""
+        self.waiting += 1
+        queued_at = time.perf_counter()
+        async with self._slots:
+            self.waiting -= 1
+            self.submitted += 1
+            self.running += 1
+            started_at = time.perf_counter()
+            self.total_wait_time += started_at - queued_at
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+                self.completed += 1
+                return result
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self.running -= 1
+                self.total_run_time += time.perf_counter() - started_at
+    
+    async def prepare_batch(self, model_path: str, image_bytes: bytes) -> np.ndarray:
+        """Decode and build the TTA batch for one upload"""
+        return await self._submit(_prepare_batch, model_path, image_bytes)
+    
+    async def prepare_single(self, model_path: str, image_bytes: bytes) -> np.ndarray:
+        """Decode one upload into a single model input row (no TTA)"""
+        return await self._submit(_prepare_single, model_path, image_bytes)
+    
+    async def run_batch(self, model_path: str, batch: np.ndarray) -> np.ndarray:
+        """Score one batch of model inputs"""
+        return await self._submit(_run_batch, model_path, batch)
+    
+    async def predict(self, model_path: str, image_bytes: bytes) -> tuple[str, float, list, bool, int]:
+        """Full decode + TTA + inference for one upload"""
+        return await self._submit(_predict, model_path, image_bytes)
+    
+    def stats(self) -> dict:
+        """Pool size, occupancy and timing metrics"""
+        finished = self.completed + self.failed
+        return {
+            "kind": "process" if self.use_processes else "thread",
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "running": self.running,
+            "waiting": self.waiting,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.total_wait_time / self.submitted * 1000, 2) if self.submitted else 0.0,
+            "avg_run_ms": round(self.total_run_time / finished * 1000, 2) if finished else 0.0,
+        }
+    
+    def shutdown(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+_executor_instance: InferenceExecutor | None = None
+
+
+def get_executor() -> InferenceExecutor:
+    """Get or create the shared inference executor"""
+    global _executor_instance
+    
+    if _executor_instance is None:
+        settings = get_settings()
+        _executor_instance = InferenceExecutor(
+            max_workers=settings.inference_workers,
+            max_pending=settings.inference_max_pending,
+            use_processes=settings.inference_executor == "process"
+        )
+    
+    return _executor_instance
+
+
+def get_executor_stats() -> dict:
+    """Executor metrics, without creating the pool if it isn't running yet"""
+    if _executor_instance is None:
+        return {"running": 0, "waiting": 0, "submitted": 0}
+    return _executor_instance.stats()
+
+
+def shutdown_executor():
+    """Stop the worker pool (called from the app lifespan)"""
+    global _executor_instance
+    if _executor_instance is not None:
+        _executor_instance.shutdown()
+        _executor_instance = None
@@ -4,7 +4,11 @@ import random
 import json
 from PIL import Image, ImageOps, ImageEnhance
 import io
+import hashlib
+import threading
+from collections import OrderedDict
 from pathlib import Path
+from app.config import get_settings
 
 # Load class names and inference config from JSON files
 MODEL_DIR = Path(__file__).parent.parent.parent / "models"
@@ -43,49 +47,300 @@ else:
 # Confidence threshold - below this, mark as "uncertain"
 CONFIDENCE_THRESHOLD = 0.50
 
+# TTA modes: "full" always scores all variants, "adaptive" scores the original
+# first and only escalates to the full set when that result is ambiguous
+TTA_MODES = ("full", "adaptive")
+
 # Set to False to use the real model
 DEMO_MODE = False
 
+# TTA parameters (shared by the PIL reference path and the vectorized path)
+TTA_ROTATION = -10
+TTA_FILL = 128
+TTA_BRIGHTNESS = 1.1
+TTA_ZOOM = 0.9
+
+# Uploads are decoded at no less than this multiple of the model input size
+DECODE_OVERSAMPLE = 2
+
+# Modes Image.reduce can average; others (palette, bilevel, 16-bit) go to RGB first
+REDUCIBLE_MODES = ("L", "RGB", "RGBA", "CMYK")
+
+# ONNX Runtime graph optimization levels by config name
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+def create_session(model_path: str, session_config: dict | None = None):
+    """
+    Create an ONNX Runtime session with tuned SessionOptions.
+    
+    When optimized_model_dir is set, the graph optimized on first load is saved
+    there and later starts load it directly with graph optimization disabled.
+    The cache file name covers the model file, ORT version, optimization level
+    and providers, so any change produces a fresh optimized graph.
+    """
+    import onnxruntime as ort
+    
+    config = session_config or {}
+    
+    # Try GPU first, fallback to CPU
+    available = ort.get_available_providers()
+    providers = [p for p in ('CUDAExecutionProvider', 'CPUExecutionProvider') if p in available]
+    
+    level_name = config.get('graph_optimization', 'all')
+    if level_name not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown graph optimization level '{level_name}'")
+    level = getattr(ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[level_name])
+    
+    def build_options(optimization_level, optimized_path=None):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = config.get('intra_op_threads', 0)
+        options.inter_op_num_threads = config.get('inter_op_threads', 0)
+        options.execution_mode = (
+            ort.ExecutionMode.ORT_PARALLEL
+            if config.get('execution_mode') == 'parallel'
+            else ort.ExecutionMode.ORT_SEQUENTIAL
+        )
+        options.graph_optimization_level = optimization_level
+        options.enable_cpu_mem_arena = config.get('enable_mem_arena', True)
+        options.enable_mem_pattern = config.get('enable_mem_pattern', True)
+        if optimized_path:
+            options.optimized_model_filepath = optimized_path
+        return options
+    
+    cache_dir = config.get('optimized_model_dir')
+    cached = None
+    if cache_dir and level_name != 'disable':
+        stat = os.stat(model_path)
+        key = hashlib.sha1(
+            f"{stat.st_size}:{stat.st_mtime_ns}:{ort.__version__}:{level_name}:{','.join(providers)}".encode()
+        ).hexdigest()[:12]
+        cached = Path(cache_dir) / f"{Path(model_path).stem}.{key}.optimized.onnx"
+        
+        if cached.exists():
+            try:
+                session = ort.InferenceSession(
+                    str(cached),
+                    sess_options=build_options(ort.GraphOptimizationLevel.ORT_DISABLE_ALL),
+                    providers=providers
+                )
+                print(f"  Optimized graph loaded from cache: {cached}")
+                return session
+            except Exception as e:
+                print(f"⚠ Discarding unreadable optimized graph {cached}: {e}")
+                cached.unlink(missing_ok=True)
+        cached.parent.mkdir(parents=True, exist_ok=True)
+    
+    optimized_path = str(cached) if cached else None
+    try:
+        session = ort.InferenceSession(
+            model_path,
+            sess_options=build_options(level, optimized_path),
+            providers=providers
+        )
+    except Exception as e:
+        print(f"⚠ Session creation with {providers} failed ({e}), retrying on CPU")
+        session = ort.InferenceSession(
+            model_path,
+            sess_options=build_options(level, optimized_path),
+            providers=['CPUExecutionProvider']
+        )
+    if optimized_path:
+        print(f"  Optimized graph saved to: {optimized_path}")
+    return session
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp_logits = np.exp(logits - np.max(logits))
+    return exp_logits / np.sum(exp_logits)
+
+
+def _lanczos(x: np.ndarray) -> np.ndarray:
+    """Lanczos-3 kernel, as used by PIL's LANCZOS filter"""
+    x = np.abs(x)
+    return np.where(x < 3.0, np.sinc(x) * np.sinc(x / 3.0), 0.0)
+
+
+def _resample_matrix(in_size: int, out_size: int) -> np.ndarray:
+    """
+    [out_size, in_size] LANCZOS resampling matrix for one image axis.
+    Mirrors PIL's precompute_coeffs so results match Image.resize.
+    """
+    scale = in_size / out_size
+    filterscale = max(scale, 1.0)
+    support = 3.0 * filterscale
+    
+    matrix = np.zeros((out_size, in_size), dtype=np.float64)
+    for xx in range(out_size):
+        center = (xx + 0.5) * scale
+        xmin = max(int(center - support + 0.5), 0)
+        xmax = min(int(center + support + 0.5), in_size)
+        taps = np.arange(xmin, xmax)
+        weights = _lanczos((taps - center + 0.5) / filterscale)
+        total = weights.sum()
+        if total != 0:
+            weights /= total
+        matrix[xx, xmin:xmax] = weights
+    return matrix
+
+
+def _rotation_map(size: int, angle: float) -> tuple:
+    """
+    Precompute bilinear sampling indices and weights that reproduce
+    Image.rotate(angle, resample=BILINEAR) on a size x size image.
+    Indices address the image flattened to [size * size, 3] so the gathers
+    are cheap np.take calls. Returns (i00, i01, i10, i11, wy, wx, outside).
+    """
+    theta = -np.radians(angle)
+    a, b = np.cos(theta), np.sin(theta)
+    d, e = -np.sin(theta), np.cos(theta)
+    center = size / 2.0
+    c = a * -center + b * -center + center
+    f = d * -center + e * -center + center
+    
+    # Sample positions for every output pixel centre (PIL's inverse affine map)
+    ys, xs = np.mgrid[0:size, 0:size] + 0.5
+    xin = a * xs + b * ys + c
+    yin = d * xs + e * ys + f
+    outside = (xin < 0) | (xin >= size) | (yin < 0) | (yin >= size)
+    
+    xin -= 0.5
+    yin -= 0.5
+    x0 = np.floor(xin).astype(np.intp)
+    y0 = np.floor(yin).astype(np.intp)
+    wx = (xin - x0).astype(np.float32).reshape(-1, 1)
+    wy = (yin - y0).astype(np.float32).reshape(-1, 1)
+    x1 = np.clip(x0 + 1, 0, size - 1)
+    y1 = np.clip(y0 + 1, 0, size - 1)
+    x0 = np.clip(x0, 0, size - 1)
+    y0 = np.clip(y0, 0, size - 1)
+    
+    i00 = (y0 * size + x0).ravel()
+    i01 = (y0 * size + x1).ravel()
+    i10 = (y1 * size + x0).ravel()
+    i11 = (y1 * size + x1).ravel()
+    return i00, i01, i10, i11, wy, wx, outside.ravel()
+
 
 class DemoInference:
     """Demo inference for testing without a model"""
-    def predict(self, image_bytes: bytes) -> tuple[str, float, list, bool]:
+    model_version = "demo"
+    
+    def predict(self, image_bytes: bytes) -> tuple[str, float, list, bool, int]:
         random.seed(len(image_bytes) % 1000)
         disease_idx = random.randint(0, len(DISEASE_CLASSES) - 1)
         disease = DISEASE_CLASSES[disease_idx]
         confidence = random.uniform(0.75, 0.98)
-        return disease, confidence, [], True
+        return disease, confidence, [], True, 0
 
 
 class EfficientNetInference:
     """EfficientNet-based classification inference with TTA"""
-    def __init__(self, model_path: str):
-        import onnxruntime as ort
+    def __init__(
+        self,
+        model_path: str,
+        tta_mode: str = "full",
+        early_exit_confidence: float = 0.95,
+        early_exit_margin: float = 0.90,
+        session_config: dict | None = None,
+        inference_config: dict | None = None,
+        class_names: list | None = None
+    ):
+        self.session = create_session(model_path, session_config)
         
-        # Try GPU first, fallback to CPU
-        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-        try:
-            self.session = ort.InferenceSession(model_path, providers=providers)
-        except:
-            self.session = ort.InferenceSession(
-                model_path,
-                providers=['CPUExecutionProvider']
-            )
-        
-        self.input_name = self.session.get_inputs()[0].name
+        # Versioned model directories ship their own config and class names
+        config = INFERENCE_CONFIG if inference_config is None else inference_config
+        self.config = config
+        self.class_names = DISEASE_CLASSES if class_names is None else class_names
+        
+        # Identifies this exact model file (e.g. for prediction cache keys)
+        stat = os.stat(model_path)
+        self.model_version = config.get(
+            'model_version', f"{Path(model_path).stem}-{stat.st_size}-{int(stat.st_mtime)}"
+        )
+        
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Models exported with a dynamic batch axis (export_onnx_v2.py) can score
+        # all TTA variants in a single session.run; fixed batch-1 graphs cannot
+        batch_dim = model_input.shape[0] if model_input.shape else None
+        self.supports_batching = not isinstance(batch_dim, int) or batch_dim != 1
         # Get image size from config or default to 260 for EfficientNet-B3
-        self.img_size = INFERENCE_CONFIG.get('img_size', 260)
+        self.img_size = config.get('img_size', 260)
+        # Models exported with raw_input take uint8 [N,H,W,3] pixels and
+        # normalize/transpose in-graph, so decoded pixels are passed through as-is
+        self.raw_input = (
+            config.get('input_format') == 'uint8_nhwc'
+            or model_input.type == 'tensor(uint8)'
+        )
+        # TTA models (export_onnx_v2.py tta_in_graph) build the augmentations
+        # in-graph and return averaged logits for each input image
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.graph_tta_variants = int(metadata.get('tta_variants', 0))
+        
+        # Adaptive TTA: stop after the original image if it is already clear-cut
+        if tta_mode not in TTA_MODES:
+            raise ValueError(f"Unknown TTA mode '{tta_mode}', expected one of {TTA_MODES}")
+        if self.graph_tta_variants and tta_mode != "full":
+            # The graph always scores every variant - there is nothing to exit early from
+            print(f"  TTA mode '{tta_mode}' not available with in-graph TTA, using 'full'")
+            tta_mode = "full"
+        self.tta_mode = tta_mode
+        self.early_exit_confidence = early_exit_confidence
+        self.early_exit_margin = early_exit_margin
         
         # ImageNet normalization values
         self.mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)
         self.std = np.array([0.229, 0.224, 0.225], dtype=np.float32)
         
+        # Fused normalization: x / 255 / std - mean / std, per NCHW channel
+        self.norm_scale = (1.0 / (255.0 * self.std)).reshape(1, 3, 1, 1)
+        self.norm_bias = (self.mean / self.std).reshape(1, 3, 1, 1)
+        
+        # Sampling maps for the vectorized TTA path (the input size is fixed)
+        self.rotation_map = _rotation_map(self.img_size, TTA_ROTATION)
+        crop_size = int(self.img_size * TTA_ZOOM)
+        crop_start = (self.img_size - crop_size) // 2
+        self.zoom_window = slice(crop_start, crop_start + crop_size)
+        self.zoom_matrix = _resample_matrix(crop_size, self.img_size).astype(np.float32)
+        
         print(f"✓ Model loaded: {model_path}")
-        print(f"  Input: {self.input_name}, Size: {self.img_size}x{self.img_size}")
-        print(f"  Classes: {len(DISEASE_CLASSES)}")
-        print(f"  TTA: Enabled (5 augmentations)")
+        print(f"  Input: {self.input_name}, Size: {self.img_size}x{self.img_size}, Format: {'uint8 NHWC' if self.raw_input else 'float32 NCHW'}")
+        print(f"  Classes: {len(self.class_names)}")
+        if self.graph_tta_variants:
+            print(f"  TTA: In-graph ({self.graph_tta_variants} augmentations)")
+        else:
+            print(f"  TTA: Enabled (5 augmentations, {'batched' if self.supports_batching else 'sequential'}, {self.tta_mode})")
         print(f"  Confidence threshold: {CONFIDENCE_THRESHOLD}")
     
+    def load_image(self, image_bytes: bytes) -> Image.Image:
+        """
+        Decode an upload at reduced resolution:
+        - JPEGs are decoded in the DCT domain at the smallest 1/2, 1/4 or 1/8
+          scale that keeps both sides >= 2x the model input
+        - Other formats are box-reduced by an integer factor to the same bound
+          (modes reduce can't average are converted to RGB first)
+        - EXIF orientation is applied afterwards, so phone photos come out upright
+        """
+        image = Image.open(io.BytesIO(image_bytes))
+        min_side = DECODE_OVERSAMPLE * self.img_size
+        
+        # No-op for non-JPEG formats
+        image.draft('RGB', (min_side, min_side))
+        
+        factor = min(image.size) // min_side
+        if factor >= 2:
+            if image.mode not in REDUCIBLE_MODES:
+                image = image.convert('RGB')
+            image = image.reduce(factor)
+        
+        return ImageOps.exif_transpose(image)
+    
     def smart_preprocess(self, image: Image.Image) -> Image.Image:
         """
         Smart preprocessing for real-world images:
@@ -120,6 +375,8 @@ class EfficientNetInference:
     
     def preprocess_to_tensor(self, image: Image.Image) -> np.ndarray:
         """Convert PIL image to normalized tensor"""
+        if self.raw_input:
+            return np.asarray(image, dtype=np.uint8)[None]
         img_array = np.array(image, dtype=np.float32) / 255.0
         img_array = (img_array - self.mean) / self.std
         img_array = np.transpose(img_array, (2, 0, 1))
@@ -144,16 +401,16 @@ class EfficientNetInference:
         augmented.append(ImageOps.mirror(image))
         
         # 3. Slight rotation (-10 degrees)
-        rotated = image.rotate(-10, resample=Image.BILINEAR, fillcolor=(128, 128, 128))
+        rotated = image.rotate(TTA_ROTATION, resample=Image.BILINEAR, fillcolor=(TTA_FILL,) * 3)
         augmented.append(rotated)
         
         # 4. Brightness adjustment (slightly brighter)
         enhancer = ImageEnhance.Brightness(image)
-        augmented.append(enhancer.enhance(1.1))
+        augmented.append(enhancer.enhance(TTA_BRIGHTNESS))
         
         # 5. Center crop zoom (crop 90% from center, then resize back)
         w, h = image.size
-        crop_size = int(min(w, h) * 0.9)
+        crop_size = int(min(w, h) * TTA_ZOOM)
         left = (w - crop_size) // 2
         top = (h - crop_size) // 2
         cropped = image.crop((left, top, left + crop_size, top + crop_size))
@@ -164,39 +421,28 @@ class EfficientNetInference:
     
     def run_inference(self, tensor: np.ndarray) -> np.ndarray:
         """Run single inference and return logits"""
-        outputs = self.session.run(None, {self.input_name: tensor})
-        return outputs[0][0]
+        return self.run_batch(tensor)[0]
     
-    def predict(self, image_bytes: bytes) -> tuple[str, float, list, bool]:
-        """
-        Run inference with Test-Time Augmentation (TTA)
-        Returns: (disease, confidence, top5, is_confident)
-        """
-        # Load and preprocess image
-        image = Image.open(io.BytesIO(image_bytes))
-        image = self.smart_preprocess(image)
-        
-        # Get TTA variants
-        tta_images = self.get_tta_images(image)
-        
-        # Run inference on all variants
-        all_logits = []
-        for aug_image in tta_images:
-            tensor = self.preprocess_to_tensor(aug_image)
-            logits = self.run_inference(tensor)
-            all_logits.append(logits)
-        
-        # Average the logits (before softmax for better calibration)
-        avg_logits = np.mean(all_logits, axis=0)
-        
-        # Softmax
-        exp_logits = np.exp(avg_logits - np.max(avg_logits))
-        probabilities = exp_logits / np.sum(exp_logits)
+    def run_batch(self, batch: np.ndarray) -> np.ndarray:
+        """Run inference on a batch and return [N,num_classes] logits"""
+        if self.supports_batching:
+            outputs = self.session.run(None, {self.input_name: batch})
+            return outputs[0]
+        # Fixed batch-1 model: score each row separately
+        return np.stack([
+            self.session.run(None, {self.input_name: batch[i:i + 1]})[0][0]
+            for i in range(batch.shape[0])
+        ])
+    
+    def postprocess(self, avg_logits: np.ndarray) -> tuple[str, float, list, bool]:
+        """Turn averaged logits into (disease, confidence, top5, is_confident)"""
+        probabilities = _softmax(avg_logits)
         
         # Get prediction
         class_idx = int(np.argmax(probabilities))
         confidence = float(probabilities[class_idx])
-        disease = DISEASE_CLASSES[class_idx] if class_idx < len(DISEASE_CLASSES) else "unknown"
+        class_names = self.class_names
+        disease = class_names[class_idx] if class_idx < len(class_names) else "unknown"
         
         # Check if confident enough
         is_confident = confidence >= CONFIDENCE_THRESHOLD
@@ -204,29 +450,435 @@ class EfficientNetInference:
         # Top-5 predictions
         top5_indices = np.argsort(probabilities)[-5:][::-1]
         top5 = [
-            {"class": DISEASE_CLASSES[i], "confidence": float(probabilities[i])}
-            for i in top5_indices if i < len(DISEASE_CLASSES)
+            {"class": class_names[i], "confidence": float(probabilities[i])}
+            for i in top5_indices if i < len(class_names)
         ]
         
         return disease, confidence, top5, is_confident
+    
+    def get_tta_batch(self, image: Image.Image) -> np.ndarray:
+        """
+        Vectorized equivalent of get_tta_images + preprocess_to_tensor.
+        
+        The resized image is converted to a uint8 array once; the flip is a
+        view, rotation and center zoom use precomputed sampling maps and
+        brightness is a single multiply. All five variants are staged in one
+        uint8 stack, then normalized straight into a contiguous [5,3,H,W]
+        float32 buffer in one pass. Raw-input models get the uint8 stack itself.
+        """
+        base = np.asarray(image, dtype=np.uint8)
+        size = self.img_size
+        stage = np.empty((5, size, size, 3), dtype=np.uint8)
+        
+        # 1. Original
+        stage[0] = base
+        
+        # 2. Horizontal flip (view)
+        stage[1] = base[:, ::-1]
+        
+        # 3. Slight rotation: bilinear gather with grey fill outside the source
+        i00, i01, i10, i11, wy, wx, outside = self.rotation_map
+        src = base.astype(np.float32)
+        flat = src.reshape(-1, 3)
+        p00 = np.take(flat, i00, axis=0)
+        p10 = np.take(flat, i10, axis=0)
+        top = p00 + (np.take(flat, i01, axis=0) - p00) * wx
+        bottom = p10 + (np.take(flat, i11, axis=0) - p10) * wx
+        rotated = top + (bottom - top) * wy
+        rotated[outside] = TTA_FILL
+        np.clip(rotated, 0, 255, out=rotated)
+        stage[2] = rotated.reshape(size, size, 3)
+        
+        # 4. Brightness adjustment (slightly brighter)
+        np.clip(src * TTA_BRIGHTNESS, 0, 255, out=src)
+        stage[3] = src
+        
+        # 5. Center crop zoom: separable LANCZOS on the crop window (a view),
+        # horizontal pass first and rounded to 8 bits in between like PIL
+        # Each pass is one GEMM over the axis being resampled: [size, crop] @ [crop, crop*3]
+        window = base[self.zoom_window, self.zoom_window].astype(np.float32)
+        crop = window.shape[0]
+        columns = (self.zoom_matrix @ window.transpose(1, 0, 2).reshape(crop, -1)).reshape(size, crop, 3)
+        np.floor(columns + 0.5, out=columns)
+        np.clip(columns, 0, 255, out=columns)
+        zoomed = (self.zoom_matrix @ columns.transpose(1, 0, 2).reshape(crop, -1)).reshape(size, size, 3)
+        np.clip(zoomed + 0.5, 0, 255, out=zoomed)
+        stage[4] = zoomed
+        
+        return self.to_model_input(stage)
+    
+    def to_model_input(self, stage: np.ndarray) -> np.ndarray:
+        """Turn a uint8 [N,H,W,3] stack into the model's input layout"""
+        if self.raw_input:
+            # Normalization and layout conversion happen inside the graph
+            return stage
+        
+        # Fused normalization + HWC->CHW into one preallocated NCHW buffer
+        n, height, width, _ = stage.shape
+        batch = np.empty((n, 3, height, width), dtype=np.float32)
+        np.multiply(stage.transpose(0, 3, 1, 2), self.norm_scale, out=batch)
+        batch -= self.norm_bias
+        return batch
+    
+    def make_dummy_batch(self, size: int) -> np.ndarray:
+        """Zero batch in the model's input layout (for warm-up)"""
+        if self.raw_input:
+            return np.zeros((size, self.img_size, self.img_size, 3), dtype=np.uint8)
+        return np.zeros((size, 3, self.img_size, self.img_size), dtype=np.float32)
+    
+    def prepare_batch(self, image_bytes: bytes) -> np.ndarray:
+        """Decode an upload and return its TTA variants as one model input batch"""
+        if self.graph_tta_variants:
+            # The graph builds the variants itself - send only the original
+            return self.prepare_single(image_bytes)
+        
+        # Load and preprocess image
+        image = self.load_image(image_bytes)
+        image = self.smart_preprocess(image)
+        
+        return self.get_tta_batch(image)
+    
+    def prepare_single(self, image_bytes: bytes) -> np.ndarray:
+        """Decode an upload into a one-row model input batch (no TTA)"""
+        image = self.smart_preprocess(self.load_image(image_bytes))
+        return self.to_model_input(np.asarray(image, dtype=np.uint8)[None])
+    
+    def prepare_batch_pil(self, image_bytes: bytes) -> np.ndarray:
+        """Reference PIL implementation of prepare_batch (one pipeline per variant)"""
+        image = self.load_image(image_bytes)
+        image = self.smart_preprocess(image)
+        
+        tta_images = self.get_tta_images(image)
+        return np.concatenate(
+            [self.preprocess_to_tensor(aug_image) for aug_image in tta_images],
+            axis=0
+        )
+    
+    def should_exit_early(self, logits: np.ndarray) -> bool:
+        """True if the original image alone is confident enough to skip TTA"""
+        if self.tta_mode != "adaptive":
+            return False
+        probabilities = np.sort(_softmax(logits))
+        top1, top2 = probabilities[-1], probabilities[-2]
+        return top1 >= self.early_exit_confidence or (top1 - top2) >= self.early_exit_margin
+    
+    def summarize(self, all_logits: np.ndarray) -> tuple[str, float, list, bool, int]:
+        """
+        Average per-variant logits and post-process them into a prediction
+        Returns: (disease, confidence, top5, is_confident, tta_variants)
+        """
+        # Average the logits (before softmax for better calibration)
+        avg_logits = np.mean(all_logits, axis=0)
+        # In-graph TTA rows are already averages over every variant
+        variants = len(all_logits) * max(1, self.graph_tta_variants)
+        return (*self.postprocess(avg_logits), variants)
+    
+    def predict(self, image_bytes: bytes) -> tuple[str, float, list, bool, int]:
+        """
+        Run inference with Test-Time Augmentation (TTA)
+        Returns: (disease, confidence, top5, is_confident, tta_variants)
+        """
+        batch = self.prepare_batch(image_bytes)
+        
+        if self.tta_mode == "adaptive":
+            # Original first; escalate to the remaining variants only if needed
+            first = self.run_batch(batch[:1])
+            if self.should_exit_early(first[0]):
+                return self.summarize(first)
+            all_logits = np.concatenate([first, self.run_batch(batch[1:])], axis=0)
+        else:
+            # Score all variants in a single session call, one row of logits per variant
+            all_logits = self.run_batch(batch)
+        
+        return self.summarize(all_logits)
+
+
+class CascadeInference:
+    """
+    Two-stage cascade in front of an EfficientNetInference model.
+    
+    A small student model scores the original image first; scans where its
+    top-1 confidence or top-1/top-2 margin is below its threshold escalate to
+    the full model with TTA. Thresholds default to the calibration
+    stored in the student's inference_config.json ("cascade") by
+    training/distill_student.py. Escalations are counted per class of the
+    student's top prediction, along with how often the full model overturned it.
+    """
+    def __init__(
+        self,
+        student: EfficientNetInference,
+        student_path: str,
+        teacher: EfficientNetInference,
+        confidence_threshold: float = 0.0,
+        margin_threshold: float = 0.0
+    ):
+        if student.class_names != teacher.class_names:
+            raise ValueError("Cascade student and full model must predict the same classes")
+        
+        calibrated = student.config.get('cascade', {})
+        self.student = student
+        self.student_path = student_path
+        self.teacher = teacher
+        self.confidence_threshold = confidence_threshold or calibrated.get('confidence', 0.90)
+        self.margin_threshold = margin_threshold or calibrated.get('margin', 0.80)
+        # Answers depend on both models and the thresholds
+        self.model_version = (
+            f"{teacher.model_version}+{student.model_version}"
+            f"@{self.confidence_threshold:g}/{self.margin_threshold:g}"
+        )
+        
+        # Per class of the student's answer: [scans, escalated, overturned]
+        self.class_counts: dict[str, list[int]] = {}
+        self._lock = threading.Lock()
+        
+        print(f"✓ Cascade: {student.model_version} -> {teacher.model_version} "
+              f"(escalate below confidence {self.confidence_threshold:g} or margin {self.margin_threshold:g})")
+    
+    def should_escalate(self, logits: np.ndarray) -> bool:
+        """True if the student's answer is too uncertain to return as-is"""
+        probabilities = np.sort(_softmax(logits))
+        top1, top2 = probabilities[-1], probabilities[-2]
+        return top1 < self.confidence_threshold or (top1 - top2) < self.margin_threshold
+    
+    def _record(self, student_logits: np.ndarray, final_disease: str | None = None):
+        class_idx = int(np.argmax(student_logits))
+        class_names = self.student.class_names
+        disease = class_names[class_idx] if class_idx < len(class_names) else "unknown"
+        with self._lock:
+            counts = self.class_counts.setdefault(disease, [0, 0, 0])
+            counts[0] += 1
+            if final_disease is not None:
+                counts[1] += 1
+                counts[2] += final_disease != disease
+    
+    def accept(self, student_logits: np.ndarray) -> tuple[str, float, list, bool, int]:
+        """The student's answer, for scans that don't escalate"""
+        self._record(student_logits)
+        return self.student.summarize(student_logits[None])
+    
+    def escalated(self, student_logits: np.ndarray, prediction: tuple) -> tuple[str, float, list, bool, int]:
+        """Record an escalation and return the full model's answer"""
+        self._record(student_logits, prediction[0])
+        return prediction
+    
+    def predict(self, image_bytes: bytes) -> tuple[str, float, list, bool, int]:
+        """
+        Student first, full model with TTA on uncertainty
+        Returns: (disease, confidence, top5, is_confident, tta_variants)
+        """
+        student_logits = self.student.run_batch(self.student.prepare_single(image_bytes))[0]
+        if not self.should_escalate(student_logits):
+            return self.accept(student_logits)
+        return self.escalated(student_logits, self.teacher.predict(image_bytes))
+    
+    def stats(self) -> dict:
+        """Overall and per-class escalation rates"""
+        with self._lock:
+            counts = {disease: list(c) for disease, c in sorted(self.class_counts.items())}
+        scans = sum(c[0] for c in counts.values())
+        escalated = sum(c[1] for c in counts.values())
+        return {
+            "enabled": True,
+            "student": self.student.model_version,
+            "confidence_threshold": self.confidence_threshold,
+            "margin_threshold": self.margin_threshold,
+            "scans": scans,
+            "escalated": escalated,
+            "escalation_rate": round(escalated / scans, 4) if scans else 0.0,
+            "by_class": {
+                disease: {
+                    "scans": c[0],
+                    "escalation_rate": round(c[1] / c[0], 4),
+                    "overturned": c[2],
+                }
+                for disease, c in counts.items()
+            },
+        }
+
+
+def resolve_model_path(model_path: str, variant: str = "", inference_config: dict | None = None) -> str:
+    """
+    Pick a published model variant (e.g. "int8", "fp16") listed in
+    inference_config.json, falling back to model_path when it isn't available.
+    With use_tta_model set, the in-graph TTA model is preferred over both.
+    """
+    config = INFERENCE_CONFIG if inference_config is None else inference_config
+    tta_entry = config.get('tta_model')
+    if config.get('use_tta_model') and tta_entry:
+        tta_path = Path(model_path).parent / tta_entry['file']
+        if tta_path.exists():
+            print(f"  Using in-graph TTA model ({tta_entry.get('variants')} variants)")
+            return str(tta_path)
+        print(f"⚠ TTA model file {tta_path} not found - ignoring use_tta_model")
+    
+    if not variant:
+        return model_path
+    
+    entry = config.get('variants', {}).get(variant)
+    if entry is None:
+        print(f"⚠ Model variant '{variant}' not published in inference_config.json - using {model_path}")
+        return model_path
+    
+    variant_path = Path(model_path).parent / entry['file']
+    if not variant_path.exists():
+        print(f"⚠ Model variant file {variant_path} not found - using {model_path}")
+        return model_path
+    
+    print(f"  Using {variant} variant (val accuracy {entry.get('accuracy')}%, agreement {entry.get('agreement')}%)")
+    return str(variant_path)
 
 
-_inference_instance = None
+def session_config_from_settings(settings) -> dict:
+    """ONNX Runtime session options from app settings"""
+    intra_op_threads = settings.ort_intra_op_threads
+    if intra_op_threads <= 0:
+        # Split the cores between the inference workers instead of letting
+        # every concurrent session.run spin up one thread per core
+        intra_op_threads = max(1, (os.cpu_count() or 1) // max(1, settings.inference_workers))
+    return {
+        'intra_op_threads': intra_op_threads,
+        'inter_op_threads': settings.ort_inter_op_threads,
+        'execution_mode': settings.ort_execution_mode,
+        'graph_optimization': settings.ort_graph_optimization,
+        'enable_mem_arena': settings.ort_enable_mem_arena,
+        'enable_mem_pattern': settings.ort_enable_mem_pattern,
+        'optimized_model_dir': settings.ort_optimized_model_dir or None,
+    }
+
+
+def read_model_dir(model_dir: Path) -> tuple[Path | None, dict, list]:
+    """
+    Read a versioned model directory: the ONNX file plus its own
+    inference_config.json and class_names.json.
+    Returns (onnx_path, inference_config, class_names).
+    """
+    config = {}
+    config_file = model_dir / "inference_config.json"
+    if config_file.exists():
+        with open(config_file) as f:
+            config = json.load(f)
+    # Cache keys and logs name the model after its directory by default
+    config.setdefault('model_version', model_dir.name)
+    
+    class_names = DISEASE_CLASSES
+    class_names_file = model_dir / "class_names.json"
+    if class_names_file.exists():
+        with open(class_names_file) as f:
+            class_names = json.load(f)
+    
+    onnx_path = model_dir / config.get('model_file', 'agrosentinel_model_v2.onnx')
+    if not onnx_path.exists():
+        candidates = sorted(model_dir.glob("*.onnx"))
+        onnx_path = candidates[0] if candidates else None
+    
+    return onnx_path, config, class_names
+
+
+def load_inference(model_path: str):
+    """Load a model file (legacy flat layout) or a versioned model directory"""
+    settings = get_settings()
+    path = Path(model_path)
+    
+    if DEMO_MODE:
+        print("⚠ Running in DEMO MODE - using mock predictions")
+        return DemoInference()
+    
+    if path.is_dir():
+        onnx_path, config, class_names = read_model_dir(path)
+        if onnx_path is None:
+            print(f"⚠ No ONNX model in {model_path} - using DEMO MODE")
+            return DemoInference()
+    elif path.exists():
+        onnx_path, config, class_names = path, None, None
+    else:
+        print(f"⚠ Model not found at {model_path} - using DEMO MODE")
+        return DemoInference()
+    
+    onnx_path = resolve_model_path(str(onnx_path), settings.model_variant, config)
+    print(f"Loading model from {onnx_path}...")
+    return EfficientNetInference(
+        onnx_path,
+        tta_mode=settings.tta_mode,
+        early_exit_confidence=settings.tta_early_exit_confidence,
+        early_exit_margin=settings.tta_early_exit_margin,
+        session_config=session_config_from_settings(settings),
+        inference_config=config,
+        class_names=class_names
+    )
+
+
+# Loaded models by path, least recently used first. Room for the active
+# model, a cascade student, a shadow candidate and the one being swapped out.
+MAX_LOADED_MODELS = 4
+_inference_instances: OrderedDict[str, object] = OrderedDict()
+_inference_lock = threading.Lock()
 
 
 def get_inference(model_path: str):
-    """Get or create inference instance"""
-    global _inference_instance
-    
-    if _inference_instance is None:
-        if DEMO_MODE:
-            print("⚠ Running in DEMO MODE - using mock predictions")
-            _inference_instance = DemoInference()
-        elif not os.path.exists(model_path):
-            print(f"⚠ Model not found at {model_path} - using DEMO MODE")
-            _inference_instance = DemoInference()
-        else:
-            print(f"Loading model from {model_path}...")
-            _inference_instance = EfficientNetInference(model_path)
+    """Get or create the inference instance for a model file or directory"""
+    instance = _inference_instances.get(model_path)
+    if instance is not None:
+        try:
+            _inference_instances.move_to_end(model_path)
+        except KeyError:
+            pass  # Evicted concurrently; the caller still holds a working instance
+        return instance
     
-    return _inference_instance
+    # Startup warm-up and hot swaps load models off the event loop; don't load one twice
+    with _inference_lock:
+        instance = _inference_instances.get(model_path)
+        if instance is None:
+            instance = load_inference(model_path)
+            _inference_instances[model_path] = instance
+            while len(_inference_instances) > MAX_LOADED_MODELS:
+                evicted, _ = _inference_instances.popitem(last=False)
+                print(f"  Unloaded model {evicted}")
+    
+    return instance
+
+
+# Cascades by full-model path (False when no usable student is configured)
+_cascades: dict[str, CascadeInference | bool] = {}
+
+
+def _build_cascade(student_path: str, teacher) -> CascadeInference | bool:
+    if not os.path.exists(student_path):
+        print(f"⚠ Cascade student not found at {student_path} - serving the full model only")
+        return False
+    
+    settings = get_settings()
+    try:
+        return CascadeInference(
+            get_inference(student_path),
+            student_path,
+            teacher,
+            confidence_threshold=settings.cascade_confidence,
+            margin_threshold=settings.cascade_margin
+        )
+    except ValueError as e:
+        print(f"⚠ Cascade disabled: {e}")
+        return False
+
+
+def get_predictor(model_path: str):
+    """The model at model_path, fronted by the cascade student when one is configured"""
+    inference = get_inference(model_path)
+    student_path = get_settings().cascade_student_model
+    if not student_path or student_path == model_path or not hasattr(inference, "prepare_batch"):
+        return inference
+    
+    cascade = _cascades.get(model_path)
+    # Rebuild if the full model was unloaded and loaded again since
+    if cascade is None or (cascade and cascade.teacher is not inference):
+        cascade = _build_cascade(student_path, inference)
+        _cascades[model_path] = cascade
+    
+    return cascade or inference
+
+
+def get_cascade_stats(model_path: str) -> dict:
+    """Escalation metrics for the cascade in front of model_path, without building it"""
+    cascade = _cascades.get(model_path)
+    if not cascade:
+        return {"enabled": False}
+    return cascade.stats()
@@ -0,0 +1,422 @@
+"""
+AgroSentinel Background Jobs
+Long-running bulk analyses (field surveys) run off the request path: submit
+returns a job id at once, a small worker pool processes the job and clients
+poll or stream its progress. Job state and per-item results are persisted, so
+jobs interrupted by a restart resume where they stopped.
+"""
+
+import asyncio
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+from fastapi import UploadFile
+from app.config import get_settings
+from app.services.database import Database
+from app.services.prediction import run_prediction
+from app.services.survey import SurveyFiles, SurveySummary, WeatherCells, run_survey
+from app.services.uploads import save_upload
+from app.services.weather_service import get_weather_service
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+UNFINISHED_STATUSES = [JOB_QUEUED, JOB_RUNNING]
+FINISHED_STATUSES = (JOB_COMPLETED, JOB_FAILED)
+
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+# Attempts at storing a batch of results before the job fails, backing off
+# RESULT_WRITE_BACKOFF seconds after the first and twice that after the next
+RESULT_WRITE_ATTEMPTS = 3
+RESULT_WRITE_BACKOFF = 1.0
+
+
+def _write_json(path: Path, data: dict):
+    temp = path.with_suffix(".tmp")
+    temp.write_text(json.dumps(data))
+    temp.replace(path)
+
+
+def _read_ndjson(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    results = []
+    with open(path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                break  # Torn last line from a crash mid-write
+    return results
+
+
+class FileJobStore:
+    """
+    Job state on local disk, used when MongoDB is unavailable: root/<id>/job.json
+    (rewritten atomically) plus an append-only results.ndjson. Same methods as
+    the job methods of Database.
+    """
+    
+    def __init__(self, root: str):
+        self.root = Path(root)
+    
+    async def save_job(self, job: dict) -> bool:
+        job_dir = self.root / job["id"]
+        job_dir.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(_write_json, job_dir / "job.json", job)
+        return True
+    
+    async def get_job(self, job_id: str) -> Optional[dict]:
+        path = self.root / job_id / "job.json"
+        if not path.exists():
+            return None
+        return json.loads(await asyncio.to_thread(path.read_text))
+    
+    async def find_jobs(self, statuses: list[str]) -> list:
+        if not self.root.is_dir():
+            return []
+        jobs = []
+        for path in self.root.glob("*/job.json"):
+            job = json.loads(await asyncio.to_thread(path.read_text))
+            if job["status"] in statuses:
+                jobs.append(job)
+        return sorted(jobs, key=lambda job: job["created_at"])
+    
+    async def save_job_results(self, job_id: str, results: list[dict]) -> int:
+        lines = "".join(json.dumps(result) + "\n" for result in results)
+        
+        def append():
+            with open(self.root / job_id / "results.ndjson", "a") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        
+        await asyncio.to_thread(append)
+        return len(results)
+    
+    async def get_job_results(self, job_id: str) -> list:
+        return await asyncio.to_thread(_read_ndjson, self.root / job_id / "results.ndjson")
+    
+    # Uploads already live under root/<id>/uploads, next to the job state
+    
+    async def save_job_upload(self, job_id: str, name: str, path: Path) -> bool:
+        return True
+    
+    async def restore_job_uploads(self, job_id: str, root: Path, names: list[str]) -> int:
+        return 0
+    
+    async def delete_job_uploads(self, job_id: str):
+        pass
+
+
+class JobQueue:
+    """
+    Queue of survey jobs processed by `workers` asyncio worker tasks.
+    
+    Uploads are kept under root/<id>/uploads until the job finishes; with the
+    MongoDB store they are also stored with the job (store_uploads), and a
+    resumed job whose local copies are gone - a host with an ephemeral disk -
+    gets them back from there. Results are persisted in batches (every
+    progress_interval seconds) together with the job's progress, and a
+    resumed job skips every item that already has a stored result. A batch
+    that can't be stored fails the job rather than being counted as done.
+    """
+    
+    def __init__(self, root: str, workers: int = 1, progress_interval: float = 1.0, store_uploads: bool = True):
+        self.root = Path(root)
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self.store_uploads = store_uploads
+        self.store = None
+        
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._active: dict[str, dict] = {}
+        self._updates: dict[str, asyncio.Event] = {}
+        
+        # Metrics
+        self.submitted = 0
+        self.resumed = 0
+        self.completed = 0
+        self.failed = 0
+    
+    async def start(self):
+        """Pick the store, re-queue unfinished jobs and start the workers"""
+        self.store = Database if Database.connected else FileJobStore(str(self.root))
+        self._queue = asyncio.Queue()
+        
+        for job in await self.store.find_jobs(UNFINISHED_STATUSES):
+            self._active[job["id"]] = job
+            self._queue.put_nowait(job["id"])
+            self.resumed += 1
+        if self.resumed:
+            print(f"  Resuming {self.resumed} unfinished job(s)")
+        
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"✓ Job queue started ({self.workers} worker(s), {'MongoDB' if self.store is Database else self.root} store)")
+    
+    async def submit_survey(
+        self,
+        files: list[UploadFile],
+        lang: str = "en",
+        default_location: Optional[tuple[float, float]] = None
+    ) -> dict:
+        """Persist the uploads and queue a survey job (ValueError for unusable uploads)"""
+        settings = get_settings()
+        job_id = uuid.uuid4().hex
+        upload_dir = self.root / job_id / "uploads"
+        upload_dir.mkdir(parents=True)
+        
+        try:
+            budget = settings.survey_max_upload_mb * 1024 * 1024
+            uploads = []
+            for number, file in enumerate(files):
+                temp_path = await save_upload(file, budget, prefix="job_")
+                budget -= os.path.getsize(temp_path)
+                relative = f"uploads/{number}{os.path.splitext(temp_path)[1]}"
+                await asyncio.to_thread(shutil.move, temp_path, self.root / job_id / relative)
+                uploads.append([file.filename or relative, relative])
+            
+            survey_files = await asyncio.to_thread(self._open_files, job_id, uploads)
+            total = len(survey_files)
+            survey_files.close()
+            if not total:
+                raise ValueError("No photos found (upload images or a ZIP of images)")
+            
+            if self.store_uploads:
+                for _, relative in uploads:
+                    if not await self.store.save_job_upload(job_id, relative, self.root / job_id / relative):
+                        print(f"⚠ Job {job_id}: could not store {relative} with the job - it won't resume without jobs_dir")
+        except BaseException:
+            await asyncio.to_thread(shutil.rmtree, self.root / job_id, True)
+            await self.store.delete_job_uploads(job_id)
+            raise
+        
+        now = time.time()
+        job = {
+            "id": job_id,
+            "kind": "survey",
+            "status": JOB_QUEUED,
+            "created_at": now,
+            "updated_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "total": total,
+            "done": 0,
+            "failed": 0,
+            "params": {"lang": lang, "default_location": default_location},
+            "uploads": uploads,
+            "summary": None,
+            "error": None,
+        }
+        await self.store.save_job(job)
+        self._active[job_id] = job
+        self._queue.put_nowait(job_id)
+        self.submitted += 1
+        return job
+    
+    def _open_files(self, job_id: str, uploads: list) -> SurveyFiles:
+        settings = get_settings()
+        return SurveyFiles(
+            [(name, str(self.root / job_id / relative)) for name, relative in uploads],
+            settings.survey_max_files,
+            settings.survey_max_image_mb * 1024 * 1024
+        )
+    
+    async def get(self, job_id: str) -> Optional[dict]:
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        if job_id in self._active:
+            return self._active[job_id]
+        return await self.store.get_job(job_id)
+    
+    async def results(self, job_id: str) -> list[dict]:
+        results = await self.store.get_job_results(job_id)
+        return sorted(results, key=lambda feature: feature["properties"]["index"])
+    
+    async def wait_for_update(self, job_id: str, timeout: float):
+        """Block until the job's progress changes (or the timeout passes)"""
+        event = self._updates.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    
+    def _notify(self, job_id: str):
+        event = self._updates.pop(job_id, None)
+        if event is not None:
+            event.set()
+    
+    async def _save(self, job: dict):
+        job["updated_at"] = time.time()
+        await self.store.save_job(job)
+        self._notify(job["id"])
+    
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self._active[job_id]
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                job.update(status=JOB_FAILED, error=str(e), finished_at=time.time())
+                self.failed += 1
+                await self._save(job)
+            finally:
+                if job["status"] in FINISHED_STATUSES:
+                    self._active.pop(job_id, None)
+                    await asyncio.to_thread(shutil.rmtree, self.root / job_id / "uploads", True)
+                    await self.store.delete_job_uploads(job_id)
+    
+    async def _restore_uploads(self, job: dict):
+        """Bring back uploads lost with the local disk (RuntimeError if some can't be)"""
+        job_dir = self.root / job["id"]
+        missing = [relative for _, relative in job["uploads"] if not (job_dir / relative).exists()]
+        if not missing:
+            return
+        restored = await self.store.restore_job_uploads(job["id"], job_dir, missing)
+        if restored < len(missing):
+            raise RuntimeError(
+                f"{len(missing) - restored} of the job's uploads are gone "
+                f"(jobs_dir isn't persistent and they weren't stored with the job)"
+            )
+        print(f"  Job {job['id']}: restored {restored} upload(s) from the job store")
+    
+    async def _save_results(self, job_id: str, results: list[dict]):
+        """Store a batch of results, retrying a short write (RuntimeError if it stays short)"""
+        for attempt in range(RESULT_WRITE_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(RESULT_WRITE_BACKOFF * 2 ** (attempt - 1))
+            stored = await self.store.save_job_results(job_id, results)
+            if stored >= len(results):
+                return
+            print(f"⚠ Job {job_id}: stored {stored} of {len(results)} results (attempt {attempt + 1})")
+        raise RuntimeError(f"Could not store the job's results ({stored} of {len(results)} saved)")
+    
+    async def _run(self, job: dict):
+        settings = get_settings()
+        job_id = job["id"]
+        params = job["params"]
+        default_location = tuple(params["default_location"]) if params["default_location"] else None
+        
+        await self._restore_uploads(job)
+        survey_files = await asyncio.to_thread(self._open_files, job_id, job["uploads"])
+        weather = WeatherCells(get_weather_service(), settings.survey_weather_cell_deg)
+        summary = SurveySummary(len(survey_files))
+        
+        # Resume: every item with a stored result is done
+        done = set()
+        for feature in await self.store.get_job_results(job_id):
+            if feature["properties"]["index"] not in done:
+                done.add(feature["properties"]["index"])
+                summary.add(feature)
+        remaining = [index for index in range(len(survey_files)) if index not in done]
+        if done:
+            print(f"  Job {job_id}: resuming with {len(remaining)} of {len(survey_files)} photos left")
+        
+        job.update(status=JOB_RUNNING, started_at=job["started_at"] or time.time())
+        await self._save(job)
+        
+        pending: list[dict] = []
+        
+        async def flush():
+            nonlocal pending
+            if pending:
+                await self._save_results(job_id, pending)
+                pending = []
+            job.update(done=summary.done, failed=summary.failed, summary=summary.to_dict(weather.lookups))
+            await self._save(job)
+        
+        features = run_survey(
+            survey_files,
+            run_prediction,
+            weather,
+            summary,
+            lang=params["lang"],
+            default_location=default_location,
+            concurrency=settings.survey_concurrency,
+            insert_batch=settings.survey_insert_batch,
+            indexes=remaining
+        )
+        try:
+            last_flush = time.monotonic()
+            async for feature in features:
+                pending.append(feature)
+                if time.monotonic() - last_flush >= self.progress_interval:
+                    await flush()
+                    last_flush = time.monotonic()
+            await flush()
+        except asyncio.CancelledError:
+            # Shutdown: keep what's finished so the restart doesn't redo it
+            await flush()
+            raise
+        finally:
+            await features.aclose()
+            weather.close()
+            survey_files.close()
+        
+        job.update(status=JOB_COMPLETED, finished_at=time.time())
+        self.completed += 1
+        await self._save(job)
+        print(f"✓ Job {job_id} completed: {summary.done} photos in {job['finished_at'] - job['started_at']:.1f}s")
+    
+    def stats(self) -> dict:
+        return {
+            "store": "mongodb" if self.store is Database else "file",
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": sum(job["status"] == JOB_RUNNING for job in self._active.values()),
+            "submitted": self.submitted,
+            "resumed": self.resumed,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+    
+    async def close(self):
+        """Stop the workers; running jobs stay 'running' and resume on the next start"""
+        for worker in self._workers:
+            worker.cancel()
+        for worker in self._workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+
+
+_job_queue: JobQueue | None = None
+
+
+def get_job_queue() -> JobQueue:
+    """Get or create the shared job queue"""
+    global _job_queue
+    
+    if _job_queue is None:
+        settings = get_settings()
+        _job_queue = JobQueue(
+            settings.jobs_dir,
+            workers=settings.job_workers,
+            progress_interval=settings.job_progress_interval,
+            store_uploads=settings.job_store_uploads
+        )
+    
+    return _job_queue
+
+
+async def shutdown_job_queue():
+    """Stop the job workers (called from the app lifespan)"""
+    global _job_queue
+    if _job_queue is not None:
+        await _job_queue.close()
+        _job_queue = None
@@ -0,0 +1,331 @@
+"""
+AgroSentinel Model Registry
+Versioned model directories with zero-downtime hot swaps and background
+shadow scoring of a candidate model
+"""
+
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from app.config import get_settings
+from app.services.inference import get_inference
+from app.services.warmup import warm_model, warm_up_model
+
+# Pointer files in the registry directory, each holding a version name
+ACTIVE_POINTER = "ACTIVE"
+CANDIDATE_POINTER = "CANDIDATE"
+
+# Version name for the legacy single model at settings.model_path
+DEFAULT_VERSION = "default"
+
+
+def _shadow_predict(model_path: str, image_bytes: bytes) -> tuple[str, float, list, bool, int]:
+    return get_inference(model_path).predict(image_bytes)
+
+
+class ModelRegistry:
+    """
+    Serves one active model and optionally shadow-scores a candidate.
+    
+    Each version is a directory under root holding the ONNX model plus its own
+    class_names.json and inference_config.json. Activating a version loads and
+    warms it off the event loop first, then swaps active_path in one step:
+    requests already in flight finish on the old model, new requests use the
+    new one. The ACTIVE and CANDIDATE pointer files in root are polled, so
+    writing a version name into them has the same effect as the admin API.
+    Without a versioned model the legacy model_path is served as "default".
+    
+    A sampled fraction of freshly computed predictions is re-scored on the
+    candidate in a single background thread and compared with the primary
+    answer; the primary response never waits for it.
+    """
+    
+    def __init__(
+        self,
+        root: str,
+        default_model_path: str,
+        watch_interval: float = 10.0,
+        shadow_version: str = "",
+        shadow_sample_rate: float = 0.0,
+        shadow_max_pending: int = 8
+    ):
+        self.root = Path(root)
+        self.default_model_path = default_model_path
+        self.watch_interval = watch_interval
+        self.initial_shadow_version = shadow_version
+        self.shadow_sample_rate = shadow_sample_rate
+        self.shadow_max_pending = shadow_max_pending
+        
+        self.active_version = DEFAULT_VERSION
+        self.active_path = default_model_path
+        self.candidate_version: str | None = None
+        self.candidate_path: str | None = None
+        
+        self._swap_lock = asyncio.Lock()
+        self._watcher: asyncio.Task | None = None
+        self._pointer_mtimes: dict[str, int | None] = {}
+        self._shadow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+        self._shadow_tasks: set[asyncio.Task] = set()
+        
+        # Metrics
+        self.swaps = 0
+        self.last_swap_at: float | None = None
+        self.shadow_scored = 0
+        self.shadow_agreed = 0
+        self.shadow_skipped = 0
+        self.shadow_failed = 0
+        self.shadow_confidence_delta = 0.0
+        self.shadow_by_class: dict[str, list[int]] = {}
+    
+    def versions(self) -> list[str]:
+        """Version directories that contain an ONNX model"""
+        if not self.root.is_dir():
+            return []
+        return sorted(
+            path.name for path in self.root.iterdir()
+            if path.is_dir() and any(path.glob("*.onnx"))
+        )
+    
+    def version_path(self, version: str) -> str:
+        """Model path for a version name (only listed versions - no arbitrary paths)"""
+        if version == DEFAULT_VERSION:
+            return self.default_model_path
+        if version not in self.versions():
+            raise ValueError(f"Unknown model version '{version}'")
+        return str(self.root / version)
+    
+    def _pointer_mtime(self, name: str) -> int | None:
+        pointer = self.root / name
+        return pointer.stat().st_mtime_ns if pointer.exists() else None
+    
+    def _read_pointer(self, name: str) -> str | None:
+        pointer = self.root / name
+        if not pointer.exists():
+            return None
+        return pointer.read_text().strip() or None
+    
+    def _write_pointer(self, name: str, version: str | None):
+        """Persist a selection so restarts keep it (atomic rename)"""
+        if not self.root.is_dir():
+            return
+        pointer = self.root / name
+        temp = pointer.with_suffix(".tmp")
+        temp.write_text(f"{version or ''}\n")
+        temp.replace(pointer)
+        self._pointer_mtimes[name] = self._pointer_mtime(name)
+    
+    async def start(self):
+        """Warm the version named by the ACTIVE pointer, then start watching the pointers"""
+        for name in (ACTIVE_POINTER, CANDIDATE_POINTER):
+            self._pointer_mtimes[name] = self._pointer_mtime(name)
+        
+        version = self._read_pointer(ACTIVE_POINTER)
+        if version:
+            try:
+                self.active_path = self.version_path(version)
+                self.active_version = version
+            except ValueError as e:
+                print(f"⚠ {e} in {self.root / ACTIVE_POINTER} - serving {self.default_model_path}")
+        print(f"  Active model version: {self.active_version}")
+        
+        await warm_up_model(self.active_path)
+        
+        candidate = self._read_pointer(CANDIDATE_POINTER) or self.initial_shadow_version
+        if candidate:
+            try:
+                await self.set_candidate(candidate, persist=False)
+            except Exception as e:
+                print(f"⚠ Shadow model '{candidate}' not loaded: {e}")
+        
+        if self.watch_interval > 0:
+            self._watcher = asyncio.create_task(self._watch())
+    
+    async def activate(self, version: str, persist: bool = True):
+        """Load and warm a version, then make it the active model"""
+        path = self.version_path(version)
+        
+        async with self._swap_lock:
+            if path == self.active_path:
+                return
+            started = time.perf_counter()
+            await warm_model(path)
+            
+            previous = self.active_version
+            # Single step on the event loop - every request sees either model, never a mix
+            self.active_path, self.active_version = path, version
+            self.swaps += 1
+            self.last_swap_at = time.time()
+            if persist:
+                self._write_pointer(ACTIVE_POINTER, version)
+            print(f"✓ Active model swapped {previous} -> {version} in {time.perf_counter() - started:.2f}s")
+    
+    async def set_candidate(self, version: str | None, sample_rate: float | None = None, persist: bool = True):
+        """Choose the shadow-scored candidate (None stops shadow scoring)"""
+        if sample_rate is not None:
+            if not 0.0 <= sample_rate <= 1.0:
+                raise ValueError("Shadow sample rate must be between 0 and 1")
+            self.shadow_sample_rate = sample_rate
+        
+        if version is None:
+            self.candidate_path, self.candidate_version = None, None
+        else:
+            path = self.version_path(version)
+            await asyncio.to_thread(get_inference, path)
+            if version != self.candidate_version:
+                self._reset_shadow_metrics()
+            self.candidate_path, self.candidate_version = path, version
+        
+        if persist:
+            self._write_pointer(CANDIDATE_POINTER, version)
+        print(f"  Shadow model: {self.candidate_version or 'none'} (sample rate {self.shadow_sample_rate})")
+    
+    async def _watch(self):
+        """Poll the pointer files and apply changes made outside the API"""
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                await self._check_pointers()
+            except Exception as e:
+                print(f"⚠ Model pointer check failed: {e}")
+    
+    async def _check_pointers(self):
+        for name in (ACTIVE_POINTER, CANDIDATE_POINTER):
+            mtime = self._pointer_mtime(name)
+            if mtime == self._pointer_mtimes.get(name):
+                continue
+            self._pointer_mtimes[name] = mtime
+            version = self._read_pointer(name)
+            
+            if name == ACTIVE_POINTER:
+                # A removed pointer keeps the current model
+                if version and version != self.active_version:
+                    print(f"  {self.root / name} changed - activating {version}")
+                    await self.activate(version, persist=False)
+            elif version != self.candidate_version:
+                await self.set_candidate(version, persist=False)
+    
+    def shadow(self, model_path: str, image_bytes: bytes, prediction: tuple):
+        """Maybe re-score this upload on the candidate in the background"""
+        candidate_path = self.candidate_path
+        if candidate_path is None or candidate_path == model_path:
+            return
+        if random.random() >= self.shadow_sample_rate:
+            return
+        if len(self._shadow_tasks) >= self.shadow_max_pending:
+            # Shadow traffic is best-effort - never queue up behind it
+            self.shadow_skipped += 1
+            return
+        
+        task = asyncio.create_task(self._shadow_score(candidate_path, image_bytes, prediction))
+        self._shadow_tasks.add(task)
+        task.add_done_callback(self._shadow_tasks.discard)
+    
+    async def _shadow_score(self, candidate_path: str, image_bytes: bytes, prediction: tuple):
+        try:
+            shadow_prediction = await asyncio.get_running_loop().run_in_executor(
+                self._shadow_pool, _shadow_predict, candidate_path, image_bytes
+            )
+        except Exception as e:
+            self.shadow_failed += 1
+            print(f"⚠ Shadow scoring failed: {e}")
+            return
+        if candidate_path != self.candidate_path:
+            return  # Candidate changed while this was running
+        
+        disease, confidence = prediction[0], prediction[1]
+        shadow_disease, shadow_confidence = shadow_prediction[0], shadow_prediction[1]
+        agreed = shadow_disease == disease
+        
+        self.shadow_scored += 1
+        self.shadow_agreed += agreed
+        self.shadow_confidence_delta += shadow_confidence - confidence
+        per_class = self.shadow_by_class.setdefault(disease, [0, 0])
+        per_class[0] += 1
+        per_class[1] += agreed
+        
+        if not agreed:
+            print(
+                f"  Shadow disagreement: {self.active_version}={disease} ({confidence:.2f}), "
+                f"{self.candidate_version}={shadow_disease} ({shadow_confidence:.2f})"
+            )
+        if self.shadow_scored % 100 == 0:
+            print(
+                f"  Shadow agreement {self.candidate_version} vs {self.active_version}: "
+                f"{self.shadow_agreed / self.shadow_scored:.1%} over {self.shadow_scored} scans"
+            )
+    
+    def _reset_shadow_metrics(self):
+        self.shadow_scored = 0
+        self.shadow_agreed = 0
+        self.shadow_skipped = 0
+        self.shadow_failed = 0
+        self.shadow_confidence_delta = 0.0
+        self.shadow_by_class = {}
+    
+    def stats(self) -> dict:
+        """Versions, swap history and shadow agreement"""
+        scored = self.shadow_scored
+        return {
+            "active_version": self.active_version,
+            "candidate_version": self.candidate_version,
+            "versions": self.versions(),
+            "swaps": self.swaps,
+            "last_swap_at": self.last_swap_at,
+            "shadow": {
+                "sample_rate": self.shadow_sample_rate,
+                "pending": len(self._shadow_tasks),
+                "scored": scored,
+                "agreement": round(self.shadow_agreed / scored, 4) if scored else None,
+                "avg_confidence_delta": round(self.shadow_confidence_delta / scored, 4) if scored else None,
+                "skipped": self.shadow_skipped,
+                "failed": self.shadow_failed,
+                "agreement_by_class": {
+                    disease: round(agreed / count, 4)
+                    for disease, (count, agreed) in sorted(self.shadow_by_class.items())
+                },
+            },
+        }
+    
+    async def close(self):
+        """Stop the pointer watch and any shadow scoring still running"""
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+        for task in list(self._shadow_tasks):
+            task.cancel()
+        self._shadow_pool.shutdown(wait=False, cancel_futures=True)
+
+
+_registry_instance: ModelRegistry | None = None
+
+
+def get_model_registry() -> ModelRegistry:
+    """Get or create the shared model registry"""
+    global _registry_instance
+    
+    if _registry_instance is None:
+        settings = get_settings()
+        _registry_instance = ModelRegistry(
+            settings.model_registry_dir,
+            settings.model_path,
+            watch_interval=settings.model_watch_interval,
+            shadow_version=settings.shadow_model,
+            shadow_sample_rate=settings.shadow_sample_rate,
+            shadow_max_pending=settings.shadow_max_pending
+        )
+    
+    return _registry_instance
+
+
+async def shutdown_model_registry():
+    """Stop the registry's background work (called from the app lifespan)"""
+    global _registry_instance
+    if _registry_instance is not None:
+        await _registry_instance.close()
+        _registry_instance = None
@@ -0,0 +1,290 @@
+"""
+AgroSentinel Orthomosaic Tiling
+Sliding-window disease mapping of large drone orthomosaics. The raster is read
+one row of tiles at a time, each tile is resized to the model input and the
+tiles are scored in batches, so memory stays bounded by a couple of tile rows
+no matter how large the mosaic is.
+"""
+
+import asyncio
+import time
+import warnings
+from PIL import Image
+import numpy as np
+import rasterio
+import rasterio.env
+from rasterio.enums import ColorInterp, MaskFlags, Resampling
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.warp import transform
+from rasterio.windows import Window
+from app.services.disease_data import get_disease_info
+
+# Tiles with less valid (non-nodata) area than this are not scored
+MIN_VALID_FRACTION = 0.5
+
+# Without a nodata mask, pixels no brighter than this count as empty border
+NODATA_LEVEL = 10
+
+
+class Georeference:
+    """
+    Pixel -> (lon, lat) mapping: an affine geotransform in the raster's CRS
+    plus an optional reprojection to WGS84 for projected rasters.
+    """
+    
+    def __init__(self, affine: tuple, reproject=None):
+        # lon/x = c + a * col + b * row, lat/y = f + d * col + e * row
+        self.a, self.b, self.c, self.d, self.e, self.f = affine
+        self.reproject = reproject
+    
+    @classmethod
+    def from_bounds(cls, north: float, south: float, east: float, west: float, width: int, height: int):
+        """North-up image spanning the given WGS84 bounds"""
+        return cls(((east - west) / width, 0.0, west, 0.0, -(north - south) / height, north))
+    
+    def to_lonlat(self, cols: np.ndarray, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        xs = self.c + self.a * cols + self.b * rows
+        ys = self.f + self.d * cols + self.e * rows
+        if self.reproject is not None:
+            xs, ys = self.reproject(xs, ys)
+        return np.asarray(xs), np.asarray(ys)
+    
+    def bounds(self, x0, y0, x1, y1) -> tuple[np.ndarray, ...]:
+        """(north, south, east, west) of pixel boxes, from all four corners"""
+        cols = np.stack([x0, x1, x0, x1])
+        rows = np.stack([y0, y0, y1, y1])
+        lons, lats = self.to_lonlat(cols.ravel(), rows.ravel())
+        lons, lats = lons.reshape(cols.shape), lats.reshape(rows.shape)
+        return lats.max(axis=0), lats.min(axis=0), lons.max(axis=0), lons.min(axis=0)
+
+
+class MosaicSource:
+    """
+    Raster read with rasterio (GDAL): windowed, decimated reads of one band of
+    rows at a time, so only that band is ever decoded into memory. Tiled or
+    striped GeoTIFFs (any compression) are read block by block and JPEG/PNG
+    scanline by scanline; reduced reads use overviews or JPEG DCT scaling
+    when available. Brings the dataset's nodata mask and reprojects any CRS
+    to WGS84.
+    """
+    
+    def __init__(self, path: str, tile_size: int, model_size: int, max_pixels: int):
+        with warnings.catch_warnings():
+            # Plain JPEG/PNG uploads have no georeference - bounds come from the request
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            self.dataset = rasterio.open(path)
+        self.width, self.height = self.dataset.width, self.dataset.height
+        if self.width * self.height > max_pixels:
+            self.dataset.close()
+            raise ValueError(f"Mosaic is {self.width}x{self.height} pixels, above the limit of {max_pixels}")
+        # Read at no more than ~2x the model input per tile
+        self.scale = max(1.0, tile_size / (2 * model_size))
+        # Nodata value, alpha band or mask band; otherwise black borders count as empty
+        self.has_mask = MaskFlags.all_valid not in self.dataset.mask_flag_enums[0]
+        
+        # Palette images: read indexes (never averaged) and look the colours up
+        self.palette = None
+        if self.dataset.colorinterp[0] == ColorInterp.palette:
+            colormap = self.dataset.colormap(1)
+            self.palette = np.zeros((max(colormap) + 1, 3), dtype=np.uint8)
+            for index, rgba in colormap.items():
+                self.palette[index] = rgba[:3]
+        
+        self.georeference = None
+        if self.dataset.crs is not None:
+            t = self.dataset.transform
+            reproject = None
+            if not self.dataset.crs.is_geographic:
+                crs = self.dataset.crs
+                reproject = lambda xs, ys: transform(crs, "EPSG:4326", xs.tolist(), ys.tolist())
+            self.georeference = Georeference((t.a, t.b, t.c, t.d, t.e, t.f), reproject)
+    
+    def read_band(self, y0: int, y1: int) -> tuple[np.ndarray, np.ndarray | None]:
+        """Rows y0:y1 (full-resolution coordinates) as uint8 RGB plus a validity mask"""
+        window = Window(0, y0, self.width, y1 - y0)
+        out_shape = (max(1, int(round((y1 - y0) / self.scale))), max(1, int(round(self.width / self.scale))))
+        
+        if self.palette is not None:
+            indexes = self.dataset.read(1, window=window, out_shape=out_shape, resampling=Resampling.nearest)
+            data = self.palette[indexes].transpose(2, 0, 1)
+        else:
+            indexes = [1, 2, 3] if self.dataset.count >= 3 else [1, 1, 1]
+            data = self.dataset.read(indexes, window=window, out_shape=(3, *out_shape), resampling=Resampling.average)
+        if data.dtype != np.uint8:
+            # e.g. 16-bit mosaics: scale the dtype range to 0..255
+            max_value = np.iinfo(data.dtype).max if np.issubdtype(data.dtype, np.integer) else max(float(data.max()), 1.0)
+            data = np.clip(data.astype(np.float32) * (255.0 / max_value), 0, 255).astype(np.uint8)
+        mask = None
+        if self.has_mask:
+            mask = self.dataset.read_masks(1, window=window, out_shape=out_shape, resampling=Resampling.nearest) > 0
+        return np.ascontiguousarray(data.transpose(1, 2, 0)), mask
+    
+    def close(self):
+        self.dataset.close()
+
+
+def open_mosaic(path: str, tile_size: int, model_size: int, max_pixels: int, gdal_cache_mb: int = 32) -> MosaicSource:
+    # Every block is read once, so GDAL's block cache (default 5% of RAM) only holds
+    # rows already scored; keep it small so memory stays bounded by the tile rows
+    rasterio.env.set_gdal_config("GDAL_CACHEMAX", gdal_cache_mb)
+    return MosaicSource(path, tile_size, model_size, max_pixels)
+
+
+def prepare_tile_row(source, inference, row: int, tile_size: int, cols: int) -> tuple[np.ndarray, list[int], np.ndarray]:
+    """
+    Read one row of tiles and return (model input for the valid tiles, their
+    column indices, valid fraction per column)
+    """
+    y0 = row * tile_size
+    y1 = min(y0 + tile_size, source.height)
+    band, mask = source.read_band(y0, y1)
+    
+    # Tile size in the decoded band's pixels; edge tiles are zero-padded
+    step = tile_size / source.scale
+    padded_h = int(round(step))
+    padded_w = int(round(step * cols))
+    if mask is None:
+        # No explicit nodata: treat (near-)black borders as empty - JPEG
+        # compression leaves them slightly above zero
+        mask = band.max(axis=2) > NODATA_LEVEL
+    if band.shape[0] < padded_h or band.shape[1] < padded_w:
+        padded = np.zeros((padded_h, padded_w, 3), dtype=np.uint8)
+        padded_mask = np.zeros((padded_h, padded_w), dtype=bool)
+        h, w = min(band.shape[0], padded_h), min(band.shape[1], padded_w)
+        padded[:h, :w] = band[:h, :w]
+        padded_mask[:h, :w] = mask[:h, :w]
+        band, mask = padded, padded_mask
+    
+    size = inference.img_size
+    stage = []
+    valid_cols = []
+    valid_fraction = np.zeros(cols, dtype=np.float32)
+    for col in range(cols):
+        x0, x1 = int(round(col * step)), int(round((col + 1) * step))
+        valid_fraction[col] = mask[:padded_h, x0:x1].mean()
+        if valid_fraction[col] < MIN_VALID_FRACTION:
+            continue
+        tile = Image.fromarray(band[:padded_h, x0:x1]).resize((size, size), Image.LANCZOS)
+        stage.append(np.asarray(tile))
+        valid_cols.append(col)
+    
+    if not stage:
+        return inference.make_dummy_batch(0), valid_cols, valid_fraction
+    return inference.to_model_input(np.stack(stage)), valid_cols, valid_fraction
+
+
+async def analyze_mosaic(
+    path: str,
+    inference,
+    score,
+    tile_size: int = 512,
+    max_pixels: int = 1_000_000_000,
+    bounds: dict | None = None,
+    gdal_cache_mb: int = 32
+) -> dict:
+    """
+    Tile a mosaic and score every tile.
+    
+    score is an async callable taking a model input batch and returning its
+    logits (the shared micro-batcher). Reading and resizing the next row of
+    tiles overlaps with scoring the current one, so at most two rows of tiles
+    are held at once.
+    """
+    started = time.perf_counter()
+    source = await asyncio.to_thread(open_mosaic, path, tile_size, inference.img_size, max_pixels, gdal_cache_mb)
+    next_row = None
+    try:
+        georeference = source.georeference
+        if bounds:
+            georeference = Georeference.from_bounds(width=source.width, height=source.height, **bounds)
+        
+        rows = -(-source.height // tile_size)
+        cols = -(-source.width // tile_size)
+        
+        tiles = []
+        by_disease: dict[str, int] = {}
+        scored = 0
+        unhealthy = 0
+        
+        next_row = asyncio.create_task(asyncio.to_thread(prepare_tile_row, source, inference, 0, tile_size, cols))
+        for row in range(rows):
+            batch, valid_cols, valid_fraction = await next_row
+            if row + 1 < rows:
+                next_row = asyncio.create_task(
+                    asyncio.to_thread(prepare_tile_row, source, inference, row + 1, tile_size, cols)
+                )
+            logits = await score(batch) if valid_cols else []
+            
+            # Pixel boxes for the whole row, clipped to the raster
+            x0 = np.arange(cols) * tile_size
+            x1 = np.minimum(x0 + tile_size, source.width)
+            y0 = np.full(cols, row * tile_size)
+            y1 = np.full(cols, min((row + 1) * tile_size, source.height))
+            geo = georeference.bounds(x0, y0, x1, y1) if georeference else None
+            
+            predictions = dict(zip(valid_cols, logits))
+            row_tiles = []
+            for col in range(cols):
+                tile = {
+                    "row": row,
+                    "col": col,
+                    "x": int(x0[col]),
+                    "y": int(y0[col]),
+                    "width": int(x1[col] - x0[col]),
+                    "height": int(y1[col] - y0[col]),
+                    "valid_fraction": round(float(valid_fraction[col]), 3),
+                }
+                if geo is not None:
+                    north, south, east, west = (float(v[col]) for v in geo)
+                    tile["bounds"] = {"north": north, "south": south, "east": east, "west": west}
+                    tile["lat"] = (north + south) / 2
+                    tile["lng"] = (east + west) / 2
+                
+                if col in predictions:
+                    disease, confidence, _, is_confident = inference.postprocess(predictions[col])
+                    is_healthy = get_disease_info(disease)["is_healthy"]
+                    tile.update({
+                        "disease": disease,
+                        "confidence": confidence,
+                        "is_confident": is_confident,
+                        "is_healthy": is_healthy,
+                    })
+                    scored += 1
+                    unhealthy += not is_healthy
+                    by_disease[disease] = by_disease.get(disease, 0) + 1
+                else:
+                    tile["disease"] = None  # No data (outside the mapped area)
+                row_tiles.append(tile)
+            tiles.append(row_tiles)
+        
+        mosaic_bounds = None
+        if georeference:
+            north, south, east, west = georeference.bounds(
+                np.array([0]), np.array([0]), np.array([source.width]), np.array([source.height])
+            )
+            mosaic_bounds = {"north": float(north[0]), "south": float(south[0]), "east": float(east[0]), "west": float(west[0])}
+        
+        return {
+            "width": source.width,
+            "height": source.height,
+            "tile_size": tile_size,
+            "rows": rows,
+            "cols": cols,
+            "georeferenced": georeference is not None,
+            "bounds": mosaic_bounds,
+            "tiles": tiles,
+            "summary": {
+                "tiles_scored": scored,
+                "tiles_no_data": rows * cols - scored,
+                "unhealthy_fraction": round(unhealthy / scored, 4) if scored else 0.0,
+                "by_disease": dict(sorted(by_disease.items(), key=lambda item: -item[1])),
+            },
+            "model_version": inference.model_version,
+            "seconds": round(time.perf_counter() - started, 2),
+        }
+    finally:
+        if next_row is not None and not next_row.done():
+            # Let the read in flight finish before closing the file under it
+            next_row.cancel()
+            await asyncio.gather(next_row, return_exceptions=True)
+        source.close()
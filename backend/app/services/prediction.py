@@ -0,0 +1,26 @@
+"""
+AgroSentinel Prediction
+The shared single-image prediction path used by the API routes and jobs
+"""
+
+import asyncio
+from app.services.batching import get_batcher
+from app.services.inference import get_predictor
+from app.services.model_registry import get_model_registry
+from app.services.prediction_cache import get_prediction_cache
+
+
+async def run_prediction(image_bytes: bytes) -> tuple[str, float, list, bool, int]:
+    """Predict with the active model through the content-addressed cache, then the batched model"""
+    registry = get_model_registry()
+    # Pin the model for this request so a concurrent hot swap can't mix versions
+    model_path = registry.active_path
+    # A cold model (or cascade student) loads here - keep that off the event loop
+    predictor = await asyncio.to_thread(get_predictor, model_path)
+    
+    async def compute(data: bytes) -> tuple[str, float, list, bool, int]:
+        prediction = await get_batcher().predict(model_path, data)
+        registry.shadow(model_path, data, prediction)
+        return prediction
+    
+    return await get_prediction_cache().get_or_compute(image_bytes, predictor.model_version, compute)
@@ -0,0 +1,125 @@
+"""
+AgroSentinel Prediction Cache
+Content-addressed LRU/TTL cache of predictions keyed by image hash, with
+in-flight de-duplication of identical concurrent uploads
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+from app.config import get_settings
+
+Prediction = tuple[str, float, list, bool, int]
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of (disease, confidence, top_predictions, is_confident, tta_variants).
+    
+    Keys are a BLAKE2b digest of the uploaded bytes plus the model version, so
+    retrained models never serve stale answers. While a prediction for a key
+    is being computed, later identical uploads await the same task instead of
+    decoding and scoring the image again.
+    """
+    
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, Prediction]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.inflight_joins = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def make_key(image_bytes: bytes, model_version: str) -> str:
+        digest = hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+        return f"{model_version}:{digest}"
+    
+    def get(self, key: str) -> Prediction | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, prediction = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return prediction
+    
+    def put(self, key: str, prediction: Prediction):
+        self._entries[key] = (time.monotonic(), prediction)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    async def get_or_compute(
+        self,
+        image_bytes: bytes,
+        model_version: str,
+        compute: Callable[[bytes], Awaitable[Prediction]]
+    ) -> Prediction:
+        """Return a cached prediction, join an in-flight one, or compute it"""
+        if self.max_entries <= 0:
+            return await compute(image_bytes)
+        
+        key = self.make_key(image_bytes, model_version)
+        
+        prediction = self.get(key)
+        if prediction is not None:
+            self.hits += 1
+            return prediction
+        
+        task = self._inflight.get(key)
+        if task is not None:
+            self.inflight_joins += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(compute(image_bytes))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._finish(key, t))
+        
+        # Shield so one caller disconnecting doesn't cancel the shared work
+        return await asyncio.shield(task)
+    
+    def _finish(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.inflight_joins
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "inflight_joins": self.inflight_joins,
+            "inflight": len(self._inflight),
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.inflight_joins) / lookups, 3) if lookups else 0.0,
+        }
+
+
+_prediction_cache: PredictionCache | None = None
+
+
+def get_prediction_cache() -> PredictionCache:
+    """Get or create the shared prediction cache"""
+    global _prediction_cache
+    
+    if _prediction_cache is None:
+        settings = get_settings()
+        _prediction_cache = PredictionCache(
+            max_entries=settings.prediction_cache_size,
+            ttl_seconds=settings.prediction_cache_ttl
+        )
+    
+    return _prediction_cache
@@ -1,3 +1,5 @@
+from typing import Sequence
+import numpy as np
 from app.models.schemas import WeatherData
 from app.services.disease_data import SEVERITY_LEVELS
 
@@ -20,6 +22,48 @@ RISK_THRESHOLDS = {
     "tomato_yellow_leaf_curl_virus": {"humidity": 50, "temp_min": 25, "temp_max": 35},
 }
 
+# Diseases in RISK_THRESHOLDS order and their [humidity, temp_min, temp_max]
+# rows; the [diseases, 1] columns let one comparison score every disease
+# against every weather slot
+THRESHOLD_DISEASES = list(RISK_THRESHOLDS)
+THRESHOLD_ROWS = {disease: row for row, disease in enumerate(THRESHOLD_DISEASES)}
+THRESHOLD_MATRIX = np.array(
+    [[t["humidity"], t["temp_min"], t["temp_max"]] for t in RISK_THRESHOLDS.values()],
+    dtype=np.float64
+)
+THRESHOLD_HUMIDITY = THRESHOLD_MATRIX[:, 0:1]
+THRESHOLD_TEMP_MIN = THRESHOLD_MATRIX[:, 1:2]
+THRESHOLD_TEMP_MAX = THRESHOLD_MATRIX[:, 2:3]
+
+RISK_LEVELS = np.array(["LOW", "MODERATE", "HIGH", "CRITICAL"])
+
+# Level per number of favourable weather factors (0-3) when no disease has
+# been diagnosed: weather alone never makes a field CRITICAL
+CONDITION_LEVELS = np.array(["LOW", "LOW", "MODERATE", "HIGH"])
+
+
+def round3(values: np.ndarray) -> np.ndarray:
+    """np.round(values, 3), corrected to Python's round() wherever the two can differ"""
+    rounded = np.round(values, 3)
+    scaled = values * 1000
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_half.any():
+        rounded[near_half] = [round(float(value), 3) for value in values[near_half]]
+    return rounded
+
+
+def risk_levels(combined_risk: np.ndarray) -> np.ndarray:
+    index = (combined_risk >= 0.4).astype(np.int64) + (combined_risk >= 0.6) + (combined_risk >= 0.8)
+    return RISK_LEVELS[index]
+
+
+def _encode(values: Sequence[str], encode) -> np.ndarray:
+    """encode() each distinct string once, then map every element through the results"""
+    if isinstance(values, np.ndarray):
+        values = values.tolist()
+    codes = {value: encode(value) for value in set(values)}
+    return np.fromiter(map(codes.__getitem__, values), dtype=np.int64, count=len(values))
+
 
 class RiskEngine:
     @staticmethod
@@ -56,3 +100,94 @@ class RiskEngine:
             level = "LOW"
         
         return round(combined_risk, 3), level
+    
+    @staticmethod
+    def project_forecast(
+        humidity: np.ndarray,
+        temperature: np.ndarray,
+        rain: np.ndarray,
+        confidence: float = 1.0
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Risk of every disease in THRESHOLD_DISEASES at every forecast slot in
+        one pass: ([diseases, slots] scores, [diseases, slots] levels), with the
+        same arithmetic as calculate_risk for that weather and confidence.
+        """
+        humidity = np.asarray(humidity)[None, :]
+        temperature = np.asarray(temperature)[None, :]
+        rain = np.asarray(rain, dtype=bool)[None, :]
+        
+        risk_factors = (
+            (humidity >= THRESHOLD_HUMIDITY).astype(np.int64)
+            + ((THRESHOLD_TEMP_MIN <= temperature) & (temperature <= THRESHOLD_TEMP_MAX))
+            + ((humidity > 85) | rain)
+        )
+        environmental_risk = risk_factors / 3
+        combined_risk = (confidence * 0.6) + (environmental_risk * 0.4)
+        return round3(combined_risk), risk_levels(combined_risk)
+    
+    @staticmethod
+    def calculate_risk_batch(
+        diseases: Sequence[str],
+        confidences: Sequence[float],
+        humidity: Sequence[int],
+        temperature: Sequence[float],
+        descriptions: Sequence[str]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        calculate_risk over whole arrays (history tables, grid cells): returns
+        (scores, levels) element for element identical to the scalar function.
+        Each distinct disease is looked up once, then every row is scored with
+        broadcasting against THRESHOLD_MATRIX.
+        """
+        confidences = np.asarray(confidences, dtype=np.float64)
+        humidity = np.asarray(humidity)
+        temperature = np.asarray(temperature)
+        rain = _encode(descriptions, lambda description: "rain" in description.lower()).astype(bool)
+        
+        # Threshold row per disease; -1 = healthy class, -2 = no thresholds
+        rows = _encode(diseases, lambda disease: -1 if disease in HEALTHY_CLASSES else THRESHOLD_ROWS.get(disease, -2))
+        healthy = rows == -1
+        unknown = rows == -2
+        
+        thresholds = THRESHOLD_MATRIX[np.maximum(rows, 0)]
+        risk_factors = (
+            (humidity >= thresholds[:, 0]).astype(np.int64)
+            + ((thresholds[:, 1] <= temperature) & (temperature <= thresholds[:, 2]))
+            + ((humidity > 85) | rain)
+        )
+        environmental_risk = risk_factors / 3
+        combined_risk = (confidences * 0.6) + (environmental_risk * 0.4)
+        
+        scores = np.where(unknown, confidences * 0.5, round3(combined_risk))
+        scores[healthy] = 0.0
+        levels = risk_levels(combined_risk).astype("<U8")
+        levels[unknown] = "UNKNOWN"
+        levels[healthy] = "HEALTHY"
+        return scores, levels
+    
+    @staticmethod
+    def score_conditions(
+        diseases: Sequence[str],
+        humidity: Sequence[int],
+        temperature: Sequence[float],
+        descriptions: Sequence[str]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        How favourable the weather is to each disease, independent of any
+        diagnosis: (scores, levels) with the score the share of
+        calculate_risk's weather factors that are met (0, 1/3, 2/3 or 1)
+        and the level from CONDITION_LEVELS. Every disease must have an
+        entry in RISK_THRESHOLDS.
+        """
+        humidity = np.asarray(humidity)
+        temperature = np.asarray(temperature)
+        rain = _encode(descriptions, lambda description: "rain" in description.lower()).astype(bool)
+        
+        thresholds = THRESHOLD_MATRIX[_encode(diseases, THRESHOLD_ROWS.__getitem__)]
+        risk_factors = (
+            (humidity >= thresholds[:, 0]).astype(np.int64)
+            + ((thresholds[:, 1] <= temperature) & (temperature <= thresholds[:, 2]))
+            + ((humidity > 85) | rain)
+        )
+        return round3(risk_factors / 3), CONDITION_LEVELS[risk_factors]
@@ -0,0 +1,299 @@
+"""
+AgroSentinel Regional Risk Heatmap
+Per-disease weather risk over a map area, scored cell by cell from the cached
+weather observations: how favourable the weather is to each disease, or,
+given a diagnosis confidence, the risk an analysis there would report. A
+tile is recomputed only when the weather of one of its cells has been
+refreshed, not on every map pan.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+from app.config import get_settings
+from app.services.risk_engine import RiskEngine, THRESHOLD_DISEASES
+from app.services.weather_service import WeatherService, geohash_bounds, geohash_center, geohash_grid, get_weather_service
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """(south, north, west, east) of an XYZ (web mercator) map tile"""
+    n = 2 ** z
+    if not (0 <= x < n and 0 <= y < n):
+        raise ValueError(f"Tile {z}/{x}/{y} does not exist")
+    
+    def latitude(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    
+    return latitude(y + 1), latitude(y), x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+
+
+def _report_failure(task: asyncio.Task):
+    """Done callback for fetches that may outlive their request: log the error instead of leaving it unretrieved"""
+    if not task.cancelled() and task.exception() is not None:
+        print(f"⚠ Heatmap cell fetch failed: {task.exception()}")
+
+
+class RiskHeatmap:
+    """
+    Risk grids over geohash weather cells.
+    
+    Cells are scored from the weather cache; up to max_fetch missing cells
+    are fetched within the weather latency budget, and the rest are reported
+    as missing. Those and any stale cells go on a fill backlog, refreshed in
+    the background at most fill_rate upstream calls per second, most recently
+    viewed first. Map views aren't diagnoses, so none of this is recorded as
+    prefetch demand. The backlog keeps the newest backlog_size cells.
+    Results are cached per area together with the fetch times of its cells,
+    so a cached grid is reused until one of its observations changes.
+    """
+    
+    def __init__(
+        self,
+        max_cells: int = 2500,
+        max_fetch: int = 8,
+        cache_size: int = 256,
+        fill_rate: float = 0.5,
+        backlog_size: int = 500
+    ):
+        self.max_cells = max_cells
+        self.max_fetch = max_fetch
+        self.cache_size = cache_size
+        self.fill_rate = fill_rate
+        self.backlog_size = backlog_size
+        self._cache: OrderedDict[tuple, tuple[tuple, dict]] = OrderedDict()
+        self._backlog: OrderedDict[str, None] = OrderedDict()
+        self._filler: asyncio.Task | None = None
+        
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.cells_scored = 0
+        self.filled = 0
+        self.fill_failed = 0
+        self.dropped = 0  # backlog cells pushed out by newer views before their fill
+    
+    @property
+    def service(self) -> WeatherService:
+        # Resolved per call - the shared client is recreated with the app lifespan
+        return get_weather_service()
+    
+    async def grid(
+        self,
+        south: float,
+        north: float,
+        west: float,
+        east: float,
+        confidence: Optional[float] = None,
+        disease: Optional[str] = None
+    ) -> dict:
+        """
+        Risk per weather cell over a bounding box (ValueError if it's too large).
+        Without a confidence the cells are scored on weather conditions alone.
+        """
+        service = self.service
+        rows, cols, cells = geohash_grid(south, north, west, east, service.cache_precision, self.max_cells)
+        
+        if service.demo_mode:
+            demo = await service.get_weather(*geohash_center(cells[0]))
+            observations = {cell: (demo, 0.0) for cell in cells}
+        else:
+            await self._fetch_missing(cells)
+            observations = {cell: service.cached(cell) for cell in cells}
+        
+        key = (round(south, 6), round(north, 6), round(west, 6), round(east, 6), confidence, disease)
+        # Changes when any cell is refreshed, fetched or goes stale
+        now = time.monotonic()
+        fingerprint = tuple(
+            None if entry is None else (entry[1], now - entry[1] < service.cache_ttl)
+            for entry in observations.values()
+        )
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return cached[1]
+        
+        self.misses += 1
+        result = self._score(rows, cols, cells, observations, confidence, disease)
+        result["bounds"] = {"south": south, "north": north, "west": west, "east": east}
+        self._cache[key] = (fingerprint, result)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+    
+    async def _fetch_missing(self, cells: list[str]):
+        service = self.service
+        now = time.monotonic()
+        missing = [cell for cell in cells if service.cached(cell) is None]
+        
+        if missing[:self.max_fetch]:
+            tasks = [asyncio.ensure_future(service.refresh_cell(cell)) for cell in missing[:self.max_fetch]]
+            for task in tasks:
+                task.add_done_callback(_report_failure)
+            # Whatever isn't back within the budget keeps going and lands in the cache
+            await asyncio.wait(tasks, timeout=service.latency_budget)
+        
+        # Fill in or refresh the rest in the background
+        if self.fill_rate <= 0 or service.cache_ttl <= 0:
+            return
+        for cell in cells:
+            entry = service.cached(cell)
+            if entry is None or now - entry[1] >= service.cache_ttl:
+                self._backlog[cell] = None
+                self._backlog.move_to_end(cell)
+        while len(self._backlog) > self.backlog_size:
+            self._backlog.popitem(last=False)
+            self.dropped += 1
+        if self._backlog and self._filler is None:
+            self._filler = asyncio.create_task(self._fill())
+    
+    async def _fill(self):
+        """Drain the backlog newest first, calls starting 1/fill_rate apart"""
+        try:
+            next_call = time.monotonic()
+            while self._backlog:
+                cell, _ = self._backlog.popitem(last=True)
+                service = self.service
+                # Fetched by a request or the prefetcher since it was queued
+                if service.expires_in(cell) > 0:
+                    continue
+                await asyncio.sleep(next_call - time.monotonic())
+                next_call = max(next_call + 1.0 / self.fill_rate, time.monotonic())
+                try:
+                    weather = await service.refresh_cell(cell)
+                except Exception as e:
+                    print(f"⚠ Heatmap fill failed for {cell}: {e}")
+                    weather = None
+                if weather is None:
+                    self.fill_failed += 1
+                else:
+                    self.filled += 1
+        finally:
+            self._filler = None
+    
+    def _score(self, rows: int, cols: int, cells: list[str], observations: dict, confidence: Optional[float], disease: Optional[str]) -> dict:
+        diseases = [disease] if disease else THRESHOLD_DISEASES
+        known = [cell for cell in cells if observations[cell] is not None]
+        
+        scores = levels = None
+        if known:
+            weather = [observations[cell][0] for cell in known]
+            # One row per (cell, disease) pair, scored in a single batch
+            pairs = (
+                np.repeat([w.humidity for w in weather], len(diseases)),
+                np.repeat([w.temperature for w in weather], len(diseases)),
+                np.repeat([w.description for w in weather], len(diseases))
+            )
+            if confidence is None:
+                scores, levels = RiskEngine.score_conditions(np.tile(diseases, len(known)), *pairs)
+            else:
+                scores, levels = RiskEngine.calculate_risk_batch(
+                    np.tile(diseases, len(known)),
+                    np.full(len(known) * len(diseases), confidence),
+                    *pairs
+                )
+            scores = scores.reshape(len(known), len(diseases))
+            levels = levels.reshape(len(known), len(diseases))
+            self.cells_scored += len(known)
+        
+        now = time.monotonic()
+        rows_of_known = {cell: index for index, cell in enumerate(known)}
+        grid = []
+        for cell in cells:
+            south, north, west, east = geohash_bounds(cell)
+            entry = {
+                "geohash": cell,
+                "bounds": {"south": south, "north": north, "west": west, "east": east},
+                "source": None,
+                "weather": None,
+                "risk": None,
+                "top_disease": None,
+                "top_risk": None,
+                "top_level": None,
+            }
+            index = rows_of_known.get(cell)
+            if index is not None:
+                weather, fetched_at = observations[cell]
+                top = int(np.argmax(scores[index]))
+                entry.update({
+                    "source": weather.source if weather.source == "demo" else (
+                        "cache" if now - fetched_at < self.service.cache_ttl else "stale"
+                    ),
+                    "weather": {
+                        "temperature": weather.temperature,
+                        "humidity": weather.humidity,
+                        "description": weather.description,
+                    },
+                    "risk": dict(zip(diseases, scores[index].tolist())),
+                    "top_disease": diseases[top],
+                    "top_risk": float(scores[index, top]),
+                    "top_level": str(levels[index, top]),
+                })
+            grid.append(entry)
+        
+        return {
+            "rows": rows,
+            "cols": cols,
+            "precision": self.service.cache_precision,
+            "score": "conditions" if confidence is None else "risk",
+            "confidence": confidence,
+            "diseases": diseases,
+            "missing": len(cells) - len(known),
+            "cells": grid,
+        }
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached_areas": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "cells_scored": self.cells_scored,
+            "fill_rate": self.fill_rate,
+            "backlog": len(self._backlog),
+            "filled": self.filled,
+            "fill_failed": self.fill_failed,
+            "dropped": self.dropped,
+        }
+    
+    async def close(self):
+        self._backlog.clear()
+        if self._filler is not None:
+            self._filler.cancel()
+            try:
+                await self._filler
+            except asyncio.CancelledError:
+                pass
+            self._filler = None
+
+
+_heatmap_instance: RiskHeatmap | None = None
+
+
+def get_risk_heatmap() -> RiskHeatmap:
+    """Get or create the shared risk heatmap"""
+    global _heatmap_instance
+    
+    if _heatmap_instance is None:
+        settings = get_settings()
+        _heatmap_instance = RiskHeatmap(
+            max_cells=settings.risk_heatmap_max_cells,
+            max_fetch=settings.risk_heatmap_max_fetch,
+            cache_size=settings.risk_heatmap_cache_size,
+            fill_rate=settings.risk_heatmap_fill_rate,
+            backlog_size=settings.risk_heatmap_backlog
+        )
+    
+    return _heatmap_instance
+
+
+async def shutdown_risk_heatmap():
+    """Stop the background fill (called from the app lifespan)"""
+    global _heatmap_instance
+    if _heatmap_instance is not None:
+        await _heatmap_instance.close()
+        _heatmap_instance = None
@@ -0,0 +1,314 @@
+"""
+AgroSentinel Field Surveys
+Bulk analysis of geotagged scout/drone photos. Entries are read from the
+uploaded files and ZIP archives on demand, located from their EXIF GPS tags and
+scored concurrently so the micro-batcher fills real batches; weather is looked
+up once per grid cell and the diagnoses are written with bulk inserts.
+"""
+
+import asyncio
+import io
+import os
+import threading
+import time
+import zipfile
+from collections import Counter
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from PIL import Image
+from app.models.schemas import DiagnosisRecord, Location, WeatherData
+from app.services.database import Database
+from app.services.disease_data import REMEDIES, get_disease_info
+from app.services.risk_engine import RiskEngine
+from app.services.translations import get_disease_name, get_risk_level_name
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+
+# EXIF GPS IFD and its tags
+GPS_IFD = 0x8825
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+
+DEFAULT_REMEDY = {
+    "spray": "Consult local agricultural officer",
+    "repeat": "N/A",
+    "precautions": "Monitor crop closely"
+}
+
+
+def _dms_to_degrees(dms, ref) -> float:
+    degrees, minutes, seconds = (float(value) for value in dms)
+    value = degrees + minutes / 60 + seconds / 3600
+    if isinstance(ref, bytes):
+        ref = ref.decode(errors="ignore")
+    return -value if str(ref).strip().upper() in ("S", "W") else value
+
+
+def read_gps(image_bytes: bytes) -> Optional[tuple[float, float]]:
+    """(latitude, longitude) from a photo's EXIF GPS tags, None if untagged"""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            gps = img.getexif().get_ifd(GPS_IFD)
+        if GPS_LATITUDE not in gps or GPS_LONGITUDE not in gps:
+            return None
+        latitude = _dms_to_degrees(gps[GPS_LATITUDE], gps.get(GPS_LATITUDE_REF, "N"))
+        longitude = _dms_to_degrees(gps[GPS_LONGITUDE], gps.get(GPS_LONGITUDE_REF, "E"))
+    except Exception:
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    if latitude == 0 and longitude == 0:
+        return None  # Cameras without a fix often write zeros
+    return latitude, longitude
+
+
+class SurveyFiles:
+    """
+    The image entries of a survey upload: plain image files plus the images
+    inside any ZIP archives. Entries are (name, path, member) and are only
+    read when processed, so a large archive is never held in memory.
+    """
+    
+    def __init__(self, uploads: list[tuple[str, str]], max_files: int, max_image_bytes: int):
+        self.max_image_bytes = max_image_bytes
+        self.entries: list[tuple[str, str, Optional[str]]] = []
+        self._archives: dict[str, zipfile.ZipFile] = {}
+        self._lock = threading.Lock()
+        
+        for name, path in uploads:
+            if zipfile.is_zipfile(path):
+                archive = zipfile.ZipFile(path)
+                self._archives[path] = archive
+                for info in archive.infolist():
+                    member = info.filename
+                    if info.is_dir() or not member.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    if member.startswith("__MACOSX/") or os.path.basename(member).startswith("."):
+                        continue
+                    self.entries.append((member, path, member))
+            elif name.lower().endswith(IMAGE_EXTENSIONS):
+                self.entries.append((name, path, None))
+            if len(self.entries) > max_files:
+                self.close()
+                raise ValueError(f"Survey has more than {max_files} photos")
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def name(self, index: int) -> str:
+        return self.entries[index][0]
+    
+    def read(self, index: int) -> bytes:
+        _, path, member = self.entries[index]
+        if member is None:
+            if os.path.getsize(path) > self.max_image_bytes:
+                raise ValueError("Photo too large")
+            with open(path, "rb") as f:
+                return f.read()
+        
+        archive = self._archives[path]
+        info = archive.getinfo(member)
+        # Declared size check guards against zip bombs before decompressing
+        if info.file_size > self.max_image_bytes:
+            raise ValueError("Photo too large")
+        with self._lock:
+            return archive.read(info)
+    
+    def close(self):
+        for archive in self._archives.values():
+            archive.close()
+        self._archives = {}
+
+
+class WeatherCells:
+    """
+    One weather lookup per grid cell: photos from the same patch of field
+    share the result, and concurrent requests for a cell share one call.
+    """
+    
+    def __init__(self, weather_service, cell_deg: float):
+        self.weather_service = weather_service
+        self.cell_deg = cell_deg
+        self._cells: dict[tuple[int, int], asyncio.Task] = {}
+    
+    def cell(self, latitude: float, longitude: float) -> tuple[int, int]:
+        return round(latitude / self.cell_deg), round(longitude / self.cell_deg)
+    
+    async def get(self, latitude: float, longitude: float) -> WeatherData:
+        key = self.cell(latitude, longitude)
+        task = self._cells.get(key)
+        if task is None:
+            # Look up at the cell centre so every photo in the cell gets the same answer
+            task = asyncio.ensure_future(self.weather_service.get_weather(
+                round(key[0] * self.cell_deg, 6), round(key[1] * self.cell_deg, 6)
+            ))
+            self._cells[key] = task
+        return await asyncio.shield(task)
+    
+    @property
+    def lookups(self) -> int:
+        return len(self._cells)
+    
+    def close(self):
+        for task in self._cells.values():
+            task.cancel()
+
+
+class SurveySummary:
+    """Running totals for a survey (kept instead of the features when streaming)"""
+    
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.geotagged = 0
+        self.located = 0
+        self.saved = 0
+        self.diseases: Counter = Counter()
+        self.risk_levels: Counter = Counter()
+        self.started = time.perf_counter()
+    
+    def add(self, feature: dict):
+        self.done += 1
+        properties = feature["properties"]
+        if "error" in properties:
+            self.failed += 1
+            return
+        self.geotagged += properties["location_source"] == "exif"
+        self.located += feature["geometry"] is not None
+        self.diseases[properties["disease"]] += 1
+        if properties["risk_level"]:
+            self.risk_levels[properties["risk_level"]] += 1
+    
+    def to_dict(self, weather_lookups: int) -> dict:
+        return {
+            "total": self.total,
+            "analyzed": self.done - self.failed,
+            "failed": self.failed,
+            "geotagged": self.geotagged,
+            "located": self.located,
+            "saved": self.saved,
+            "weather_lookups": weather_lookups,
+            "diseases": dict(self.diseases.most_common()),
+            "risk_levels": dict(self.risk_levels),
+            "elapsed_seconds": round(time.perf_counter() - self.started, 2),
+        }
+
+
+def _load_entry(files: SurveyFiles, index: int) -> tuple[bytes, Optional[tuple[float, float]]]:
+    image_bytes = files.read(index)
+    return image_bytes, read_gps(image_bytes)
+
+
+async def analyze_entry(
+    files: SurveyFiles,
+    index: int,
+    predict: Callable[[bytes], Awaitable[tuple]],
+    weather: WeatherCells,
+    lang: str = "en",
+    default_location: Optional[tuple[float, float]] = None
+) -> tuple[dict, Optional[DiagnosisRecord]]:
+    """Score one survey photo: a GeoJSON feature plus the record to store (if located)"""
+    name = files.name(index)
+    try:
+        image_bytes, location = await asyncio.to_thread(_load_entry, files, index)
+        location_source = "exif" if location else None
+        if location is None and default_location is not None:
+            location, location_source = default_location, "default"
+        
+        disease, confidence, _, is_confident, _ = await predict(image_bytes)
+    except Exception as e:
+        return {
+            "type": "Feature",
+            "geometry": None,
+            "properties": {"index": index, "filename": name, "error": str(e)},
+        }, None
+    
+    disease_info = get_disease_info(disease)
+    properties = {
+        "index": index,
+        "filename": name,
+        "location_source": location_source,
+        "disease": disease,
+        "display_name": get_disease_name(disease, lang),
+        "confidence": confidence,
+        "crop": disease_info["crop"],
+        "is_healthy": disease_info["is_healthy"],
+        "severity": disease_info["severity"],
+        "is_confident": is_confident,
+        "risk_score": None,
+        "risk_level": None,
+        "risk_level_display": None,
+        "weather": None,
+    }
+    if location is None:
+        return {"type": "Feature", "geometry": None, "properties": properties}, None
+    
+    latitude, longitude = location
+    weather_data = await weather.get(latitude, longitude)
+    risk_score, risk_level = RiskEngine.calculate_risk(disease, confidence, weather_data)
+    properties.update({
+        "risk_score": risk_score,
+        "risk_level": risk_level,
+        "risk_level_display": get_risk_level_name(risk_level, lang),
+        "weather": weather_data.model_dump(),
+    })
+    record = DiagnosisRecord(
+        location=Location(latitude=latitude, longitude=longitude),
+        disease=disease,
+        confidence=confidence,
+        weather=weather_data,
+        risk_score=risk_score,
+        remedy=REMEDIES.get(disease, DEFAULT_REMEDY)
+    )
+    feature = {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [round(longitude, 7), round(latitude, 7)]},
+        "properties": properties,
+    }
+    return feature, record
+
+
+async def run_survey(
+    files: SurveyFiles,
+    predict: Callable[[bytes], Awaitable[tuple]],
+    weather: WeatherCells,
+    summary: SurveySummary,
+    lang: str = "en",
+    default_location: Optional[tuple[float, float]] = None,
+    concurrency: int = 16,
+    insert_batch: int = 100,
+    indexes: Optional[list[int]] = None
+) -> AsyncIterator[dict]:
+    """
+    Yield a GeoJSON feature per photo as each finishes (completion order).
+    Up to `concurrency` photos are in flight at once - enough for the batcher
+    to merge them into full batches while memory stays bounded. `indexes`
+    limits the run to some entries (e.g. those a resumed job hasn't done).
+    """
+    slots = asyncio.Semaphore(concurrency)
+    pending_records: list[DiagnosisRecord] = []
+    
+    async def process(index: int):
+        async with slots:
+            return await analyze_entry(files, index, predict, weather, lang, default_location)
+    
+    if indexes is None:
+        indexes = range(len(files))
+    tasks = [asyncio.create_task(process(index)) for index in indexes]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            feature, record = await next_done
+            summary.add(feature)
+            if record is not None:
+                pending_records.append(record)
+                if len(pending_records) >= insert_batch:
+                    summary.saved += await Database.save_diagnoses(pending_records)
+                    pending_records = []
+            yield feature
+        if pending_records:
+            summary.saved += await Database.save_diagnoses(pending_records)
+    finally:
+        for task in tasks:
+            task.cancel()
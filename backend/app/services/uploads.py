@@ -0,0 +1,29 @@
+"""
+AgroSentinel Upload Spooling
+Large uploads are streamed to temp files instead of being read into memory
+"""
+
+import asyncio
+import os
+import tempfile
+from fastapi import HTTPException, UploadFile
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+async def save_upload(file: UploadFile, max_bytes: int, prefix: str = "upload_") -> str:
+    """Stream an upload to a temp file, rejecting it with 413 past max_bytes"""
+    suffix = os.path.splitext(file.filename or "")[1].lower() or ".img"
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix=prefix)
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise HTTPException(413, f"Upload larger than {max_bytes // (1024 * 1024)} MB")
+                await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
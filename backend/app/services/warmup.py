@@ -0,0 +1,102 @@
+"""
+AgroSentinel Model Warm-up
+Loads a model and runs dummy batches at every batch size the server uses,
+so the first real scan doesn't pay for session creation and first-run
+kernel setup. Used at startup (driving the /ready endpoint) and before
+every model hot swap.
+"""
+
+import asyncio
+import time
+from app.services.inference import CascadeInference, get_inference, get_predictor
+from app.services.batching import TTA_ROWS, get_batcher
+
+
+class Readiness:
+    ready: bool = False
+    warming: bool = False
+    error: str | None = None
+    batch_sizes: list[int] = []
+    warmup_seconds: float | None = None
+    
+    @classmethod
+    def status(cls) -> dict:
+        return {
+            "ready": cls.ready,
+            "warming": cls.warming,
+            "error": cls.error,
+            "warmed_batch_sizes": cls.batch_sizes,
+            "warmup_seconds": cls.warmup_seconds,
+        }
+
+
+def warmup_batch_sizes(inference, batch_sizes: list[int], batching: bool) -> list[int]:
+    """
+    Every batch size the serving path will send to session.run. With batching
+    the micro-batcher pads each combined batch up to one of batch_sizes;
+    without it each upload runs on its own (mosaic tile batches without
+    batching keep whatever size the mosaic gives them).
+    """
+    if not inference.supports_batching:
+        # Fixed batch-1 models score row by row
+        return [1]
+    if batching:
+        return list(batch_sizes)
+    if getattr(inference, "graph_tta_variants", 0):
+        # One row per upload; the graph expands it to every variant
+        return [1]
+    if inference.tta_mode == "adaptive":
+        # Original-only first pass, then the remaining variants on escalation
+        return [1, TTA_ROWS - 1, TTA_ROWS]
+    return [TTA_ROWS]
+
+
+async def warm_model(model_path: str) -> list[int]:
+    """
+    Load a model (and its cascade student, if any) off the event loop and run
+    dummy batches at every batch size the serving path will use. Returns the
+    warmed batch sizes of the full model.
+    """
+    # Model loading (ORT session creation) is blocking
+    predictor = await asyncio.to_thread(get_predictor, model_path)
+    inference = get_inference(model_path)
+    if not hasattr(inference, "run_batch"):
+        return []
+    
+    batcher = get_batcher()
+    sizes = warmup_batch_sizes(inference, batcher.batch_sizes, batcher.enabled)
+    await _run_dummy_batches(batcher.executor, model_path, inference, sizes)
+    
+    if isinstance(predictor, CascadeInference):
+        # The student only ever scores single originals, merged and padded by the batcher
+        student = predictor.student
+        student_sizes = batcher.batch_sizes if batcher.enabled and student.supports_batching else [1]
+        await _run_dummy_batches(batcher.executor, predictor.student_path, student, student_sizes)
+    return sizes
+
+
+async def _run_dummy_batches(executor, model_path: str, inference, sizes: list[int]):
+    # Process pools hold one model per worker - warm each of them
+    rounds = executor.max_workers if executor.use_processes else 1
+    for size in sizes:
+        dummy = inference.make_dummy_batch(size)
+        await asyncio.gather(*[executor.run_batch(model_path, dummy) for _ in range(rounds)])
+
+
+async def warm_up_model(model_path: str):
+    """Load and warm the startup model, then mark the server ready"""
+    Readiness.ready = False
+    Readiness.warming = True
+    Readiness.error = None
+    started = time.perf_counter()
+    
+    try:
+        Readiness.batch_sizes = await warm_model(model_path)
+        Readiness.warmup_seconds = round(time.perf_counter() - started, 2)
+        Readiness.ready = True
+        print(f"✓ Model warm-up done in {Readiness.warmup_seconds}s (batch sizes: {Readiness.batch_sizes})")
+    except Exception as e:
+        Readiness.error = str(e)
+        print(f"⚠ Model warm-up failed: {e}")
+    finally:
+        Readiness.warming = False
@@ -0,0 +1,152 @@
+"""
+AgroSentinel Weather Prefetcher
+Keeps the weather cache warm for regions with recent traffic, so the first
+analyze in a busy cell is a local hit and upstream calls are spread evenly
+instead of bursting when many entries expire together
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+from app.config import get_settings
+from app.services.database import Database
+from app.services.weather_service import WeatherService, get_weather_service
+
+
+class WeatherPrefetcher:
+    """
+    Background task refreshing active weather cells ahead of expiry.
+    
+    A cell is active while it has been looked up within active_window seconds
+    (the service's in-memory demand counter, seeded from recent diagnoses in
+    the database at start). Every `interval` seconds the busiest active cells
+    that would go stale before the next cycle are refreshed one at a time, at
+    most `rate` upstream calls per second and max_cells per cycle. Calls and
+    cycles are paced against monotonic schedules, so a cycle's calls fit
+    within its interval and the configured rate is what's actually achieved.
+    """
+    
+    def __init__(
+        self,
+        service: WeatherService,
+        interval: float = 60.0,
+        rate: float = 0.5,
+        active_window: float = 3 * 3600,
+        max_cells: int = 200
+    ):
+        self.service = service
+        self.interval = interval
+        self.rate = rate
+        self.active_window = active_window
+        self.max_cells = max_cells
+        self._task: asyncio.Task | None = None
+        
+        # Metrics
+        self.cycles = 0
+        self.refreshed = 0
+        self.failed = 0
+        self.deferred = 0  # due cells left for the next cycle by the rate limit
+        self.last_cycle_at: float | None = None
+        self.last_active_cells = 0
+    
+    @property
+    def enabled(self) -> bool:
+        service = self.service
+        return self.interval > 0 and self.rate > 0 and service.cache_ttl > 0 and not service.demo_mode
+    
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def _run(self):
+        await self._seed()
+        # Cycles start every `interval` seconds, however long the last one took
+        next_cycle = time.monotonic()
+        while True:
+            try:
+                await self._cycle()
+            except Exception as e:
+                print(f"⚠ Weather prefetch failed: {e}")
+            next_cycle = max(next_cycle + self.interval, time.monotonic())
+            await asyncio.sleep(next_cycle - time.monotonic())
+    
+    async def _seed(self):
+        """Count recent diagnoses as demand so a restart doesn't start cold"""
+        since = datetime.utcnow() - timedelta(seconds=self.active_window)
+        locations = await Database.get_recent_locations(since)
+        for latitude, longitude in locations:
+            self.service.note_location(latitude, longitude)
+        if locations:
+            print(f"  Weather prefetch seeded with {len(locations)} recent diagnosis locations")
+    
+    async def _cycle(self):
+        self.cycles += 1
+        self.last_cycle_at = time.time()
+        active = self.service.active_cells(self.active_window)
+        self.last_active_cells = len(active)
+        
+        # Refresh what would otherwise expire before the next cycle
+        budget = min(self.max_cells, max(1, int(self.rate * self.interval)))
+        due = [cell for cell in active if self.service.expires_in(cell) < self.interval]
+        self.deferred += max(0, len(due) - budget)
+        
+        # Calls start 1/rate apart; the time a call takes counts towards the gap
+        next_call = time.monotonic()
+        for cell in due[:budget]:
+            await asyncio.sleep(next_call - time.monotonic())
+            next_call = max(next_call + 1.0 / self.rate, time.monotonic())
+            weather = await self.service.refresh_cell(cell)
+            if weather is None:
+                self.failed += 1
+            else:
+                self.refreshed += 1
+    
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "interval": self.interval,
+            "rate": self.rate,
+            "cycles": self.cycles,
+            "active_cells": self.last_active_cells,
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "deferred": self.deferred,
+            "last_cycle_at": self.last_cycle_at,
+        }
+    
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+_prefetcher_instance: WeatherPrefetcher | None = None
+
+
+def get_weather_prefetcher() -> WeatherPrefetcher:
+    """Get or create the shared weather prefetcher"""
+    global _prefetcher_instance
+    
+    if _prefetcher_instance is None:
+        settings = get_settings()
+        _prefetcher_instance = WeatherPrefetcher(
+            get_weather_service(),
+            interval=settings.weather_prefetch_interval,
+            rate=settings.weather_prefetch_rate,
+            active_window=settings.weather_prefetch_window,
+            max_cells=settings.weather_prefetch_max_cells
+        )
+    
+    return _prefetcher_instance
+
+
+async def shutdown_weather_prefetcher():
+    """Stop the prefetch task (called from the app lifespan)"""
+    global _prefetcher_instance
+    if _prefetcher_instance is not None:
+        await _prefetcher_instance.close()
+        _prefetcher_instance = None
@@ -1,47 +1,567 @@
+import asyncio
+import time
+from collections import OrderedDict
 import aiohttp
+import numpy as np
+from app.config import get_settings
 from app.models.schemas import WeatherData
 
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int = 5) -> str:
+    """Geohash of a point (precision 5 is a cell of about 4.9 x 4.9 km)"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        value, bounds = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            bounds[0] = mid
+        else:
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def geohash_bounds(geohash: str) -> tuple[float, float, float, float]:
+    """(south, north, west, east) of a geohash cell"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            bounds = lon_range if even else lat_range
+            mid = (bounds[0] + bounds[1]) / 2
+            if bits >> shift & 1:
+                bounds[0] = mid
+            else:
+                bounds[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def geohash_center(geohash: str) -> tuple[float, float]:
+    """(latitude, longitude) of a geohash cell's centre"""
+    south, north, west, east = geohash_bounds(geohash)
+    return (south + north) / 2, (west + east) / 2
+
+
+def geohash_grid(south: float, north: float, west: float, east: float, precision: int, max_cells: int) -> tuple[int, int, list[str]]:
+    """
+    (rows, cols, cells) of the geohash cells covering a bounding box, row by
+    row from the south-west corner (ValueError past max_cells)
+    """
+    cell_south, cell_north, cell_west, cell_east = geohash_bounds(geohash_encode(south, west, precision))
+    lat_step, lon_step = cell_north - cell_south, cell_east - cell_west
+    rows = max(1, int(np.ceil((north - cell_south) / lat_step)))
+    cols = max(1, int(np.ceil((east - cell_west) / lon_step)))
+    if rows * cols > max_cells:
+        raise ValueError(f"Area covers {rows * cols} weather cells (max {max_cells}) - zoom in")
+    cells = [
+        geohash_encode(
+            min(cell_south + (row + 0.5) * lat_step, 90.0),
+            (cell_west + (col + 0.5) * lon_step + 180.0) % 360.0 - 180.0,
+            precision
+        )
+        for row in range(rows) for col in range(cols)
+    ]
+    return rows, cols, cells
+
+
+class Forecast:
+    """
+    Upcoming forecast slots (3-hourly from OpenWeatherMap) as parallel arrays,
+    ready for vectorized risk scoring.
+    """
+    
+    def __init__(
+        self,
+        times: np.ndarray,
+        humidity: np.ndarray,
+        temperature: np.ndarray,
+        wind_speed: np.ndarray,
+        descriptions: list[str],
+        source: str = "live"
+    ):
+        self.times = times  # unix seconds (UTC)
+        self.humidity = humidity
+        self.temperature = temperature
+        self.wind_speed = wind_speed
+        self.descriptions = descriptions
+        self.source = source
+    
+    @property
+    def rain(self) -> np.ndarray:
+        return np.array(["rain" in description.lower() for description in self.descriptions], dtype=bool)
+    
+    def __len__(self) -> int:
+        return len(self.times)
+    
+    def with_source(self, source: str) -> "Forecast":
+        return Forecast(self.times, self.humidity, self.temperature, self.wind_speed, self.descriptions, source)
+    
+    @classmethod
+    def from_response(cls, data: dict) -> "Forecast":
+        slots = data["list"]
+        return cls(
+            np.array([slot["dt"] for slot in slots], dtype=np.int64),
+            np.array([slot["main"]["humidity"] for slot in slots], dtype=np.int64),
+            np.array([slot["main"]["temp"] for slot in slots], dtype=np.float64),
+            np.array([slot["wind"]["speed"] for slot in slots], dtype=np.float64),
+            [slot["weather"][0]["description"] for slot in slots]
+        )
+    
+    @classmethod
+    def demo(cls, slots: int = 40, step: int = 3 * 3600) -> "Forecast":
+        """Diurnal cycle around the demo-mode observation"""
+        start = int(time.time()) // step * step + step
+        times = start + step * np.arange(slots, dtype=np.int64)
+        phase = 2 * np.pi * ((times % 86400) / 86400 - 0.375)  # warmest mid-afternoon UTC
+        temperature = np.round(28.0 + 5.0 * np.sin(phase), 1)
+        humidity = np.clip(np.round(65 - 15 * np.sin(phase)), 0, 100).astype(np.int64)
+        descriptions = ["light rain" if h > 78 else "partly cloudy" for h in humidity]
+        return cls(times, humidity, temperature, np.full(slots, 3.5), descriptions, source="demo")
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. After failure_threshold failures in a
+    row the circuit opens and calls are refused for reset_timeout seconds;
+    then a single trial call is let through (half-open) and its outcome
+    closes or re-opens the circuit.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        
+        # Metrics
+        self.opens = 0
+        self.rejected = 0
+    
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        self.rejected += 1
+        return False
+    
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_running = False
+    
+    def release(self):
+        """A call ended without an outcome (cancelled) - a later call may run the trial"""
+        self._trial_running = False
+    
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opens += 1
+                print(f"⚠ Weather circuit opened after {self.failures} failure(s) - serving cached weather for {self.reset_timeout:.0f}s")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+    
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opens": self.opens,
+            "rejected": self.rejected,
+        }
+
 
 class WeatherService:
+    """
+    OpenWeatherMap client. One long-lived ClientSession is shared by every
+    request, so upstream calls reuse pooled keep-alive connections and cached
+    DNS instead of paying a fresh TCP/TLS handshake each time.
+    
+    Observations are cached per geohash cell (fetched at the cell centre) for
+    cache_ttl seconds. Concurrent misses for a cell share one upstream call,
+    and for a further stale_ttl seconds an expired entry is still served while
+    a background refresh replaces it. Failed lookups are never cached.
+    
+    A request waits at most latency_budget seconds for upstream; a slower
+    fetch keeps running in the background and fills the cache. Failed and
+    over-budget calls trip a circuit breaker, and while it is open no upstream
+    call is made at all. Without a usable answer the last known observation
+    for the cell is served (source "stale"), and only cells never seen fall
+    back to defaults. Every result says where it came from in `source`.
+    """
+    
     BASE_URL = "https://api.openweathermap.org/data/2.5/weather"
+    FORECAST_URL = "https://api.openweathermap.org/data/2.5/forecast"
     
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        timeout: float = 5.0,
+        latency_budget: float = 1.5,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30.0,
+        pool_size: int = 20,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 30.0,
+        cache_precision: int = 5,
+        cache_ttl: float = 600.0,
+        stale_ttl: float = 3600.0,
+        cache_size: int = 4096,
+        forecast_ttl: float = 10800.0
+    ):
         self.api_key = api_key
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.pool_size = pool_size
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.latency_budget = latency_budget
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self._session: aiohttp.ClientSession | None = None
+        
+        self.cache_precision = cache_precision
+        self.cache_ttl = cache_ttl
+        self.stale_ttl = stale_ttl
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, tuple[WeatherData, float]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.forecast_ttl = forecast_ttl
+        self._forecasts: OrderedDict[str, tuple[Forecast, float]] = OrderedDict()
+        self._forecast_inflight: dict[str, asyncio.Task] = {}
+        # Recent demand per cell: [lookups, last lookup] (drives the prefetcher)
+        self._demand: OrderedDict[str, list] = OrderedDict()
+        
+        # Metrics
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0  # misses that joined a fetch already in flight
+        self.upstream_calls = 0
+        self.upstream_failures = 0
+        self.over_budget = 0
+        self.served_stale_on_error = 0
+        self.served_default = 0
+        self.forecast_hits = 0
+        self.forecast_misses = 0
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Create the session lazily so it binds to the running event loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+    
+    async def close(self):
+        for task in [*self._inflight.values(), *self._forecast_inflight.values()]:
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    @property
+    def demo_mode(self) -> bool:
+        return not self.api_key or self.api_key == "demo_mode"
+    
+    def cell(self, latitude: float, longitude: float) -> str:
+        return geohash_encode(latitude, longitude, self.cache_precision)
+    
+    def cached(self, cell: str) -> tuple[WeatherData, float] | None:
+        """A cell's last observation and its time.monotonic() fetch time, whatever its age"""
+        return self._cache.get(cell)
     
     async def get_weather(self, latitude: float, longitude: float) -> WeatherData:
-        if not self.api_key or self.api_key == "demo_mode":
+        if self.demo_mode:
             return WeatherData(
                 humidity=65,
                 temperature=28.0,
                 description="partly cloudy",
-                wind_speed=3.5
+                wind_speed=3.5,
+                source="demo"
             )
         
+        if self.cache_ttl <= 0:
+            self.misses += 1
+            weather = await self._within_budget(asyncio.ensure_future(self._fetch(latitude, longitude)))
+            return weather or self._fallback_weather()
+        
+        cell = self.cell(latitude, longitude)
+        self._record_demand(cell)
+        entry = self._cache.get(cell)
+        if entry is not None:
+            weather, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.cache_ttl:
+                self.hits += 1
+                self._cache.move_to_end(cell)
+                return weather.model_copy(update={"source": "cache"})
+            if age < self.cache_ttl + self.stale_ttl:
+                # Stale-while-revalidate: answer now, refresh behind the request
+                self.stale_hits += 1
+                self._cache.move_to_end(cell)
+                self._refresh(cell)
+                return weather.model_copy(update={"source": "stale"})
+        
+        self.misses += 1
+        if cell in self._inflight:
+            self.coalesced += 1
+        weather = await self._within_budget(self._refresh(cell))
+        if weather is not None:
+            return weather
+        if entry is not None:
+            # Stale-while-error: the last known value beats made-up defaults
+            self.served_stale_on_error += 1
+            return entry[0].model_copy(update={"source": "stale"})
+        return self._fallback_weather()
+    
+    async def _within_budget(self, task: asyncio.Future) -> WeatherData | None:
+        """Wait for a fetch up to the latency budget (it keeps running past it)"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.latency_budget)
+        except asyncio.TimeoutError:
+            self.over_budget += 1
+            return None
+    
+    def _record_demand(self, cell: str, lookups: int = 1):
+        demand = self._demand.get(cell)
+        if demand is None:
+            self._demand[cell] = [lookups, time.monotonic()]
+            while len(self._demand) > self.cache_size:
+                self._demand.popitem(last=False)
+        else:
+            demand[0] += lookups
+            demand[1] = time.monotonic()
+            self._demand.move_to_end(cell)
+    
+    def note_location(self, latitude: float, longitude: float, lookups: int = 1):
+        """Count demand for a location without looking it up (e.g. from stored history)"""
+        self._record_demand(self.cell(latitude, longitude), lookups)
+    
+    def active_cells(self, window: float) -> list[str]:
+        """Cells looked up within the last `window` seconds, busiest first"""
+        cutoff = time.monotonic() - window
+        while self._demand:
+            cell, (_, last_seen) = next(iter(self._demand.items()))
+            if last_seen >= cutoff:
+                break
+            self._demand.popitem(last=False)
+        return sorted(self._demand, key=lambda cell: self._demand[cell][0], reverse=True)
+    
+    def expires_in(self, cell: str) -> float:
+        """Seconds until a cell's cached observation goes stale (negative once it has)"""
+        entry = self._cache.get(cell)
+        if entry is None:
+            return float("-inf")
+        return self.cache_ttl - (time.monotonic() - entry[1])
+    
+    async def refresh_cell(self, cell: str) -> WeatherData | None:
+        """Fetch a cell now, sharing any fetch already in flight"""
+        return await asyncio.shield(self._refresh(cell))
+    
+    def _refresh(self, cell: str) -> asyncio.Task:
+        """Fetch a cell unless a fetch for it is already running (single-flight)"""
+        task = self._inflight.get(cell)
+        if task is None:
+            task = asyncio.create_task(self._fetch_cell(cell))
+            self._inflight[cell] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cell, None))
+        return task
+    
+    async def _fetch_cell(self, cell: str) -> WeatherData | None:
+        weather = await self._fetch(*geohash_center(cell))
+        if weather is not None:
+            self._cache[cell] = (weather, time.monotonic())
+            self._cache.move_to_end(cell)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return weather
+    
+    async def get_forecast(self, latitude: float, longitude: float) -> Forecast | None:
+        """
+        Forecast for the cell (cached for forecast_ttl, same single-flight,
+        latency budget and stale-while-error rules as get_weather); None when
+        no forecast is available at all.
+        """
+        if self.demo_mode:
+            return Forecast.demo()
+        
+        cell = self.cell(latitude, longitude)
+        entry = self._forecasts.get(cell)
+        if entry is not None and time.monotonic() - entry[1] < self.forecast_ttl:
+            self.forecast_hits += 1
+            self._forecasts.move_to_end(cell)
+            return entry[0].with_source("cache")
+        
+        self.forecast_misses += 1
+        task = self._forecast_inflight.get(cell)
+        if task is None:
+            task = asyncio.create_task(self._fetch_forecast_cell(cell))
+            self._forecast_inflight[cell] = task
+            task.add_done_callback(lambda _: self._forecast_inflight.pop(cell, None))
+        forecast = await self._within_budget(task)
+        if forecast is not None:
+            return forecast
+        if entry is not None:
+            return entry[0].with_source("stale")
+        return None
+    
+    async def _fetch_forecast_cell(self, cell: str) -> Forecast | None:
+        data = await self._request(self.FORECAST_URL, *geohash_center(cell))
+        if data is None:
+            return None
+        try:
+            forecast = Forecast.from_response(data)
+        except (KeyError, IndexError, TypeError, ValueError):
+            self.upstream_failures += 1
+            return None
+        self._forecasts[cell] = (forecast, time.monotonic())
+        self._forecasts.move_to_end(cell)
+        while len(self._forecasts) > self.cache_size:
+            self._forecasts.popitem(last=False)
+        return forecast
+    
+    async def _fetch(self, latitude: float, longitude: float) -> WeatherData | None:
+        """Current weather from one upstream call; None when it fails or the circuit is open"""
+        data = await self._request(self.BASE_URL, latitude, longitude)
+        if data is None:
+            return None
+        try:
+            return WeatherData(
+                humidity=data["main"]["humidity"],
+                temperature=data["main"]["temp"],
+                description=data["weather"][0]["description"],
+                wind_speed=data["wind"]["speed"],
+                source="live"
+            )
+        except (KeyError, IndexError, TypeError, ValueError):
+            self.upstream_failures += 1
+            return None
+    
+    async def _request(self, url: str, latitude: float, longitude: float) -> dict | None:
+        """One upstream GET through the circuit breaker; None when it fails or the circuit is open"""
+        if not self.breaker.allow():
+            return None
         params = {
-            "lat": latitude,
-            "lon": longitude,
+            "lat": round(latitude, 4),
+            "lon": round(longitude, 4),
             "appid": self.api_key,
             "units": "metric"
         }
+        self.upstream_calls += 1
+        started = time.monotonic()
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.BASE_URL, params=params, timeout=10) as response:
-                    if response.status != 200:
-                        return self._fallback_weather()
-                    data = await response.json()
-                    return WeatherData(
-                        humidity=data["main"]["humidity"],
-                        temperature=data["main"]["temp"],
-                        description=data["weather"][0]["description"],
-                        wind_speed=data["wind"]["speed"]
-                    )
+            async with self._get_session().get(url, params=params) as response:
+                if response.status != 200:
+                    raise ValueError(f"HTTP {response.status}")
+                data = await response.json()
+        except asyncio.CancelledError:
+            # Client gone or budget expired: no verdict, but don't leave a half-open trial pending
+            self.breaker.release()
+            raise
         except Exception:
-            return self._fallback_weather()
+            self.upstream_failures += 1
+            self.breaker.record_failure()
+            return None
+        
+        # A slow upstream counts against the breaker even when it answers
+        if time.monotonic() - started > self.latency_budget:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return data
+    
+    def stats(self) -> dict:
+        """Cache hit ratio and upstream traffic"""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "cache_entries": len(self._cache),
+            "cache_precision": self.cache_precision,
+            "cache_ttl": self.cache_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else None,
+            "inflight": len(self._inflight),
+            "upstream_calls": self.upstream_calls,
+            "upstream_failures": self.upstream_failures,
+            "latency_budget": self.latency_budget,
+            "over_budget": self.over_budget,
+            "served_stale_on_error": self.served_stale_on_error,
+            "served_default": self.served_default,
+            "circuit": self.breaker.stats(),
+            "forecast_entries": len(self._forecasts),
+            "forecast_hits": self.forecast_hits,
+            "forecast_misses": self.forecast_misses,
+        }
     
     def _fallback_weather(self) -> WeatherData:
+        self.served_default += 1
         return WeatherData(
             humidity=70,
             temperature=25.0,
             description="unknown",
-            wind_speed=2.0
+            wind_speed=2.0,
+            source="default"
         )
+
+
+_weather_instance: WeatherService | None = None
+
+
+def get_weather_service() -> WeatherService:
+    """Get or create the shared weather client"""
+    global _weather_instance
+    
+    if _weather_instance is None:
+        settings = get_settings()
+        _weather_instance = WeatherService(
+            settings.openweathermap_api_key,
+            timeout=settings.weather_timeout,
+            latency_budget=settings.weather_latency_budget,
+            breaker_failures=settings.weather_breaker_failures,
+            breaker_reset=settings.weather_breaker_reset,
+            pool_size=settings.weather_pool_size,
+            dns_cache_ttl=settings.weather_dns_cache_ttl,
+            keepalive_timeout=settings.weather_keepalive_timeout,
+            cache_precision=settings.weather_cache_precision,
+            cache_ttl=settings.weather_cache_ttl,
+            stale_ttl=settings.weather_cache_stale_ttl,
+            cache_size=settings.weather_cache_size,
+            forecast_ttl=settings.weather_forecast_ttl
+        )
+    
+    return _weather_instance
+
+
+async def shutdown_weather_service():
+    """Close the pooled connections (called from the app lifespan)"""
+    global _weather_instance
+    if _weather_instance is not None:
+        await _weather_instance.close()
+        _weather_instance = None
@@ -0,0 +1,67 @@
+"""
+Shared fixtures: tiny ONNX stand-ins for the trained model, so the
+preprocessing paths can be tested without the real weights
+"""
+
+import io
+import numpy as np
+import onnx
+import pytest
+from onnx import TensorProto, helper
+from PIL import Image
+from app.services.inference import DISEASE_CLASSES, EfficientNetInference
+
+
+def make_model(path: str, img_size: int, raw_input: bool = False) -> str:
+    """Global average pool + linear head, in either input layout of the real exports"""
+    num_classes = len(DISEASE_CLASSES)
+    weights = np.random.default_rng(0).normal(size=(3, num_classes)).astype(np.float32)
+    
+    if raw_input:
+        model_input = helper.make_tensor_value_info("input", TensorProto.UINT8, ["batch", img_size, img_size, 3])
+        nodes = [
+            helper.make_node("Cast", ["input"], ["pixels"], to=TensorProto.FLOAT),
+            helper.make_node("ReduceMean", ["pixels"], ["pooled"], axes=[1, 2], keepdims=0),
+        ]
+    else:
+        model_input = helper.make_tensor_value_info("input", TensorProto.FLOAT, ["batch", 3, img_size, img_size])
+        nodes = [helper.make_node("ReduceMean", ["input"], ["pooled"], axes=[2, 3], keepdims=0)]
+    nodes.append(helper.make_node("MatMul", ["pooled", "weights"], ["logits"]))
+    
+    graph = helper.make_graph(
+        nodes,
+        "stand_in",
+        [model_input],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["batch", num_classes])],
+        [helper.make_tensor("weights", TensorProto.FLOAT, weights.shape, weights.ravel())]
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    onnx.save(model, path)
+    return path
+
+
+@pytest.fixture(scope="session", params=["float32_nchw", "uint8_nhwc"])
+def inference(request, tmp_path_factory) -> EfficientNetInference:
+    raw_input = request.param == "uint8_nhwc"
+    path = make_model(str(tmp_path_factory.mktemp("model") / "model.onnx"), 260, raw_input)
+    return EfficientNetInference(
+        path,
+        inference_config={"img_size": 260, "input_format": request.param, "model_version": "test"},
+        session_config={"graph_optimization": "basic"}
+    )
+
+
+def encode(image: Image.Image, format: str = "PNG", **params) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **params)
+    return buffer.getvalue()
+
+
+def random_image(seed: int, size: tuple[int, int], mode: str = "RGB") -> Image.Image:
+    """Smooth random image (noise upsampled), closer to a photo than white noise"""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, size=(size[1] // 8 + 1, size[0] // 8 + 1, 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize(size, Image.BICUBIC)
+    noise = rng.integers(-12, 13, size=(size[1], size[0], 3))
+    image = Image.fromarray(np.clip(np.asarray(image, dtype=np.int16) + noise, 0, 255).astype(np.uint8))
+    return image if mode == "RGB" else image.convert(mode)
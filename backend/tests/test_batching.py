@@ -0,0 +1,98 @@
+"""
+Micro-batching (InferenceBatcher): combined batches padded to the warmed
+sizes, each caller getting back exactly its own rows
+"""
+
+import asyncio
+import numpy as np
+import pytest
+from app.services.batching import InferenceBatcher, padded_batch_sizes
+
+
+class RecordingExecutor:
+    """Scores row i as [row sum, i] and records the batch sizes it was sent"""
+    max_workers = 1
+    use_processes = False
+    
+    def __init__(self):
+        self.sizes = []
+    
+    async def run_batch(self, model_path: str, batch: np.ndarray) -> np.ndarray:
+        self.sizes.append(batch.shape[0])
+        await asyncio.sleep(0)
+        sums = batch.reshape(batch.shape[0], -1).sum(axis=1)
+        return np.stack([sums, np.arange(batch.shape[0])], axis=1)
+
+
+def rows(start: int, count: int) -> np.ndarray:
+    return np.arange(start, start + count, dtype=np.float32)[:, None, None, None] * np.ones((1, 3, 2, 2), np.float32)
+
+
+def test_padded_batch_sizes():
+    assert padded_batch_sizes(32) == [1, 5, 10, 15, 20, 25, 30, 32]
+    assert padded_batch_sizes(5) == [1, 5]
+    assert padded_batch_sizes(1) == [1]
+
+
+@pytest.mark.parametrize("counts, sent", [
+    ([5, 5], [10]),
+    ([5, 4, 1, 3], [15]),  # 13 rows
+    ([1], [1]),
+    ([2], [5]),
+    ([31], [32]),
+])
+def test_combined_batches_are_padded_to_warmed_sizes(counts, sent):
+    async def run():
+        executor = RecordingExecutor()
+        batcher = InferenceBatcher(executor, max_batch_size=32, max_wait_ms=50.0)
+        starts = np.cumsum([0] + counts[:-1])
+        results = await asyncio.gather(*[
+            batcher._score("model", rows(int(start), count)) for start, count in zip(starts, counts)
+        ])
+        await batcher.close()
+        return executor, batcher, starts, results
+    
+    executor, batcher, starts, results = asyncio.run(run())
+    assert executor.sizes == sent
+    assert batcher.rows_padded == sum(sent) - sum(counts)
+    for start, count, logits in zip(starts, counts, results):
+        # Each caller's own rows, in order, with the padding dropped
+        np.testing.assert_array_equal(logits[:, 0], (start + np.arange(count)) * 12)
+        np.testing.assert_array_equal(logits[:, 1], start + np.arange(count))
+
+
+def test_no_padding_for_batch_one_models():
+    async def run():
+        executor = RecordingExecutor()
+        batcher = InferenceBatcher(executor, max_batch_size=32, max_wait_ms=50.0)
+        logits = await batcher._score("model", rows(0, 3), pad=False)
+        await batcher.close()
+        return executor, logits
+    
+    executor, logits = asyncio.run(run())
+    assert executor.sizes == [3]
+    assert logits.shape == (3, 2)
+
+
+class HangingExecutor(RecordingExecutor):
+    async def run_batch(self, model_path: str, batch: np.ndarray) -> np.ndarray:
+        self.sizes.append(batch.shape[0])
+        await asyncio.Event().wait()
+
+
+def test_cancelled_flush_releases_its_callers():
+    async def run():
+        executor = HangingExecutor()
+        batcher = InferenceBatcher(executor, max_batch_size=32, max_wait_ms=1.0)
+        callers = [asyncio.ensure_future(batcher._score("model", rows(i * 5, 5))) for i in range(2)]
+        while not batcher._flushes:
+            await asyncio.sleep(0.005)
+        for flush in list(batcher._flushes):
+            flush.cancel()
+        done, pending = await asyncio.wait(callers, timeout=1.0)
+        await batcher.close()
+        return done, pending
+    
+    done, pending = asyncio.run(run())
+    assert not pending
+    assert all(caller.cancelled() for caller in done)
@@ -0,0 +1,37 @@
+"""
+Cascade escalation rule (CascadeInference.should_escalate): the student's
+answer is kept only when both its confidence and its margin clear the
+thresholds
+"""
+
+import numpy as np
+import pytest
+from app.services.inference import DISEASE_CLASSES, CascadeInference, EfficientNetInference
+from conftest import make_model
+
+
+@pytest.fixture(scope="module")
+def cascade(tmp_path_factory) -> CascadeInference:
+    path = make_model(str(tmp_path_factory.mktemp("cascade") / "model.onnx"), 64)
+    model = EfficientNetInference(
+        path,
+        inference_config={"img_size": 64, "model_version": "test"},
+        session_config={"graph_optimization": "basic"}
+    )
+    return CascadeInference(model, path, model, confidence_threshold=0.6, margin_threshold=0.5)
+
+
+def logits_for(top1: float, top2: float) -> np.ndarray:
+    """Logits whose softmax puts top1 and top2 on the first two classes, the rest spread evenly"""
+    rest = (1.0 - top1 - top2) / (len(DISEASE_CLASSES) - 2)
+    return np.log(np.array([top1, top2] + [rest] * (len(DISEASE_CLASSES) - 2), dtype=np.float32))
+
+
+@pytest.mark.parametrize("top1, top2, escalate", [
+    (0.90, 0.05, False),  # confident, clear margin
+    (0.70, 0.25, True),  # confident, but a near-tie with the runner-up
+    (0.55, 0.04, True),  # clear margin, but not confident
+    (0.40, 0.35, True),  # neither
+])
+def test_escalates_when_either_threshold_is_missed(cascade, top1, top2, escalate):
+    assert cascade.should_escalate(logits_for(top1, top2)) == escalate
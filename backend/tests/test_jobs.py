@@ -0,0 +1,85 @@
+"""
+Job persistence (JobQueue): short result writes are retried or fail the
+job, and uploads lost with the local disk come back from the job store
+"""
+
+import asyncio
+import pytest
+from app.services import jobs
+from app.services.jobs import FileJobStore, JobQueue
+
+
+class ShortWriteStore(FileJobStore):
+    """Stores nothing for the first `short` writes, like a failed insert_many"""
+    
+    def __init__(self, root: str, short: int):
+        super().__init__(root)
+        self.short = short
+        self.attempts = 0
+    
+    async def save_job_results(self, job_id: str, results: list[dict]) -> int:
+        self.attempts += 1
+        if self.attempts <= self.short:
+            return 0
+        return await super().save_job_results(job_id, results)
+
+
+class UploadStore(FileJobStore):
+    """Keeps uploads apart from jobs_dir, as GridFS does"""
+    
+    def __init__(self, root: str, stored: dict[str, bytes]):
+        super().__init__(root)
+        self.stored = stored
+    
+    async def restore_job_uploads(self, job_id, root, names) -> int:
+        found = [name for name in names if name in self.stored]
+        for name in found:
+            (root / name).parent.mkdir(parents=True, exist_ok=True)
+            (root / name).write_bytes(self.stored[name])
+        return len(found)
+
+
+def results(count: int) -> list[dict]:
+    return [{"properties": {"index": index}} for index in range(count)]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(jobs, "RESULT_WRITE_BACKOFF", 0.0)
+
+
+def test_short_result_write_is_retried(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    queue.store = ShortWriteStore(str(tmp_path), short=2)
+    (tmp_path / "job").mkdir()
+    
+    asyncio.run(queue._save_results("job", results(4)))
+    assert queue.store.attempts == 3
+    assert len(asyncio.run(queue.store.get_job_results("job"))) == 4
+
+
+def test_results_that_cannot_be_stored_fail_the_job(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    queue.store = ShortWriteStore(str(tmp_path), short=jobs.RESULT_WRITE_ATTEMPTS)
+    (tmp_path / "job").mkdir()
+    
+    with pytest.raises(RuntimeError, match="0 of 4 saved"):
+        asyncio.run(queue._save_results("job", results(4)))
+
+
+def test_lost_uploads_are_restored(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    queue.store = UploadStore(str(tmp_path), {"uploads/0.jpg": b"photo"})
+    job = {"id": "job", "uploads": [["field.jpg", "uploads/0.jpg"]]}
+    
+    asyncio.run(queue._restore_uploads(job))
+    assert (tmp_path / "job" / "uploads" / "0.jpg").read_bytes() == b"photo"
+
+
+def test_unrecoverable_uploads_fail_the_job(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    queue.store = UploadStore(str(tmp_path), {"uploads/0.jpg": b"photo"})
+    job = {"id": "job", "uploads": [["a.jpg", "uploads/0.jpg"], ["b.jpg", "uploads/1.jpg"]]}
+    
+    with pytest.raises(RuntimeError, match="1 of the job's uploads are gone"):
+        asyncio.run(queue._restore_uploads(job))
@@ -0,0 +1,68 @@
+"""
+Reduced-resolution decoding (EfficientNetInference.load_image) across image
+modes and formats, against a plain full-resolution decode
+"""
+
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from conftest import encode, random_image
+
+# (mode, format) pairs large enough to take the reduce path
+MODES = [
+    ("1", "PNG"),
+    ("L", "PNG"),
+    ("LA", "PNG"),
+    ("P", "PNG"),
+    ("RGB", "PNG"),
+    ("RGBA", "PNG"),
+    ("I;16", "PNG"),
+    ("I;16", "TIFF"),
+    ("I", "TIFF"),
+    ("F", "TIFF"),
+    ("CMYK", "TIFF"),
+    ("CMYK", "JPEG"),
+    ("L", "JPEG"),
+    ("RGB", "JPEG"),
+    ("RGB", "WEBP"),
+]
+
+
+def make_image(mode: str) -> Image.Image:
+    image = random_image(7, (1400, 1100))
+    if mode in ("I;16", "I", "F"):
+        # Values within 0-255, so conversion to RGB keeps the picture
+        return Image.fromarray(np.asarray(image.convert("L"), dtype=np.uint16)).convert(mode)
+    return image.convert(mode)
+
+
+def baseline(inference, data: bytes) -> np.ndarray:
+    """Decode as before reduced-resolution loading: full size, then RGB"""
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    return np.asarray(inference.smart_preprocess(image), dtype=np.float32)
+
+
+@pytest.mark.parametrize("mode,format", MODES, ids=[f"{mode}-{format}" for mode, format in MODES])
+def test_load_image_handles_mode(inference, mode, format):
+    data = encode(make_image(mode), format)
+    image = inference.smart_preprocess(inference.load_image(data))
+    
+    assert image.mode == "RGB"
+    assert image.size == (inference.img_size, inference.img_size)
+    # Same picture as a full-resolution decode (bilevel images average their dithering)
+    difference = np.abs(np.asarray(image, dtype=np.float32) - baseline(inference, data)).mean()
+    assert difference < (20 if mode == "1" else 3)
+
+
+@pytest.mark.parametrize("format", ["JPEG", "PNG", "TIFF"])
+@pytest.mark.parametrize("mode", ["RGB", "P"])
+def test_load_image_applies_exif_orientation(inference, format, mode):
+    if format == "JPEG" and mode == "P":
+        pytest.skip("JPEG has no palette mode")
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotated 90 degrees clockwise
+    data = encode(make_image(mode), format, exif=exif)
+    
+    image = inference.load_image(data)
+    assert image.width < image.height
@@ -0,0 +1,65 @@
+"""
+The vectorized risk paths (RiskEngine.calculate_risk_batch, score_conditions)
+against the scalar calculate_risk
+"""
+
+import itertools
+import numpy as np
+from app.models.schemas import WeatherData
+from app.services.risk_engine import HEALTHY_CLASSES, RiskEngine, THRESHOLD_DISEASES
+
+HUMIDITY = [30, 55, 65, 80, 86, 95]
+TEMPERATURE = [5.0, 12.5, 22.0, 28.0, 33.0, 41.0]
+DESCRIPTIONS = ["clear sky", "light rain", "Heavy Rain", "overcast clouds"]
+
+# Every threshold value, and either side of it
+EDGE_HUMIDITY = sorted({h + d for h in [40, 50, 60, 70, 75, 80, 85] for d in (-1, 0, 1)})
+EDGE_TEMPERATURE = sorted({t + d for t in [10, 15, 20, 25, 30, 35, 40] for d in (-0.5, 0.0, 0.5)})
+CONFIDENCES = [0.0, 0.35, 0.5, 0.75, 0.99, 1.0]
+
+
+def weather_grid() -> list[tuple]:
+    return list(itertools.product(THRESHOLD_DISEASES, HUMIDITY, TEMPERATURE, DESCRIPTIONS))
+
+
+def test_batch_matches_calculate_risk():
+    diseases = THRESHOLD_DISEASES + HEALTHY_CLASSES + ["unknown_disease"]
+    rows = list(itertools.product(diseases, CONFIDENCES, EDGE_HUMIDITY, EDGE_TEMPERATURE, ["clear sky", "Light Rain"]))
+    disease, confidence, humidity, temperature, description = zip(*rows)
+    scores, levels = RiskEngine.calculate_risk_batch(disease, confidence, humidity, temperature, description)
+    
+    assert len(scores) == len(levels) == len(rows)
+    for row, score, level in zip(rows, scores.tolist(), levels.tolist()):
+        disease, confidence, h, t, description = row
+        weather = WeatherData(temperature=t, humidity=h, description=description, wind_speed=0.0, source="test")
+        assert (score, level) == RiskEngine.calculate_risk(disease, confidence, weather), row
+
+
+def test_batch_of_nothing():
+    scores, levels = RiskEngine.calculate_risk_batch([], [], [], [], [])
+    assert scores.shape == levels.shape == (0,)
+
+
+def test_scores_are_the_weather_share_of_calculate_risk():
+    rows = weather_grid()
+    diseases, humidity, temperature, descriptions = zip(*rows)
+    scores, levels = RiskEngine.score_conditions(diseases, humidity, temperature, descriptions)
+    
+    for row, score in zip(rows, scores):
+        disease, h, t, description = row
+        weather = WeatherData(temperature=t, humidity=h, description=description, wind_speed=0.0, source="test")
+        # With zero confidence the combined risk is the weather term alone (0.4 * share)
+        combined, _ = RiskEngine.calculate_risk(disease, 0.0, weather)
+        assert score == round(combined / 0.4, 3), row
+
+
+def test_weather_alone_never_reaches_critical():
+    diseases, humidity, temperature, descriptions = zip(*weather_grid())
+    scores, levels = RiskEngine.score_conditions(diseases, humidity, temperature, descriptions)
+    
+    assert "CRITICAL" not in set(levels.tolist())
+    assert set(levels[scores <= 1 / 3].tolist()) == {"LOW"}
+    assert set(levels[scores == 1].tolist()) == {"HIGH"}
+    # Dry, cold weather scores nothing for any disease
+    dry, _ = RiskEngine.score_conditions(THRESHOLD_DISEASES, [20] * 12, [0.0] * 12, ["clear sky"] * 12)
+    np.testing.assert_array_equal(dry, 0.0)
@@ -0,0 +1,56 @@
+"""
+The vectorized TTA batch (prepare_batch) against the PIL reference path
+(prepare_batch_pil): the same pixels up to PIL's own rounding
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+from conftest import encode, random_image
+
+# Variant order of get_tta_images / get_tta_batch
+ORIGINAL, FLIP, ROTATE, BRIGHTNESS, ZOOM = range(5)
+
+
+def to_levels(inference, batch: np.ndarray) -> np.ndarray:
+    """Model input rows back to uint8 [N,H,W,3] pixel levels"""
+    if inference.raw_input:
+        return batch.astype(np.int16)
+    pixels = (batch + inference.norm_bias) / inference.norm_scale
+    return np.rint(pixels).astype(np.int16).transpose(0, 2, 3, 1)
+
+
+def upload(seed: int) -> bytes:
+    """Random sizes and aspect ratios, as PNG and JPEG, some with an EXIF rotation"""
+    rng = np.random.default_rng(seed)
+    size = (int(rng.integers(200, 1400)), int(rng.integers(200, 1400)))
+    image = random_image(seed, size)
+    if seed % 2:
+        return encode(image)
+    exif = Image.Exif()
+    exif[0x0112] = (6, 8, 3, 1)[seed // 2 % 4]  # Orientation: rotate 90/270/180, none
+    return encode(image, "JPEG", quality=90, exif=exif)
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_vectorized_tta_matches_pil(inference, seed):
+    data = upload(seed)
+    vectorized = to_levels(inference, inference.prepare_batch(data))
+    reference = to_levels(inference, inference.prepare_batch_pil(data))
+    
+    assert vectorized.shape == reference.shape == (5, inference.img_size, inference.img_size, 3)
+    difference = np.abs(vectorized - reference).max(axis=(1, 2, 3))
+    
+    # Pure pixel moves and the brightness multiply are exact
+    for variant in (ORIGINAL, FLIP, BRIGHTNESS):
+        assert difference[variant] == 0, f"variant {variant} differs by {difference[variant]}"
+    # Interpolation: PIL works in fixed point, so allow one level
+    for variant in (ROTATE, ZOOM):
+        assert difference[variant] <= 1, f"variant {variant} differs by {difference[variant]}"
+
+
+def test_vectorized_tta_feeds_the_same_logits(inference):
+    data = upload(3)
+    vectorized = inference.run_batch(inference.prepare_batch(data))
+    reference = inference.run_batch(inference.prepare_batch_pil(data))
+    np.testing.assert_allclose(vectorized, reference, atol=0.05)
@@ -1,7 +1,7 @@
 import { useState, useEffect, useRef, useCallback, useMemo, memo } from 'react'
 import { MapContainer, TileLayer, Circle, Popup, useMap, Rectangle } from 'react-leaflet'
 import { motion, AnimatePresence } from 'framer-motion'
-import { getLocationHistory } from '../services/api'
+import { getLocationHistory, getRiskHeatmap } from '../services/api'
 import { useStore } from '../store/useStore'
 import { useLanguage } from '../i18n'
 import 'leaflet/dist/leaflet.css'
@@ -36,6 +36,14 @@ const getRiskColor = (risk) => {
   return RISK_COLORS.low
 }
 
+// Heatmap cells carry the backend's level, so colour by that rather than re-deriving it from the score
+const LEVEL_COLORS = {
+  CRITICAL: RISK_COLORS.critical,
+  HIGH: RISK_COLORS.high,
+  MODERATE: RISK_COLORS.medium,
+  LOW: RISK_COLORS.low
+}
+
 // Generate realistic clustered demo data (diseases spread in patches)
 const generateDemoData = (lat, lng) => {
   const data = []
@@ -155,6 +163,23 @@ function DroneView() {
     if (location) loadInfectionData()
   }, [location, loadInfectionData])
   
+  // Regional weather risk around the field
+  const [heatmap, setHeatmap] = useState([])
+  
+  useEffect(() => {
+    if (!location) return
+    let cancelled = false
+    getRiskHeatmap(
+      location.latitude - 0.05,
+      location.longitude - 0.05,
+      location.latitude + 0.05,
+      location.longitude + 0.05
+    ).then(data => {
+      if (!cancelled && data) setHeatmap(data.cells.filter(cell => cell.risk))
+    })
+    return () => { cancelled = true }
+  }, [location])
+  
   const [scanProgress, setScanProgress] = useState(0)
   const [scanBounds, setScanBounds] = useState(null)
   const [revealedPoints, setRevealedPoints] = useState([])
@@ -322,6 +347,32 @@ function DroneView() {
               url="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}"
               attribution="ESRI"
             />
+            {/* Weather risk heatmap */}
+            {heatmap.map(cell => (
+              <Rectangle
+                key={cell.geohash}
+                bounds={[
+                  [cell.bounds.south, cell.bounds.west],
+                  [cell.bounds.north, cell.bounds.east]
+                ]}
+                pathOptions={{
+                  color: LEVEL_COLORS[cell.top_level],
+                  fillColor: LEVEL_COLORS[cell.top_level],
+                  fillOpacity: 0.15,
+                  weight: 0
+                }}
+              >
+                <Popup>
+                  <div className="text-black text-sm p-1">
+                    <strong className="capitalize">{cell.top_disease.replace(/_/g, ' ')}</strong>
+                    <br />
+                    <span className="text-gray-600">Favourable weather: {cell.top_level.toLowerCase()} ({(cell.top_risk * 100).toFixed(0)}%)</span>
+                    <br />
+                    <span className="text-gray-600">{cell.weather.temperature}°C, {cell.weather.humidity}% humidity</span>
+                  </div>
+                </Popup>
+              </Rectangle>
+            ))}
             {/* Scanning animation overlay */}
             {analysisRunning && scanBounds && (
               <ScanningOverlay bounds={scanBounds} progress={scanProgress} />
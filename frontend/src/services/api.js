@@ -213,6 +213,16 @@ export const getLocationHistory = async (latitude, longitude) => {
   }
 }
 
+// Weather-driven disease risk per grid cell over a map area
+export const getRiskHeatmap = async (south, west, north, east) => {
+  try {
+    const response = await api.get('/risk/heatmap', { params: { south, west, north, east } })
+    return response.data
+  } catch (err) {
+    return null
+  }
+}
+
 export const getRemedy = async (disease) => {
   try {
     const response = await api.get(`/remedies/${encodeURIComponent(disease)}`)
@@ -0,0 +1,433 @@
+"""
+AgroSentinel Student Distillation
+Trains a small, CPU-fast student (MobileNetV3 / EfficientNet-B0) on the soft
+targets of the calibrated EfficientNet-B3 teacher, exports it with the same
+ONNX conventions as export_onnx_v2.py and calibrates the confidence/margin
+thresholds the backend cascade uses to decide when to escalate to the teacher.
+
+Run after train_model_v2.py (needs agrosentinel_best_v2.pth and
+training_config_v2.json). Output goes to models/student/, a self-contained
+model directory the backend loads via CASCADE_STUDENT_MODEL=models/student.
+"""
+import time
+import torch
+import torch.nn as nn
+import torch.optim as optim
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from torchvision import transforms, datasets, models
+from pathlib import Path
+import json
+import numpy as np
+from tqdm import tqdm
+
+from export_onnx_v2 import (
+    ExportConfig, CalibratedModel, IMAGENET_MEAN, IMAGENET_STD,
+    create_model as create_teacher, export_graph, with_input_format
+)
+
+
+DATASET_DIR = Path("datasets/agrosentinel")
+MODEL_DIR = Path("models")
+STUDENT_DIR = MODEL_DIR / "student"
+
+DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+class DistillConfig:
+    student_name = "mobilenet_v3_large"  # or "mobilenet_v3_small", "efficientnet_b0"
+    img_size = 224  # Student input; the teacher sees the same crop at its own size
+    batch_size = 48
+    epochs = 30
+    lr = 0.001
+    weight_decay = 1e-4
+    num_workers = 0
+    patience = 6
+    distill_temperature = 4.0  # Softens teacher targets so "dark knowledge" survives
+    distill_alpha = 0.7  # Weight of the soft-target loss vs the hard-label loss
+    label_smoothing = 0.1
+    # Cascade calibration: student answers are only kept where they are at
+    # least this accurate on val; everything else escalates to the teacher
+    cascade_target_accuracy = 99.5
+    latency_budget_ms = 20.0  # Single-core, batch-1 target
+    latency_runs = 100
+
+
+def get_transforms(teacher_size):
+    """Training crops at the teacher's size (resized down for the student)"""
+    train_transform = transforms.Compose([
+        transforms.RandomResizedCrop(teacher_size, scale=(0.7, 1.0)),
+        transforms.RandomHorizontalFlip(p=0.5),
+        transforms.RandomVerticalFlip(p=0.3),
+        transforms.RandomRotation(45),
+        transforms.ColorJitter(brightness=0.4, contrast=0.4, saturation=0.4, hue=0.15),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+    ])
+    
+    val_transform = transforms.Compose([
+        transforms.Resize(teacher_size + 20),
+        transforms.CenterCrop(teacher_size),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+    ])
+    
+    return train_transform, val_transform
+
+
+def to_student_size(images):
+    """Teacher-size batch -> student-size batch (antialiased, like the backend's LANCZOS resize)"""
+    if images.shape[-1] == DistillConfig.img_size:
+        return images
+    return F.interpolate(
+        images, size=(DistillConfig.img_size, DistillConfig.img_size),
+        mode='bilinear', align_corners=False, antialias=True
+    )
+
+
+def create_student(num_classes):
+    """Small ImageNet-pretrained backbone with a fresh classifier head"""
+    if DistillConfig.student_name == "mobilenet_v3_large":
+        model = models.mobilenet_v3_large(weights=models.MobileNet_V3_Large_Weights.IMAGENET1K_V2)
+        model.classifier[3] = nn.Linear(model.classifier[3].in_features, num_classes)
+    elif DistillConfig.student_name == "mobilenet_v3_small":
+        model = models.mobilenet_v3_small(weights=models.MobileNet_V3_Small_Weights.IMAGENET1K_V1)
+        model.classifier[3] = nn.Linear(model.classifier[3].in_features, num_classes)
+    elif DistillConfig.student_name == "efficientnet_b0":
+        model = models.efficientnet_b0(weights=models.EfficientNet_B0_Weights.IMAGENET1K_V1)
+        model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+    else:
+        raise ValueError(f"Unknown student model '{DistillConfig.student_name}'")
+    
+    return model.to(DEVICE)
+
+
+def load_teacher(num_classes, temperature):
+    """Calibrated EfficientNet-B3 teacher (logits already divided by optimal_temperature)"""
+    checkpoint = torch.load(MODEL_DIR / "agrosentinel_best_v2.pth", map_location='cpu')
+    teacher = create_teacher(num_classes)
+    teacher.load_state_dict(checkpoint['model_state_dict'])
+    teacher = CalibratedModel(teacher, temperature).to(DEVICE)
+    teacher.eval()
+    for param in teacher.parameters():
+        param.requires_grad = False
+    return teacher
+
+
+class DistillationLoss(nn.Module):
+    """Hinton KD: T^2-scaled KL to the softened teacher plus smoothed CE on labels"""
+    def __init__(self, temperature=4.0, alpha=0.7, smoothing=0.1):
+        super().__init__()
+        self.temperature = temperature
+        self.alpha = alpha
+        self.smoothing = smoothing
+    
+    def forward(self, student_logits, teacher_logits, target):
+        t = self.temperature
+        soft_loss = F.kl_div(
+            F.log_softmax(student_logits / t, dim=-1),
+            F.softmax(teacher_logits / t, dim=-1),
+            reduction='batchmean'
+        ) * (t * t)
+        hard_loss = F.cross_entropy(student_logits, target, label_smoothing=self.smoothing)
+        return self.alpha * soft_loss + (1 - self.alpha) * hard_loss
+
+
+def train_epoch(student, teacher, loader, criterion, optimizer, scaler):
+    student.train()
+    running_loss = 0.0
+    correct = 0
+    total = 0
+    
+    pbar = tqdm(loader, desc="Distilling")
+    for images, labels in pbar:
+        images, labels = images.to(DEVICE), labels.to(DEVICE)
+        
+        optimizer.zero_grad()
+        
+        with torch.cuda.amp.autocast():
+            with torch.no_grad():
+                teacher_logits = teacher(images)
+            student_logits = student(to_student_size(images))
+            loss = criterion(student_logits.float(), teacher_logits.float(), labels)
+        
+        scaler.scale(loss).backward()
+        scaler.step(optimizer)
+        scaler.update()
+        
+        running_loss += loss.item()
+        total += labels.size(0)
+        correct += student_logits.argmax(1).eq(labels).sum().item()
+        
+        pbar.set_postfix({
+            'loss': f'{running_loss/len(pbar):.4f}',
+            'acc': f'{100.*correct/total:.2f}%'
+        })
+    
+    return running_loss / len(loader), 100. * correct / total
+
+
+def collect_logits(student, teacher, loader):
+    """Student and teacher logits plus labels for the whole val split"""
+    student.eval()
+    student_logits, teacher_logits, all_labels = [], [], []
+    
+    with torch.no_grad():
+        for images, labels in tqdm(loader, desc="Validating"):
+            images = images.to(DEVICE)
+            teacher_logits.append(teacher(images).float().cpu())
+            student_logits.append(student(to_student_size(images)).float().cpu())
+            all_labels.append(labels)
+    
+    return torch.cat(student_logits), torch.cat(teacher_logits), torch.cat(all_labels)
+
+
+def calibrate_temperature(logits, labels, init_temp=1.5):
+    """Learn the student's own temperature so its confidences are comparable"""
+    temperature = nn.Parameter(torch.tensor(init_temp))
+    optimizer = optim.LBFGS([temperature], lr=0.01, max_iter=50)
+    
+    def eval_temp():
+        optimizer.zero_grad()
+        loss = F.cross_entropy(logits / temperature, labels)
+        loss.backward()
+        return loss
+    
+    optimizer.step(eval_temp)
+    
+    optimal_temp = temperature.item()
+    print(f"\n🌡️  Student temperature: {optimal_temp:.3f}")
+    return optimal_temp
+
+
+def calibrate_cascade(student_probs, teacher_preds, labels):
+    """
+    Pick the (confidence, margin) thresholds that escalate the fewest scans
+    while keeping the student's accepted answers at the target accuracy.
+    A scan is accepted only when both its top-1 confidence and top-1/top-2
+    margin reach their thresholds; CascadeInference.should_escalate sends
+    everything else to the teacher.
+    """
+    sorted_probs = np.sort(student_probs, axis=1)
+    top1 = sorted_probs[:, -1]
+    margin = top1 - sorted_probs[:, -2]
+    student_correct = student_probs.argmax(axis=1) == labels
+    teacher_correct = teacher_preds == labels
+    
+    best = None
+    for confidence in np.arange(0.50, 1.0, 0.01):
+        for margin_threshold in np.arange(0.30, 1.0, 0.02):
+            accepted = (top1 >= confidence) & (margin >= margin_threshold)
+            if not accepted.any():
+                continue
+            accepted_accuracy = student_correct[accepted].mean() * 100
+            if accepted_accuracy < DistillConfig.cascade_target_accuracy:
+                continue
+            escalation_rate = 1.0 - accepted.mean()
+            if best is None or escalation_rate < best['escalation_rate']:
+                cascade_correct = np.where(accepted, student_correct, teacher_correct)
+                best = {
+                    'confidence': round(float(confidence), 2),
+                    'margin': round(float(margin_threshold), 2),
+                    'escalation_rate': round(float(escalation_rate), 4),
+                    'accepted_accuracy': round(float(accepted_accuracy), 3),
+                    'cascade_accuracy': round(float(cascade_correct.mean() * 100), 3),
+                }
+    
+    if best is None:
+        # The student never reaches the target - escalate everything it isn't certain of
+        best = {'confidence': 0.99, 'margin': 0.99, 'escalation_rate': None,
+                'accepted_accuracy': None, 'cascade_accuracy': None}
+        print(f"⚠ Student never reaches {DistillConfig.cascade_target_accuracy}% accepted accuracy")
+    return best
+
+
+def measure_latency(onnx_path, dummy_input):
+    """Median single-core, batch-1 latency in milliseconds"""
+    import onnxruntime as ort
+    
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = 1
+    options.inter_op_num_threads = 1
+    session = ort.InferenceSession(str(onnx_path), sess_options=options, providers=['CPUExecutionProvider'])
+    feed = {session.get_inputs()[0].name: dummy_input}
+    
+    for _ in range(10):
+        session.run(None, feed)
+    timings = []
+    for _ in range(DistillConfig.latency_runs):
+        started = time.perf_counter()
+        session.run(None, feed)
+        timings.append((time.perf_counter() - started) * 1000)
+    return float(np.median(timings))
+
+
+def dummy_input_for(img_size):
+    """Batch-1 input in the ExportConfig input format"""
+    if ExportConfig.raw_input:
+        return np.zeros((1, img_size, img_size, 3), dtype=np.uint8)
+    return np.zeros((1, 3, img_size, img_size), dtype=np.float32)
+
+
+def main():
+    print("="*60)
+    print("AgroSentinel Student Distillation")
+    print("="*60)
+    
+    config_path = MODEL_DIR / "training_config_v2.json"
+    if not config_path.exists():
+        print("❌ Training config not found. Train the teacher first (train_model_v2.py).")
+        return
+    
+    with open(config_path) as f:
+        teacher_config = json.load(f)
+    
+    num_classes = teacher_config['num_classes']
+    class_names = teacher_config['class_names']
+    teacher_size = teacher_config['img_size']
+    teacher_temperature = teacher_config.get('optimal_temperature', 1.0)
+    
+    print(f"\n🎓 Teacher: {teacher_config['model']} @ {teacher_size}px, "
+          f"T={teacher_temperature:.3f}, val acc {teacher_config['best_val_acc']:.2f}%")
+    print(f"🧒 Student: {DistillConfig.student_name} @ {DistillConfig.img_size}px")
+    print(f"  Distillation T={DistillConfig.distill_temperature}, alpha={DistillConfig.distill_alpha}")
+    
+    train_transform, val_transform = get_transforms(teacher_size)
+    train_dataset = datasets.ImageFolder(DATASET_DIR / "train", transform=train_transform)
+    val_dataset = datasets.ImageFolder(DATASET_DIR / "val", transform=val_transform)
+    if train_dataset.classes != class_names:
+        print("❌ Dataset classes don't match the teacher's class_names")
+        return
+    
+    train_loader = DataLoader(
+        train_dataset,
+        batch_size=DistillConfig.batch_size,
+        shuffle=True,
+        num_workers=DistillConfig.num_workers,
+        pin_memory=True,
+        drop_last=True
+    )
+    val_loader = DataLoader(
+        val_dataset,
+        batch_size=DistillConfig.batch_size,
+        shuffle=False,
+        num_workers=DistillConfig.num_workers,
+        pin_memory=True
+    )
+    
+    teacher = load_teacher(num_classes, teacher_temperature)
+    student = create_student(num_classes)
+    print(f"  Student parameters: {sum(p.numel() for p in student.parameters()):,}")
+    
+    criterion = DistillationLoss(
+        DistillConfig.distill_temperature, DistillConfig.distill_alpha, DistillConfig.label_smoothing
+    )
+    optimizer = optim.AdamW(student.parameters(), lr=DistillConfig.lr, weight_decay=DistillConfig.weight_decay)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=DistillConfig.epochs, eta_min=1e-6)
+    scaler = torch.cuda.amp.GradScaler()
+    
+    STUDENT_DIR.mkdir(parents=True, exist_ok=True)
+    checkpoint_path = MODEL_DIR / "agrosentinel_student.pth"
+    best_val_acc = 0.0
+    epochs_without_improvement = 0
+    
+    print(f"\n🚀 Distilling for up to {DistillConfig.epochs} epochs...")
+    print("-" * 60)
+    for epoch in range(DistillConfig.epochs):
+        print(f"\nEpoch {epoch+1}/{DistillConfig.epochs}")
+        
+        train_loss, train_acc = train_epoch(student, teacher, train_loader, criterion, optimizer, scaler)
+        student_logits, _, labels = collect_logits(student, teacher, val_loader)
+        val_acc = (student_logits.argmax(1) == labels).float().mean().item() * 100
+        scheduler.step()
+        
+        print(f"  Train Loss: {train_loss:.4f} | Train Acc: {train_acc:.2f}%")
+        print(f"  Val Acc: {val_acc:.2f}%")
+        
+        if val_acc > best_val_acc:
+            best_val_acc = val_acc
+            epochs_without_improvement = 0
+            torch.save({
+                'epoch': epoch + 1,
+                'model_state_dict': student.state_dict(),
+                'val_acc': val_acc,
+                'student_name': DistillConfig.student_name,
+                'class_names': class_names
+            }, checkpoint_path)
+            print(f"  ✓ New best student saved! ({val_acc:.2f}%)")
+        else:
+            epochs_without_improvement += 1
+            if epochs_without_improvement >= DistillConfig.patience:
+                print(f"\n⚠️  Early stopping at epoch {epoch+1}")
+                break
+    
+    # Calibrate the best student and the cascade thresholds on val
+    student.load_state_dict(torch.load(checkpoint_path, map_location='cpu')['model_state_dict'])
+    student_logits, teacher_logits, labels = collect_logits(student, teacher, val_loader)
+    student_temperature = calibrate_temperature(student_logits, labels)
+    
+    student_probs = F.softmax(student_logits / student_temperature, dim=1).numpy()
+    teacher_preds = teacher_logits.argmax(1).numpy()
+    labels = labels.numpy()
+    teacher_acc = float((teacher_preds == labels).mean() * 100)
+    cascade = calibrate_cascade(student_probs, teacher_preds, labels)
+    
+    # Export with the same conventions as the teacher
+    student.eval()
+    student = CalibratedModel(student.cpu(), student_temperature)
+    onnx_path = STUDENT_DIR / "agrosentinel_student.onnx"
+    if ExportConfig.raw_input:
+        dummy = torch.randint(0, 256, (1, DistillConfig.img_size, DistillConfig.img_size, 3), dtype=torch.uint8)
+        input_format = 'uint8_nhwc'
+    else:
+        dummy = torch.randn(1, 3, DistillConfig.img_size, DistillConfig.img_size)
+        input_format = 'float_nchw'
+    
+    print(f"\nExporting student to ONNX...")
+    export_graph(with_input_format(student), dummy, onnx_path)
+    
+    # Accuracy vs single-core latency
+    student_latency = measure_latency(onnx_path, dummy_input_for(DistillConfig.img_size))
+    teacher_onnx = MODEL_DIR / "agrosentinel_model_v2.onnx"
+    teacher_latency = measure_latency(teacher_onnx, dummy_input_for(teacher_size)) if teacher_onnx.exists() else None
+    
+    print("\n" + "="*60)
+    print("Accuracy vs CPU latency (1 thread, batch 1, median)")
+    print("="*60)
+    print(f"  {'Model':<28}{'Val acc':>10}{'Latency':>12}")
+    teacher_latency_text = f"{teacher_latency:.1f} ms" if teacher_latency else "n/a"
+    print(f"  {'Teacher ' + teacher_config['model']:<28}{teacher_acc:>9.2f}%{teacher_latency_text:>12}")
+    print(f"  {'Student ' + DistillConfig.student_name:<28}{best_val_acc:>9.2f}%{student_latency:>9.1f} ms")
+    if cascade['cascade_accuracy'] is not None:
+        print(f"  {'Cascade':<28}{cascade['cascade_accuracy']:>9.2f}%"
+              f"   escalates {cascade['escalation_rate'] * 100:.1f}% "
+              f"(conf < {cascade['confidence']}, margin < {cascade['margin']})")
+    if student_latency > DistillConfig.latency_budget_ms:
+        print(f"⚠ Student exceeds the {DistillConfig.latency_budget_ms} ms single-core budget")
+    else:
+        print(f"✓ Student within the {DistillConfig.latency_budget_ms} ms single-core budget")
+    
+    # Self-contained model directory for the backend (CASCADE_STUDENT_MODEL)
+    inference_config = {
+        'model_file': onnx_path.name,
+        'model_version': f"student-{DistillConfig.student_name}-{int(time.time())}",
+        'img_size': DistillConfig.img_size,
+        'num_classes': num_classes,
+        'temperature': student_temperature,
+        'input_format': input_format,
+        'class_names': class_names,
+        'cascade': cascade,
+        'latency_ms': round(student_latency, 2),
+        'val_acc': round(best_val_acc, 3),
+    }
+    with open(STUDENT_DIR / "inference_config.json", "w") as f:
+        json.dump(inference_config, f, indent=2)
+    with open(STUDENT_DIR / "class_names.json", "w") as f:
+        json.dump(class_names, f, indent=2)
+    
+    print(f"\n✓ Student exported: {onnx_path}")
+    print(f"  Config saved: {STUDENT_DIR / 'inference_config.json'}")
+
+
+if __name__ == "__main__":
+    main()
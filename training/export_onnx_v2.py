@@ -1,14 +1,50 @@
 """
 Export improved model to ONNX with temperature scaling
+Optionally also builds INT8 (static quantization) and FP16 variants and only
+publishes those that stay within an accuracy budget of the FP32 model
 """
 import torch
 import torch.nn as nn
-from torchvision import models
+from torch.utils.data import DataLoader, Subset
+from torchvision import models, transforms, datasets
 from pathlib import Path
 import json
+import sys
+import numpy as np
 
 
 MODEL_DIR = Path("models")
+DATASET_DIR = Path("datasets/agrosentinel")
+# The in-graph TTA reuses the serving code's sampling maps and is checked against it
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+
+class ExportConfig:
+    quantize_int8 = True  # Static INT8 quantization calibrated on the val split
+    export_fp16 = False  # FP16 mainly pays off on GPU; needs onnxconverter-common
+    calibration_samples = 300  # Val images used to calibrate activation ranges
+    max_accuracy_drop = 1.0  # Max top-1 accuracy loss vs FP32 (percentage points)
+    eval_batch_size = 32
+    # Take raw uint8 NHWC pixels and do cast/scale/normalize/transpose in-graph
+    raw_input = False
+    # Also export a "TTA model" that builds the augmentations in-graph and
+    # returns averaged logits; serve_tta_model makes the backend load it
+    tta_in_graph = False
+    serve_tta_model = False
+    tta_parity_samples = 32  # Val images compared against the backend's TTA
+    tta_parity_tolerance = 0.01  # Max difference of any class probability
+
+
+# Must match the TTA used by backend/app/services/inference.py
+TTA_ROTATION = -10
+TTA_FILL = 128
+TTA_BRIGHTNESS = 1.1
+TTA_ZOOM = 0.9
+TTA_VARIANTS = 5
+
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
 
 
 class CalibratedModel(nn.Module):
@@ -24,6 +60,127 @@ class CalibratedModel(nn.Module):
         return logits / self.temperature
 
 
+class RawInputModel(nn.Module):
+    """
+    Wrapper that accepts uint8 [N,H,W,3] images and does the uint8->float cast,
+    /255, mean/std normalization and NHWC->NCHW transpose inside the graph
+    """
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+        mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+        # x / 255 / std - mean / std folded into one multiply-add
+        self.register_buffer('scale', 1.0 / (255.0 * std))
+        self.register_buffer('bias', mean / std)
+    
+    def forward(self, x):
+        x = x.permute(0, 3, 1, 2).float()
+        return self.model(x * self.scale - self.bias)
+
+
+def backend_inference():
+    """The backend's inference module (app.services.inference)"""
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+    from app.services import inference
+    return inference
+
+
+class TTAModel(nn.Module):
+    """
+    Wrapper that runs test-time augmentation inside the graph.
+    
+    Takes normalized [N,3,H,W] images, builds the original, horizontal flip,
+    -10 degree rotation (grey fill), 1.1x brightness and 90% center zoom
+    variants, scores all 5N images in one pass and returns the logits
+    averaged per input image, shape [N,num_classes].
+    
+    The variants are built exactly like EfficientNetInference.get_tta_batch:
+    on 8-bit pixel levels, with the backend's own sampling maps (the bilinear
+    gather of _rotation_map and the LANCZOS matrix of _resample_matrix) and
+    the same rounding and clipping, so they agree up to float rounding.
+    """
+    def __init__(self, model, img_size):
+        super().__init__()
+        self.model = model
+        self.img_size = img_size
+        
+        std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+        mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+        # Pixel levels <-> model input, as the backend's to_model_input
+        self.register_buffer('scale', 1.0 / (255.0 * std))
+        self.register_buffer('bias', mean / std)
+        
+        inference = backend_inference()
+        
+        # Flat pixel indices of the 4 bilinear taps and their weights per output pixel
+        i00, i01, i10, i11, wy, wx, outside = inference._rotation_map(img_size, TTA_ROTATION)
+        self.register_buffer('rotation_index', torch.from_numpy(np.stack([i00, i01, i10, i11]).astype(np.int64)))
+        self.register_buffer('rotation_wx', torch.from_numpy(wx.reshape(1, 1, -1)))
+        self.register_buffer('rotation_wy', torch.from_numpy(wy.reshape(1, 1, -1)))
+        self.register_buffer('rotation_outside', torch.from_numpy(outside.reshape(1, 1, -1)))
+        
+        crop_size = int(img_size * TTA_ZOOM)
+        self.crop_start = (img_size - crop_size) // 2
+        self.crop_size = crop_size
+        zoom_matrix = inference._resample_matrix(crop_size, img_size).astype(np.float32)
+        self.register_buffer('zoom_matrix', torch.from_numpy(zoom_matrix))
+    
+    def forward(self, x):
+        n = x.shape[0]
+        
+        flipped = torch.flip(x, dims=[3])
+        
+        # Back to the 8-bit levels the backend augments
+        levels = torch.round((x + self.bias) / self.scale)
+        
+        # Bilinear gather, grey outside the source, truncated to 8 bits
+        flat = levels.flatten(2)
+        p00, p01, p10, p11 = (flat.index_select(2, index) for index in self.rotation_index.unbind(0))
+        top = p00 + (p01 - p00) * self.rotation_wx
+        bottom = p10 + (p11 - p10) * self.rotation_wx
+        rotated = torch.floor(torch.clamp(top + (bottom - top) * self.rotation_wy, 0.0, 255.0))
+        rotated = torch.where(self.rotation_outside, torch.full_like(rotated, TTA_FILL), rotated).view_as(x)
+        
+        brighter = torch.floor(torch.clamp(levels * TTA_BRIGHTNESS, 0.0, 255.0))
+        
+        # Separable LANCZOS, horizontal pass first, rounded to 8 bits after each pass
+        start, end = self.crop_start, self.crop_start + self.crop_size
+        columns = torch.clamp(torch.floor(levels[:, :, start:end, start:end] @ self.zoom_matrix.t() + 0.5), 0.0, 255.0)
+        zoomed = torch.floor(torch.clamp(self.zoom_matrix @ columns + 0.5, 0.0, 255.0))
+        
+        augmented = torch.cat([rotated, brighter, zoomed], dim=0) * self.scale - self.bias
+        batch = torch.cat([x, flipped, augmented], dim=0)
+        logits = self.model(batch)
+        return logits.view(TTA_VARIANTS, n, -1).mean(dim=0)
+
+
+def check_tta_parity(fp32_path, tta_path, img_size, input_format):
+    """
+    Compare the in-graph TTA model with the backend's TTA (prepare_batch on the
+    FP32 model, logits averaged) on val images. Returns the largest difference
+    of any class probability, or None if a top-1 prediction differs.
+    """
+    inference = backend_inference()
+    config = {'img_size': img_size, 'input_format': input_format}
+    backend = inference.EfficientNetInference(str(fp32_path), tta_mode='full', inference_config=config)
+    graph = inference.EfficientNetInference(str(tta_path), inference_config=config)
+    
+    samples = datasets.ImageFolder(DATASET_DIR / "val").samples
+    indices = np.linspace(0, len(samples) - 1, min(ExportConfig.tta_parity_samples, len(samples))).astype(int)
+    
+    max_difference = 0.0
+    for index in indices:
+        image_bytes = Path(samples[index][0]).read_bytes()
+        expected = inference._softmax(backend.run_batch(backend.prepare_batch(image_bytes)).mean(axis=0))
+        actual = inference._softmax(graph.run_batch(graph.prepare_batch(image_bytes))[0])
+        if np.argmax(expected) != np.argmax(actual):
+            return None
+        max_difference = max(max_difference, float(np.abs(expected - actual).max()))
+    return max_difference
+
+
 def create_model(num_classes):
     """Recreate model architecture"""
     model = models.efficientnet_b3(weights=None)
@@ -38,6 +195,201 @@ def create_model(num_classes):
     return model
 
 
+def get_val_loader(img_size, batch_size, max_samples=None):
+    """Validation split with the same transform used during training"""
+    if ExportConfig.raw_input:
+        # uint8 pixels; normalization happens inside the exported graph
+        to_tensor = [transforms.PILToTensor()]
+    else:
+        to_tensor = [
+            transforms.ToTensor(),
+            transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+        ]
+    val_transform = transforms.Compose([
+        transforms.Resize(img_size + 20),
+        transforms.CenterCrop(img_size),
+        *to_tensor,
+    ])
+    val_dataset = datasets.ImageFolder(DATASET_DIR / "val", transform=val_transform)
+    
+    if max_samples and max_samples < len(val_dataset):
+        # Evenly spaced sample so every class is represented
+        indices = np.linspace(0, len(val_dataset) - 1, max_samples).astype(int)
+        val_dataset = Subset(val_dataset, indices.tolist())
+    
+    return DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=0)
+
+
+def to_model_input(images):
+    """Loader batch -> numpy array in the exported model's input layout"""
+    if ExportConfig.raw_input:
+        return np.ascontiguousarray(images.permute(0, 2, 3, 1).numpy())
+    return images.numpy()
+
+
+def evaluate_onnx(onnx_path, val_loader):
+    """Top-1 predictions and labels for an ONNX model on the val split"""
+    import onnxruntime as ort
+    
+    session = ort.InferenceSession(str(onnx_path), providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    
+    all_preds = []
+    all_labels = []
+    for images, labels in val_loader:
+        logits = session.run(None, {input_name: to_model_input(images)})[0]
+        all_preds.extend(np.argmax(logits, axis=1))
+        all_labels.extend(labels.numpy())
+    
+    return np.array(all_preds), np.array(all_labels)
+
+
+def quantize_int8(fp32_path, int8_path, img_size):
+    """Static INT8 quantization (QDQ, per-channel weights) calibrated on val images"""
+    from onnxruntime.quantization import (
+        CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    
+    class ValCalibrationReader(CalibrationDataReader):
+        def __init__(self, loader, input_name):
+            self.batches = iter(loader)
+            self.input_name = input_name
+        
+        def get_next(self):
+            batch = next(self.batches, None)
+            if batch is None:
+                return None
+            return {self.input_name: to_model_input(batch[0])}
+    
+    # Shape inference + graph cleanup makes quantization much more reliable
+    preprocessed_path = int8_path.with_suffix(".pre.onnx")
+    quant_pre_process(str(fp32_path), str(preprocessed_path))
+    
+    calib_loader = get_val_loader(img_size, 8, max_samples=ExportConfig.calibration_samples)
+    quantize_static(
+        str(preprocessed_path),
+        str(int8_path),
+        ValCalibrationReader(calib_loader, 'input'),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        weight_type=QuantType.QInt8,
+        activation_type=QuantType.QUInt8,
+    )
+    preprocessed_path.unlink(missing_ok=True)
+
+
+def convert_fp16(fp32_path, fp16_path):
+    """FP16 weights/activations, keeping float32 inputs and outputs"""
+    import onnx
+    from onnxconverter_common import float16
+    
+    model = onnx.load(fp32_path)
+    model_fp16 = float16.convert_float_to_float16(model, keep_io_types=True)
+    onnx.save(model_fp16, fp16_path)
+
+
+def build_variants(fp32_path, img_size):
+    """
+    Build the optional reduced-precision variants, check them against FP32 on
+    the val split and return metrics for every variant that passes the gate
+    """
+    if not (ExportConfig.quantize_int8 or ExportConfig.export_fp16):
+        return {}
+    
+    print(f"\nEvaluating FP32 reference on validation split...")
+    val_loader = get_val_loader(img_size, ExportConfig.eval_batch_size)
+    fp32_preds, labels = evaluate_onnx(fp32_path, val_loader)
+    fp32_acc = float((fp32_preds == labels).mean() * 100)
+    
+    variants = {
+        'fp32': {
+            'file': fp32_path.name,
+            'size_mb': round(fp32_path.stat().st_size / (1024 * 1024), 2),
+            'accuracy': round(fp32_acc, 3),
+            'agreement': 100.0,
+        }
+    }
+    print(f"  FP32 accuracy: {fp32_acc:.2f}%")
+    
+    builders = []
+    if ExportConfig.quantize_int8:
+        builders.append(('int8', lambda path: quantize_int8(fp32_path, path, img_size)))
+    if ExportConfig.export_fp16:
+        builders.append(('fp16', lambda path: convert_fp16(fp32_path, path)))
+    
+    for name, build in builders:
+        variant_path = fp32_path.with_name(f"{fp32_path.stem}_{name}.onnx")
+        print(f"\nBuilding {name.upper()} variant...")
+        try:
+            build(variant_path)
+        except Exception as e:
+            print(f"❌ {name.upper()} export failed: {e}")
+            continue
+        
+        preds, _ = evaluate_onnx(variant_path, val_loader)
+        accuracy = float((preds == labels).mean() * 100)
+        agreement = float((preds == fp32_preds).mean() * 100)
+        size_mb = variant_path.stat().st_size / (1024 * 1024)
+        drop = fp32_acc - accuracy
+        
+        print(f"  Size: {size_mb:.2f} MB")
+        print(f"  Accuracy: {accuracy:.2f}% (drop {drop:+.2f} pts)")
+        print(f"  Top-1 agreement with FP32: {agreement:.2f}%")
+        
+        if drop > ExportConfig.max_accuracy_drop:
+            print(f"❌ {name.upper()} rejected: accuracy drop exceeds {ExportConfig.max_accuracy_drop} pts")
+            variant_path.unlink(missing_ok=True)
+            continue
+        
+        variants[name] = {
+            'file': variant_path.name,
+            'size_mb': round(size_mb, 2),
+            'accuracy': round(accuracy, 3),
+            'agreement': round(agreement, 3),
+        }
+        print(f"✓ {name.upper()} variant published: {variant_path}")
+    
+    return variants
+
+
+def with_input_format(model):
+    """Wrap a model for raw uint8 NHWC input when ExportConfig.raw_input is set"""
+    if ExportConfig.raw_input:
+        model = RawInputModel(model)
+    model.eval()
+    return model
+
+
+def export_graph(model, dummy_input, onnx_path, opset_version=14, metadata=None):
+    """Export with a dynamic batch axis, attach metadata and verify the graph"""
+    import onnx
+    
+    torch.onnx.export(
+        model,
+        dummy_input,
+        onnx_path,
+        export_params=True,
+        opset_version=opset_version,
+        do_constant_folding=True,
+        input_names=['input'],
+        output_names=['output'],
+        dynamic_axes={
+            'input': {0: 'batch_size'},
+            'output': {0: 'batch_size'}
+        }
+    )
+    
+    # Verify
+    onnx_model = onnx.load(onnx_path)
+    if metadata:
+        for key, value in metadata.items():
+            entry = onnx_model.metadata_props.add()
+            entry.key, entry.value = key, value
+        onnx.save(onnx_model, onnx_path)
+    onnx.checker.check_model(onnx_model)
+
+
 def main():
     # Load config
     config_path = MODEL_DIR / "training_config_v2.json"
@@ -69,44 +421,66 @@ def main():
     calibrated_model = CalibratedModel(model, temperature)
     calibrated_model.eval()
     
+    if ExportConfig.raw_input:
+        # Fold preprocessing into the graph: input is uint8 [N,H,W,3]
+        dummy_input = torch.randint(0, 256, (1, img_size, img_size, 3), dtype=torch.uint8)
+        input_format = 'uint8_nhwc'
+    else:
+        dummy_input = torch.randn(1, 3, img_size, img_size)
+        input_format = 'float_nchw'
+    
     # Export to ONNX
-    dummy_input = torch.randn(1, 3, img_size, img_size)
     onnx_path = MODEL_DIR / "agrosentinel_model_v2.onnx"
     
     print(f"\nExporting to ONNX...")
-    torch.onnx.export(
-        calibrated_model,
-        dummy_input,
-        onnx_path,
-        export_params=True,
-        opset_version=14,
-        do_constant_folding=True,
-        input_names=['input'],
-        output_names=['output'],
-        dynamic_axes={
-            'input': {0: 'batch_size'},
-            'output': {0: 'batch_size'}
-        }
-    )
-    
-    # Verify
-    import onnx
-    onnx_model = onnx.load(onnx_path)
-    onnx.checker.check_model(onnx_model)
+    export_graph(with_input_format(calibrated_model), dummy_input, onnx_path)
     
     file_size = onnx_path.stat().st_size / (1024 * 1024)
     print(f"\n✓ Model exported: {onnx_path}")
     print(f"  Size: {file_size:.2f} MB")
     print(f"  Validation accuracy: {config['best_val_acc']:.2f}%")
     print(f"  Temperature calibration: {temperature:.3f}")
+    print(f"  Input format: {input_format}")
+    
+    # Reduced-precision variants, gated on val accuracy
+    variants = build_variants(onnx_path, img_size)
+    
+    # In-graph TTA model, published only if it agrees with the backend's TTA
+    tta_path = None
+    if ExportConfig.tta_in_graph:
+        tta_path = MODEL_DIR / "agrosentinel_model_v2_tta.onnx"
+        print(f"\nExporting TTA model...")
+        tta_model = with_input_format(TTAModel(calibrated_model, img_size))
+        export_graph(tta_model, dummy_input, tta_path,
+                     metadata={'tta_variants': str(TTA_VARIANTS)})
+        print(f"  Size: {tta_path.stat().st_size / (1024 * 1024):.2f} MB")
+        
+        difference = check_tta_parity(onnx_path, tta_path, img_size, input_format)
+        if difference is None or difference > ExportConfig.tta_parity_tolerance:
+            detail = "top-1 differs" if difference is None else f"probabilities differ by up to {difference:.4f}"
+            print(f"❌ TTA model rejected: {detail} from the backend's TTA")
+            tta_path.unlink(missing_ok=True)
+            tta_path = None
+        else:
+            print(f"✓ TTA model exported: {tta_path} (matches backend TTA within {difference:.4f})")
     
     # Save updated config for inference
     inference_config = {
         'img_size': img_size,
         'num_classes': num_classes,
         'temperature': temperature,
+        'input_format': input_format,
         'class_names': config['class_names']
     }
+    if variants:
+        # The backend picks one via the MODEL_VARIANT setting
+        inference_config['variants'] = variants
+    if tta_path:
+        inference_config['tta_model'] = {
+            'file': tta_path.name,
+            'variants': TTA_VARIANTS,
+        }
+        inference_config['use_tta_model'] = ExportConfig.serve_tta_model
     
     with open(MODEL_DIR / "inference_config.json", "w") as f:
         json.dump(inference_config, f, indent=2)